@@ -0,0 +1 @@
+"""オフラインのベンチマーク・負荷試験（ローカルの代役サーバーと記録済みページを使う）"""
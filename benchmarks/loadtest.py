@@ -0,0 +1,365 @@
+"""
+複数セッションの負荷試験（ローカルの代役サーバーに対して実行、ネットワーク不要）
+
+N個のセッション（1セッション1スレッド、Streamlitの1ユーザー分に相当）が、考える時間をはさみながら
+検索を繰り返す。キーワードはZipf分布で選ぶため、人気のタイトルは何度も検索され（キャッシュに当たる）、
+残りはロングテールになる。セッション数を段階的に増やし、どこから検索が遅くなるかを見る。
+
+検索の経路:
+    functions: check_status + check_tsutaya + fetch_book_info_google_books を並行に呼ぶ（デフォルト）
+    engine:    run_search（画面・APIと同じ。検索結果キャッシュ・制限時間あり）
+
+1秒ごとに処理件数・応答時間・スレッド数・メモリ（RSS）を表示し、段階ごとに
+スループット・p50/p95/p99・エラー率（サイト別）をまとめる。
+
+使い方（リポジトリのルートで）:
+    python -m benchmarks.loadtest --sessions 1,5,10,20 --duration 20
+    python -m benchmarks.loadtest --sessions 50 --path engine --latency 0.3 --error-rate 0.02 --json load.json
+"""
+
+import argparse
+import bisect
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+_WORK_DIR = tempfile.mkdtemp(prefix="book-load-")
+os.environ.setdefault("TSUTAYA_RESOLUTION_CACHE_PATH", os.path.join(_WORK_DIR, "tsutaya_resolution.json"))
+os.environ.setdefault("BOOK_SEARCH_BOOK_STORE_PATH", os.path.join(_WORK_DIR, "book_info.sqlite3"))
+
+from benchmarks.standin import StandInSites, parse_latency, scenario_keyword, use_standins  # noqa: E402
+from book_search_app import core  # noqa: E402
+
+# 失敗とみなす判定（サイトの応答がない・打ち切られた）
+FAILURE_STATUSES = ("エラー", "タイムアウト", "一時停止中")
+
+# キーワードのシナリオの割合（ヒット・0件・貸出中・メディアコスモスへの転送）
+SCENARIO_WEIGHTS = (("hit", 50), ("nohit", 30), ("on_loan", 15), ("mediacosmos", 5))
+
+# 検索の途中で劣化とみなす目安（最初の段階と比べたp99の倍率、エラー率）
+DEGRADED_P99_RATIO = 2.0
+DEGRADED_ERROR_RATE = 0.01
+
+
+# ============================================================================
+# キーワード分布
+# ============================================================================
+
+def build_vocabulary(size: int) -> List[str]:
+    """
+    人気順のキーワード一覧を作る（シナリオはSCENARIO_WEIGHTSの割合で順番に割り当てる）
+    
+    Args:
+        size: キーワード数
+    
+    Returns:
+        キーワードのリスト（先頭ほど人気）
+    """
+    cycle = [name for name, weight in SCENARIO_WEIGHTS for _ in range(weight)]
+    rng = random.Random(0)
+    rng.shuffle(cycle)
+    return [scenario_keyword(cycle[rank % len(cycle)], rank) for rank in range(size)]
+
+
+def zipf_picker(vocabulary: List[str], exponent: float) -> Callable[[random.Random], str]:
+    """
+    Zipf分布（順位rの重みが 1/r^exponent）でキーワードを選ぶ関数を作る
+    
+    Args:
+        vocabulary: 人気順のキーワード
+        exponent: 分布の偏り（大きいほど上位に集中する。1前後が一般的）
+    
+    Returns:
+        乱数生成器を受け取ってキーワードを返す関数
+    """
+    cumulative = []
+    total = 0.0
+    for rank in range(1, len(vocabulary) + 1):
+        total += 1.0 / rank ** exponent
+        cumulative.append(total)
+
+    def pick(rng: random.Random) -> str:
+        return vocabulary[min(len(vocabulary) - 1, bisect.bisect_left(cumulative, rng.random() * total))]
+
+    return pick
+
+
+# ============================================================================
+# 検索の経路
+# ============================================================================
+
+def search_functions(keyword: str) -> Dict[str, str]:
+    """check_status・check_tsutaya・fetch_book_info_google_books を並行に呼び、サイト -> 判定 を返す"""
+    tsutaya = core.submit_search_task(core.check_tsutaya, keyword)
+    book = core.submit_search_task(core.fetch_book_info_google_books, keyword)
+    statuses = {site: status["text"] for site, status in core.check_status(keyword).items()}
+    statuses["tsutaya"] = tsutaya.result()[0]["text"]
+    book.result()
+    return statuses
+
+
+def search_engine(keyword: str) -> Dict[str, str]:
+    """run_search（画面・APIと同じ経路）で検索し、サイト -> 判定 を返す"""
+    result = core.run_search(keyword)
+    return {site: data["status"] for site, data in result["sites"].items()}
+
+
+SEARCH_PATHS: Dict[str, Callable[[str], Dict[str, str]]] = {
+    "functions": search_functions,
+    "engine": search_engine,
+}
+
+
+# ============================================================================
+# 計測
+# ============================================================================
+
+def rss_mb() -> Optional[float]:
+    """現在のメモリ使用量（RSS, MB）。/procがない環境ではピーク値、取れなければNone"""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except (ImportError, OSError):
+        return None
+
+
+def _percentile(samples: List[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+
+class LoadStats:
+    """1段階分の計測値（スレッドセーフ）"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.failed_searches = 0
+        self.site_failures: Counter = Counter()
+        self.site_checks: Counter = Counter()
+        self._interval: List[float] = []
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, statuses: Optional[Dict[str, str]]) -> None:
+        """
+        検索1回の結果を記録する
+        
+        Args:
+            latency: 所要時間（秒）
+            statuses: サイト -> 判定（例外で失敗した場合はNone）
+        """
+        with self._lock:
+            self.latencies.append(latency)
+            self._interval.append(latency)
+            if statuses is None:
+                self.failed_searches += 1
+                self.site_failures["exception"] += 1
+                return
+            failed = [site for site, text in statuses.items() if text in FAILURE_STATUSES]
+            self.site_checks.update(statuses.keys())
+            self.site_failures.update(failed)
+            if failed:
+                self.failed_searches += 1
+
+    def drain_interval(self) -> List[float]:
+        """前回呼んでから記録された所要時間を返す"""
+        with self._lock:
+            interval, self._interval = self._interval, []
+            return interval
+
+
+def _session(
+    stop: threading.Event,
+    search: Callable[[str], Dict[str, str]],
+    pick: Callable[[random.Random], str],
+    think: float,
+    stats: LoadStats,
+    seed: int,
+) -> None:
+    """1セッション分: キーワードを選んで検索し、考える時間（指数分布）だけ待つ、を繰り返す"""
+    rng = random.Random(seed)
+    while not stop.is_set():
+        keyword = pick(rng)
+        started = time.perf_counter()
+        try:
+            statuses: Optional[Dict[str, str]] = search(keyword)
+        except Exception:
+            statuses = None
+        stats.record(time.perf_counter() - started, statuses)
+        if think > 0:
+            stop.wait(rng.expovariate(1.0 / think))
+
+
+def run_stage(
+    sessions: int,
+    duration: float,
+    search: Callable[[str], Dict[str, str]],
+    pick: Callable[[random.Random], str],
+    think: float,
+    interval: float = 1.0,
+    ramp: float = 0.0,
+) -> Dict[str, Any]:
+    """
+    セッション数を固定して一定時間負荷をかけ、結果をまとめる
+    
+    Args:
+        sessions: 同時セッション数
+        duration: 負荷をかける秒数（立ち上げ時間を含む）
+        search: 検索の経路
+        pick: キーワードを選ぶ関数
+        think: 検索の間に考える時間の平均（秒）
+        interval: 経過を表示する間隔（秒）
+        ramp: 全セッションを立ち上げるまでの秒数（均等にずらして開始する）
+    
+    Returns:
+        sessions / searches / throughput / p50_ms / p95_ms / p99_ms / error_rate / site_error_rates /
+        max_threads / peak_rss_mb / timeline を含む辞書
+    """
+    stats = LoadStats()
+    stop = threading.Event()
+    threads = []
+    started = time.perf_counter()
+    for i in range(sessions):
+        thread = threading.Thread(
+            target=_session, args=(stop, search, pick, think, stats, i), name=f"load-session-{i}", daemon=True
+        )
+        thread.start()
+        threads.append(thread)
+        if ramp > 0:
+            time.sleep(ramp / sessions)
+
+    timeline = []
+    while True:
+        remaining = duration - (time.perf_counter() - started)
+        time.sleep(max(0.0, min(interval, remaining)))
+        latencies = stats.drain_interval()
+        point = {
+            "t": round(time.perf_counter() - started, 1),
+            "searches_per_s": round(len(latencies) / interval, 2),
+            "p50_ms": _percentile(latencies, 0.50),
+            "p99_ms": _percentile(latencies, 0.99),
+            "threads": threading.active_count(),
+            "rss_mb": rss_mb(),
+        }
+        timeline.append(point)
+        print(
+            f"  [{sessions:>3} sessions] t={point['t']:>5}s  {point['searches_per_s']:>6}/s  "
+            f"p50={point['p50_ms']}ms  p99={point['p99_ms']}ms  threads={point['threads']}  rss={point['rss_mb']}MB",
+            file=sys.stderr,
+        )
+        if remaining <= interval:
+            break
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    searches = len(stats.latencies)
+    return {
+        "sessions": sessions,
+        "searches": searches,
+        "throughput": round(searches / elapsed, 2),
+        "p50_ms": _percentile(stats.latencies, 0.50),
+        "p95_ms": _percentile(stats.latencies, 0.95),
+        "p99_ms": _percentile(stats.latencies, 0.99),
+        "mean_ms": round(statistics.fmean(stats.latencies) * 1000, 1) if searches else None,
+        "error_rate": round(stats.failed_searches / searches, 4) if searches else 0.0,
+        "site_error_rates": {
+            site: round(stats.site_failures[site] / count, 4) for site, count in sorted(stats.site_checks.items())
+        },
+        "max_threads": max(point["threads"] for point in timeline),
+        "peak_rss_mb": max((point["rss_mb"] for point in timeline if point["rss_mb"] is not None), default=None),
+        "timeline": timeline,
+    }
+
+
+def is_degraded(stage: Dict[str, Any], first: Dict[str, Any]) -> bool:
+    """最初の段階と比べてp99が大きく伸びたか、エラー率が目安を超えたか"""
+    if stage["error_rate"] > DEGRADED_ERROR_RATE:
+        return True
+    return bool(first["p99_ms"] and stage["p99_ms"] and stage["p99_ms"] > first["p99_ms"] * DEGRADED_P99_RATIO)
+
+
+def print_summary(stages: List[Dict[str, Any]]) -> None:
+    """段階ごとの結果を表にする"""
+    print(f"{'sessions':>8} {'searches':>8} {'/s':>7} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'errors':>7} {'threads':>7} {'rssMB':>7}")
+    for stage in stages:
+        mark = "  ⚠️ 劣化" if is_degraded(stage, stages[0]) else ""
+        print(
+            f"{stage['sessions']:>8} {stage['searches']:>8} {stage['throughput']:>7} {stage['p50_ms']!s:>8} "
+            f"{stage['p95_ms']!s:>8} {stage['p99_ms']!s:>8} {stage['error_rate']:>7.2%} {stage['max_threads']:>7} "
+            f"{stage['peak_rss_mb']!s:>7}{mark}"
+        )
+        failing = {site: rate for site, rate in stage["site_error_rates"].items() if rate}
+        if failing:
+            print(f"{'':>8} サイト別エラー率: " + ", ".join(f"{site} {rate:.1%}" for site, rate in failing.items()))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.loadtest", description="複数セッションの負荷試験")
+    parser.add_argument("-s", "--sessions", default="1,5,10,20", help="同時セッション数（カンマ区切りで段階的に増やす。デフォルト: 1,5,10,20）")
+    parser.add_argument("-d", "--duration", type=float, default=20.0, help="1段階あたりの秒数（デフォルト: 20）")
+    parser.add_argument("--path", choices=sorted(SEARCH_PATHS), default="functions", help="検索の経路（デフォルト: functions）")
+    parser.add_argument("--think", type=float, default=1.0, help="検索の間に考える時間の平均（秒、デフォルト: 1）")
+    parser.add_argument("--ramp", type=float, default=2.0, help="各段階でセッションを立ち上げる秒数（デフォルト: 2）")
+    parser.add_argument("--vocabulary", type=int, default=2000, help="キーワードの種類数（デフォルト: 2000）")
+    parser.add_argument("--zipf", type=float, default=1.1, help="キーワード分布の偏り（デフォルト: 1.1）")
+    parser.add_argument("--latency", help="代役サーバーの応答遅延（秒）。全サイト共通の値か gifu=0.3,kani=0.5 の形式（デフォルト: 0.1）")
+    parser.add_argument("--jitter", type=float, default=0.5, help="遅延のばらつき（割合、デフォルト: 0.5）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="代役サーバーが503を返す割合（デフォルト: 0）")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="ホストごとの送信レート制限を本番と同じにする")
+    parser.add_argument("--json", help="結果（経過を含む）をJSONで書き出すファイル")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        session_counts = [int(n) for n in args.sessions.split(",") if n.strip()]
+    except ValueError:
+        raise SystemExit("--sessions は整数のカンマ区切りで指定してください")
+    latency = parse_latency(args.latency, 0.1)
+    pick = zipf_picker(build_vocabulary(args.vocabulary), args.zipf)
+    search = SEARCH_PATHS[args.path]
+
+    stages = []
+    with StandInSites(latency=latency, jitter=args.jitter, error_rate=args.error_rate) as standins:
+        use_standins(standins)
+        if args.keep_rate_limits:
+            for host in standins.host_overrides:
+                core.HOST_RATE_LIMITS.pop(host, None)
+        # 検索処理のログ（print）で経過表示が流れないよう、標準出力は捨てる
+        with contextlib.redirect_stdout(open(os.devnull, "w", encoding="utf-8")):
+            for sessions in session_counts:
+                stages.append(run_stage(sessions, args.duration, search, pick, args.think, ramp=args.ramp))
+        status_counts = standins.status_counts()
+
+    print_summary(stages)
+    print(f"代役サーバーの応答: {json.dumps(status_counts)}")
+    if args.json:
+        config = {key: getattr(args, key) for key in ("path", "duration", "think", "vocabulary", "zipf", "jitter", "error_rate")}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": {**config, "latency": latency}, "stages": stages}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+本番サイトのページを記録してベンチマーク用のfixturesを差し替える（ネットワークが必要）
+
+同梱のfixturesは各サイトの判定に使う表記を実際のページと同じ位置関係で含めて作ったもの。
+サイトの変更に追従したいときは、結果が分かっているキーワードでこのスクリプトを実行して記録し直す。
+
+使い方（リポジトリのルートで）:
+    python -m benchmarks.record gifu hit "ノルウェイの森"
+    python -m benchmarks.record kani on_loan "ノルウェイの森"
+    python -m benchmarks.record sanseido nohit "zzzzzzzz"
+    python -m benchmarks.record tsutaya stock_in "ノルウェイの森"   # search_hit / select / stock_in を記録
+    python -m benchmarks.record google_books found "ノルウェイの森"
+"""
+
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+from benchmarks.standin import FIXTURES_DIR
+from book_search_app import core
+
+
+def _save(site: str, name: str, body: bytes) -> None:
+    path = os.path.join(FIXTURES_DIR, site, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(body)
+    print(f"記録しました: {path} ({len(body)} bytes)")
+
+
+def _get(url: str, **kwargs: object) -> bytes:
+    session = core.open_http_session(url)
+    res = session.get(url, timeout=core.TIMEOUT_MEDIUM, **kwargs)
+    res.raise_for_status()
+    return res.content
+
+
+def record(site: str, case: str, keyword: str) -> None:
+    """
+    キーワードで検索したページを fixtures/<site>/<case>.html（Google Booksは.json）として保存する
+    
+    Args:
+        site: サイトキー（gifu / kani / sanseido / tsutaya / google_books）
+        case: 保存名（standin.SCENARIOSで使うページ名）
+        keyword: 検索キーワード
+    """
+    keyword = core.canonicalize_keyword(keyword)
+    if site == "google_books":
+        _save(site, f"{case}.json", _get(core.GOOGLE_BOOKS_API_URL, params=core.build_google_books_params(keyword), headers=core.GOOGLE_BOOKS_HEADERS))
+        return
+    if site == "tsutaya":
+        urls = core.build_tsutaya_urls(keyword, use_cache=False)
+        search = _get(urls["search_url"])
+        if not urls["work_id"] or not urls["product_key"]:
+            _save(site, "search_nohit.html", search)
+            return
+        work_id, product_key = urls["work_id"].encode(), urls["product_key"].encode()
+        # 代役サーバーがシナリオごとのIDを差し込めるよう、IDはプレースホルダーにする
+        _save(site, "search_hit.html", search.replace(work_id, b"{work_id}"))
+        select = _get("https://store-tsutaya.tsite.jp/search/result/select", params={"saleType": "sell", "workId": urls["work_id"], "itemType": "book"})
+        _save(site, "select.html", select.replace(work_id, b"{work_id}").replace(product_key, b"{product_key}"))
+        _save(site, f"{case}.html", _get(urls["stock_url"]))
+        return
+    if site in ("gifu", "kani"):
+        # OPACはセッションCookieが必要なので温めてから検索する
+        session = core.open_http_session(core.SITE_ADAPTERS[site].warmup_url)
+        session.get(core.SITE_ADAPTERS[site].warmup_url, timeout=core.SITE_ADAPTERS[site].timeout)
+        res = session.get(core.SITE_ADAPTERS[site].build_url(keyword), timeout=core.SITE_ADAPTERS[site].timeout)
+        _save(site, f"{case}.html", res.content)
+        return
+    if site in core.SITE_ADAPTERS:
+        _save(site, f"{case}.html", _get(core.SITE_ADAPTERS[site].build_url(keyword)))
+        return
+    raise SystemExit(f"不明なサイト: {site}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.record", description="ベンチマーク用のページを記録する")
+    parser.add_argument("site", help="サイトキー（gifu / kani / sanseido / tsutaya / google_books）")
+    parser.add_argument("case", help="保存名（hit / nohit / on_shelf / on_loan / in_stock / out_of_stock / stock_in / stock_out / found など）")
+    parser.add_argument("keyword", help="検索キーワード")
+    args = parser.parse_args(argv)
+    record(args.site, args.case, args.keyword)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
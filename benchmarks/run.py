@@ -0,0 +1,312 @@
+"""
+オフラインのベンチマーク（ネットワーク不要）
+
+ローカルの代役サーバー（standin.py）に記録済みのページを返させ、次を測る:
+
+- parse: サイト・ページごとの判定処理（本文の走査・文字コード判定・解析）のCPU時間
+- search: シナリオ（ヒット・0件・貸出中・メディアコスモスへの転送）ごとの検索全体の所要時間と、
+  最初の結果カードが出るまでの時間（画面と同じ start_search + iter_until_deadline の経路）
+- cached: 同じキーワードを2回目に検索したとき（検索結果キャッシュに当たる）の所要時間
+
+結果は保存済みのベースライン（baseline.json）と比べ、許容幅を超えて遅くなった項目があれば終了コード1を返す。
+
+使い方（リポジトリのルートで）:
+    python -m benchmarks.run
+    python -m benchmarks.run --iterations 50 --latency gifu=0.3,kani=0.5
+    python -m benchmarks.run --update-baseline
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 草叢BOOKSの商品特定キャッシュ・書誌情報の保存先は一時ファイルに置き、本番のキャッシュを汚さない（coreの読み込み前に設定する）
+_WORK_DIR = tempfile.mkdtemp(prefix="book-bench-")
+os.environ.setdefault("TSUTAYA_RESOLUTION_CACHE_PATH", os.path.join(_WORK_DIR, "tsutaya_resolution.json"))
+os.environ.setdefault("BOOK_SEARCH_BOOK_STORE_PATH", os.path.join(_WORK_DIR, "book_info.sqlite3"))
+
+import requests  # noqa: E402
+from requests.structures import CaseInsensitiveDict  # noqa: E402
+from requests.utils import get_encoding_from_headers  # noqa: E402
+
+from benchmarks.standin import (  # noqa: E402
+    SCENARIOS,
+    StandInSites,
+    load_fixture,
+    parse_latency,
+    scenario_keyword,
+    use_standins,
+)
+from book_search_app import core  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# ベースラインと比べるときの許容幅（相対）と、測定誤差として無視する差（単位ごと）
+DEFAULT_TOLERANCE = 0.25
+ABSOLUTE_SLACK = {"ms": 5.0, "us": 20.0}
+
+PARSE_ITERATIONS = 200
+
+
+# ============================================================================
+# 判定処理のCPU時間
+# ============================================================================
+
+def _fixture_response(body: bytes, url: str, content_type: str = "text/html; charset=UTF-8") -> requests.Response:
+    """記録済みの本文からstream=Trueで受け取ったのと同じ形のレスポンスを作る"""
+    res = requests.Response()
+    res.status_code = 200
+    res.url = url
+    res.headers = CaseInsensitiveDict({"Content-Type": content_type})
+    res.encoding = get_encoding_from_headers(res.headers)
+    res.raw = io.BytesIO(body)
+    return res
+
+
+def _scan(site: str, step: str, fixture: str) -> Callable[[], Any]:
+    body = load_fixture(site, fixture)
+    adapter = core.SITE_ADAPTERS[site]
+    return lambda: core.scan_step(_fixture_response(body, adapter.build_url("bench")), adapter, step)
+
+
+def _tsutaya_search(fixture: str) -> Callable[[], Any]:
+    body = load_fixture("tsutaya", fixture).replace(b"{work_id}", b"90000000")
+
+    def run() -> Any:
+        res = _fixture_response(body, core.build_tsutaya_search_url("bench"))
+        return core._extract_first_tsutaya_work_id(res.text)
+
+    return run
+
+
+def _google_books(fixture: str) -> Callable[[], Any]:
+    body = load_fixture("google_books", fixture)
+    return lambda: core._parse_google_books_candidates(
+        _fixture_response(body, core.GOOGLE_BOOKS_API_URL, "application/json; charset=UTF-8").json()
+    )
+
+
+# 計測するページ: 名前 -> 1回分の判定処理
+PARSE_CASES: Dict[str, Callable[[], Any]] = {
+    "gifu/hit": _scan("gifu", "search", "hit.html"),
+    "gifu/nohit": _scan("gifu", "search", "nohit.html"),
+    "kani/on_shelf": _scan("kani", "search", "on_shelf.html"),
+    "kani/on_loan": _scan("kani", "search", "on_loan.html"),
+    "kani/nohit": _scan("kani", "search", "nohit.html"),
+    "sanseido/in_stock": _scan("sanseido", "search", "in_stock.html"),
+    "sanseido/out_of_stock": _scan("sanseido", "search", "out_of_stock.html"),
+    "sanseido/nohit": _scan("sanseido", "search", "nohit.html"),
+    "tsutaya/search": _tsutaya_search("search_hit.html"),
+    "tsutaya/select": _scan("tsutaya", "select", "select.html"),
+    "tsutaya/stock_in": _scan("tsutaya", "stock", "stock_in.html"),
+    "tsutaya/stock_out": _scan("tsutaya", "stock", "stock_out.html"),
+    "google_books/found": _google_books("found.json"),
+}
+
+
+def measure_parse(iterations: int = PARSE_ITERATIONS) -> Dict[str, float]:
+    """
+    ページごとの判定処理1回あたりのCPU時間（マイクロ秒）を測る
+    
+    他の処理に割り込まれた回の影響を除くため、繰り返したうちの最小値を使う。
+    
+    Args:
+        iterations: 繰り返し回数
+    
+    Returns:
+        "parse_us.<サイト/ページ>" -> マイクロ秒
+    """
+    results = {}
+    for name, run in PARSE_CASES.items():
+        run()  # 正規表現のコンパイル等を除くため1回空回し
+        samples = []
+        for _ in range(iterations):
+            started = time.thread_time()
+            run()
+            samples.append((time.thread_time() - started) * 1e6)
+        results[f"parse_us.{name}"] = round(min(samples), 1)
+    return results
+
+
+# ============================================================================
+# 検索全体
+# ============================================================================
+
+def _percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _search_once(keyword: str) -> Tuple[float, float, Dict[str, str]]:
+    """画面と同じ経路で1回検索し、(最初のカードまで, 全部揃うまで, サイト -> 判定) を返す"""
+    started = time.perf_counter()
+    deadline = time.monotonic() + core.SEARCH_DEADLINE
+    futures = core.start_search(keyword, book_fetcher=core.fetch_book_info_cached, deadline=deadline)
+    first_card = None
+    statuses = {}
+    for site, future in core.iter_until_deadline(futures, deadline):
+        if site == "book":
+            continue
+        if first_card is None:
+            first_card = time.perf_counter() - started
+        result = future.result() if future is not None else None
+        statuses[site] = core.site_result_to_dict(site, keyword, result)["status"]
+    total = time.perf_counter() - started
+    return (first_card if first_card is not None else total), total, statuses
+
+
+def measure_search(iterations: int, start_index: int = 0) -> Tuple[Dict[str, float], List[str]]:
+    """
+    シナリオごとに検索を繰り返し、所要時間（ミリ秒）を測る
+    
+    キーワードは毎回変え、検索結果キャッシュ・草叢BOOKSの商品特定キャッシュに当たらないようにする。
+    各シナリオの最後のキーワードをもう一度検索し、キャッシュに当たった場合の時間も測る。
+    
+    Args:
+        iterations: シナリオごとの検索回数
+        start_index: キーワードの通し番号の開始値
+    
+    Returns:
+        (指標名 -> ミリ秒, 期待した判定と違った結果の説明の一覧)
+    """
+    results: Dict[str, float] = {}
+    mismatches: List[str] = []
+    # 接続プール・OPACセッションを温める（計測しない）
+    _search_once(scenario_keyword("warmup", start_index))
+    for scenario, expected in SCENARIOS.items():
+        first_cards, totals, cached = [], [], []
+        keyword = ""
+        for i in range(iterations):
+            keyword = scenario_keyword(scenario, start_index + i)
+            first_card, total, statuses = _search_once(keyword)
+            first_cards.append(first_card * 1000)
+            totals.append(total * 1000)
+            for site, status in statuses.items():
+                want = expected[site][1]
+                if status != want:
+                    mismatches.append(f"{keyword} {site}: {status}（期待: {want}）")
+        for _ in range(max(1, iterations // 4)):
+            cached.append(_search_once(keyword)[1] * 1000)
+        for name, samples in (("search_ms", totals), ("first_card_ms", first_cards)):
+            results[f"{name}.{scenario}.p50"] = round(statistics.median(samples), 1)
+            results[f"{name}.{scenario}.p95"] = round(_percentile(samples, 0.95), 1)
+        results[f"cached_ms.{scenario}.p50"] = round(statistics.median(cached), 2)
+    return results, mismatches
+
+
+# ============================================================================
+# ベースライン
+# ============================================================================
+
+def compare(current: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    """
+    ベースラインより遅くなった指標を返す
+    
+    Args:
+        current: 今回の結果
+        baseline: ベースラインの結果
+        tolerance: 許容する増加の割合
+    
+    Returns:
+        "指標名: ベースライン -> 今回 (+x%)" の一覧
+    """
+    regressions = []
+    for name, value in current.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        slack = ABSOLUTE_SLACK["us" if name.startswith("parse_us") else "ms"]
+        if value > base * (1 + tolerance) and value - base > slack:
+            regressions.append(f"{name}: {base} -> {value} (+{(value / base - 1) * 100:.0f}%)" if base else f"{name}: {base} -> {value}")
+    return regressions
+
+
+def print_table(current: Dict[str, float], baseline: Dict[str, float]) -> None:
+    """結果をベースラインとの差つきで表示"""
+    width = max(len(name) for name in current)
+    for name, value in current.items():
+        base = baseline.get(name)
+        diff = f"  ({(value / base - 1) * 100:+.0f}% / ベースライン {base})" if base else ""
+        print(f"{name:<{width}}  {value:>10}{diff}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="オフラインのベンチマーク")
+    parser.add_argument("-n", "--iterations", type=int, default=20, help="シナリオごとの検索回数（デフォルト: 20）")
+    parser.add_argument("--latency", help="代役サーバーの応答遅延（秒）。全サイト共通の値か gifu=0.3,kani=0.5 の形式（デフォルト: 0.05）")
+    parser.add_argument("--jitter", type=float, default=0.2, help="遅延のばらつき（割合、デフォルト: 0.2）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="代役サーバーが503を返す割合（デフォルト: 0）")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="ベースラインのJSON")
+    parser.add_argument("--update-baseline", action="store_true", help="今回の結果をベースラインとして保存")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="遅くなったとみなす割合（デフォルト: 0.25）")
+    parser.add_argument("--json", help="結果をJSONで書き出すファイル")
+    parser.add_argument("--skip-search", action="store_true", help="判定処理のCPU時間だけ測る")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    latency = parse_latency(args.latency, 0.05)
+    config = {"latency": latency, "jitter": args.jitter, "error_rate": args.error_rate, "iterations": args.iterations}
+
+    current = measure_parse()
+    mismatches: List[str] = []
+    status_counts: Dict[str, Any] = {}
+    if not args.skip_search:
+        with StandInSites(latency=latency, jitter=args.jitter, error_rate=args.error_rate) as standins:
+            use_standins(standins)
+            search_results, mismatches = measure_search(args.iterations)
+            status_counts = standins.status_counts()
+        current.update(search_results)
+
+    baseline: Dict[str, Any] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    if baseline and baseline.get("config") != config:
+        print("⚠️ ベースラインと条件（遅延・回数など）が違うため、比較は参考値です", file=sys.stderr)
+    print_table(current, baseline.get("metrics", {}))
+    if status_counts:
+        print(f"代役サーバーの応答: {json.dumps(status_counts)}")
+
+    report = {
+        "config": config,
+        "environment": {"python": platform.python_version(), "machine": platform.machine(), "system": platform.system()},
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "metrics": current,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({**report, "mismatches": mismatches}, f, ensure_ascii=False, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"ベースラインを保存しました: {args.baseline}")
+
+    exit_code = 0
+    if mismatches:
+        print(f"\n期待と違う判定が {len(mismatches)} 件ありました:", file=sys.stderr)
+        for line in mismatches[:20]:
+            print(f"  {line}", file=sys.stderr)
+        # エラーを混ぜた計測では判定が変わるのは想定どおり
+        if args.error_rate == 0:
+            exit_code = 1
+    regressions = compare(current, baseline.get("metrics", {}), args.tolerance) if not args.update_baseline else []
+    if regressions:
+        print(f"\nベースラインより {args.tolerance:.0%} 以上遅くなった項目:", file=sys.stderr)
+        for line in regressions:
+            print(f"  {line}", file=sys.stderr)
+        exit_code = 1
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
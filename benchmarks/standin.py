@@ -0,0 +1,323 @@
+"""
+検索対象サイトのローカル代役サーバー（ベンチマーク・負荷試験用）
+
+サイトごとに1ポートのHTTPサーバーを立て、fixtures/ の記録済みHTML・JSONを返す。
+どのページを返すかは検索キーワードに含まれるシナリオ名（"bench-hit-0001" の "hit" など）で決まる。
+応答の遅延（ジッター付き）とエラー率を指定でき、ネットワークなしで検索の全経路を動かせる。
+
+本体（book_search_app.core）はHOST_OVERRIDESで接続先だけをこのサーバーに向けるため、
+URL・リダイレクト先・サイトごとの判定処理は本番と同じものが動く。
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# シナリオ名 -> サイトごとに返すページ（fixtures/<サイト>/ のファイル名の一部）と、期待する判定
+SCENARIOS: Dict[str, Dict[str, Tuple[str, str]]] = {
+    "hit": {
+        "gifu": ("hit", "あり"),
+        "kani": ("on_shelf", "在庫あり"),
+        "sanseido": ("in_stock", "在庫あり"),
+        "tsutaya": ("stock_in", "在庫あり"),
+        "google_books": ("found", ""),
+    },
+    "nohit": {
+        "gifu": ("nohit", "なし"),
+        "kani": ("nohit", "なし"),
+        "sanseido": ("nohit", "なし"),
+        "tsutaya": ("search_nohit", "判定保留"),
+        "google_books": ("empty", ""),
+    },
+    "on_loan": {
+        "gifu": ("hit", "あり"),
+        "kani": ("on_loan", "貸出中"),
+        "sanseido": ("out_of_stock", "なし"),
+        "tsutaya": ("stock_out", "なし"),
+        "google_books": ("found", ""),
+    },
+    "mediacosmos": {
+        "gifu": ("redirect", "なし"),
+        "kani": ("nohit", "なし"),
+        "sanseido": ("nohit", "なし"),
+        "tsutaya": ("search_nohit", "判定保留"),
+        "google_books": ("empty", ""),
+    },
+}
+DEFAULT_SCENARIO = "nohit"
+
+# サイト -> 代役にするホスト（g-mediacosmos.jpは岐阜市立図書館のリダイレクト先）
+SITE_HOSTS: Dict[str, Tuple[str, ...]] = {
+    "gifu": ("www1.gifu-lib.jp", "www.g-mediacosmos.jp"),
+    "kani": ("www.kani-lib.jp",),
+    "sanseido": ("www.books-sanseido.jp",),
+    "tsutaya": ("store-tsutaya.tsite.jp",),
+    "google_books": ("www.googleapis.com",),
+}
+
+# キーワードが入るクエリパラメータ
+KEYWORD_PARAMS = ("txt_word", "text(1)", "keyword", "q")
+
+# 草叢BOOKSのworkId・productKeyにシナリオの番号を埋め込む（selectページ・在庫ページにはキーワードが来ないため）
+TSUTAYA_WORK_ID_BASE = 90000000
+TSUTAYA_PRODUCT_KEY_BASE = 9784000000000
+
+Reply = Tuple[int, Dict[str, str], bytes]
+
+
+def scenario_of(keyword: str) -> str:
+    """キーワードに含まれるシナリオ名を返す（"bench-on_loan-0003" -> "on_loan"）"""
+    for name in SCENARIOS:
+        if f"-{name}-" in f"-{keyword}-":
+            return name
+    return DEFAULT_SCENARIO
+
+
+def scenario_keyword(scenario: str, n: int) -> str:
+    """シナリオのn番目のキーワードを作る（キャッシュに当てないよう番号で変える）"""
+    return f"bench-{scenario}-{n:05d}"
+
+
+def load_fixture(site: str, name: str) -> bytes:
+    """fixtures/<site>/<name> を読む"""
+    with open(os.path.join(FIXTURES_DIR, site, name), "rb") as f:
+        return f.read()
+
+
+def _html(body: bytes, **replacements: Any) -> Reply:
+    for key, value in replacements.items():
+        body = body.replace(("{" + key + "}").encode("ascii"), str(value).encode("ascii"))
+    return 200, {"Content-Type": "text/html; charset=UTF-8"}, body
+
+
+def _redirect(location: str) -> Reply:
+    return 302, {"Location": location, "Content-Type": "text/html; charset=UTF-8"}, b""
+
+
+# ============================================================================
+# サイトごとの応答
+# ============================================================================
+
+def _route_gifu(path: str, query: Dict[str, str], scenario: str) -> Reply:
+    if path == "/winj/opac/top.do":
+        status, headers, body = _html(load_fixture("gifu", "warmup.html"))
+        headers["Set-Cookie"] = "JSESSIONID=bench; Path=/winj"
+        return status, headers, body
+    if path == "/winj/opac/search-standard.do":
+        page = SCENARIOS[scenario]["gifu"][0]
+        if page == "redirect":
+            return _redirect("https://www.g-mediacosmos.jp/lib/?from=opac")
+        return _html(load_fixture("gifu", f"{page}.html"))
+    if path == "/lib/":
+        return _html(load_fixture("gifu", "mediacosmos.html"))
+    return 404, {}, b"not found"
+
+
+def _route_kani(path: str, query: Dict[str, str], scenario: str) -> Reply:
+    if path == "/csp/opw/OPW/OPWSRCH1.CSP":
+        status, headers, body = _html(load_fixture("kani", "warmup.html"))
+        headers["Set-Cookie"] = "CSPSESSIONID=bench; Path=/csp"
+        return status, headers, body
+    if path == "/csp/opw/OPW/OPWSRCHLIST.CSP":
+        return _html(load_fixture("kani", f"{SCENARIOS[scenario]['kani'][0]}.html"))
+    return 404, {}, b"not found"
+
+
+def _route_sanseido(path: str, query: Dict[str, str], scenario: str) -> Reply:
+    if path == "/booksearch/BookSearchExec.action":
+        return _html(load_fixture("sanseido", f"{SCENARIOS[scenario]['sanseido'][0]}.html"))
+    return 404, {}, b"not found"
+
+
+def _route_tsutaya(path: str, query: Dict[str, str], scenario: str) -> Reply:
+    names = list(SCENARIOS)
+    if "workId" in query:
+        index = int(query["workId"]) - TSUTAYA_WORK_ID_BASE
+        scenario = names[index] if 0 <= index < len(names) else DEFAULT_SCENARIO
+    page = SCENARIOS[scenario]["tsutaya"][0]
+    work_id = TSUTAYA_WORK_ID_BASE + names.index(scenario)
+    product_key = TSUTAYA_PRODUCT_KEY_BASE + names.index(scenario)
+    if path == "/search/result/":
+        name = "search_nohit.html" if page == "search_nohit" else "search_hit.html"
+        return _html(load_fixture("tsutaya", name), work_id=work_id)
+    if path == "/search/result/select":
+        return _html(load_fixture("tsutaya", "select.html"), work_id=work_id, product_key=product_key)
+    if path == "/search/result/stock/result":
+        return _html(load_fixture("tsutaya", f"{page}.html"))
+    return 404, {}, b"not found"
+
+
+def _route_google_books(path: str, query: Dict[str, str], scenario: str) -> Reply:
+    if path == "/books/v1/volumes":
+        body = load_fixture("google_books", f"{SCENARIOS[scenario]['google_books'][0]}.json")
+        return 200, {"Content-Type": "application/json; charset=UTF-8"}, body
+    return 404, {}, b"not found"
+
+
+ROUTES: Dict[str, Callable[[str, Dict[str, str], str], Reply]] = {
+    "gifu": _route_gifu,
+    "kani": _route_kani,
+    "sanseido": _route_sanseido,
+    "tsutaya": _route_tsutaya,
+    "google_books": _route_google_books,
+}
+
+
+# ============================================================================
+# サーバー
+# ============================================================================
+
+@dataclass
+class SiteBehavior:
+    """代役サーバーの振る舞い（応答までの遅延とエラー率）"""
+
+    latency: float = 0.05  # 応答ヘッダーまでの遅延（秒）
+    jitter: float = 0.2  # 遅延のばらつき（latencyに対する割合、一様分布）
+    error_rate: float = 0.0  # この割合で503を返す
+    counts: Dict[int, int] = field(default_factory=dict)  # ステータスごとの応答数
+
+    def delay(self) -> float:
+        return max(0.0, self.latency * (1 + random.uniform(-self.jitter, self.jitter)))
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        server: "StandInServer" = self.server  # type: ignore[assignment]
+        parts = urllib.parse.urlsplit(self.path)
+        query = {key: values[0] for key, values in urllib.parse.parse_qs(parts.query).items()}
+        keyword = next((query[name] for name in KEYWORD_PARAMS if name in query), "")
+        time.sleep(server.behavior.delay())
+        if random.random() < server.behavior.error_rate:
+            status, headers, body = 503, {"Content-Type": "text/plain", "Retry-After": "0"}, b"busy"
+        else:
+            status, headers, body = ROUTES[server.site](parts.path, query, scenario_of(keyword))
+        with server.lock:
+            server.behavior.counts[status] = server.behavior.counts.get(status, 0) + 1
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    """1サイト分の代役サーバー"""
+
+    daemon_threads = True
+
+    def __init__(self, site: str, behavior: SiteBehavior, port: int = 0):
+        super().__init__(("127.0.0.1", port), _StandInHandler)
+        self.site = site
+        self.behavior = behavior
+        self.lock = threading.Lock()
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        # 判定が確定した時点で検索側が接続を閉じるのは正常なので表示しない
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StandInSites:
+    """
+    全サイトの代役サーバーをまとめて起動・停止する
+    
+    Args:
+        latency: サイトごとの応答遅延（秒）。サイトキー -> 秒 の辞書か、全サイト共通の値
+        jitter: 遅延のばらつき（割合）
+        error_rate: 503を返す割合
+    """
+
+    def __init__(self, latency: Any = 0.05, jitter: float = 0.2, error_rate: float = 0.0):
+        self.servers: Dict[str, StandInServer] = {}
+        for site in ROUTES:
+            site_latency = latency.get(site, 0.05) if isinstance(latency, dict) else latency
+            behavior = SiteBehavior(latency=site_latency, jitter=jitter, error_rate=error_rate)
+            self.servers[site] = StandInServer(site, behavior)
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> "StandInSites":
+        for server in self.servers.values():
+            thread = threading.Thread(target=server.serve_forever, name=f"standin-{server.site}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self) -> None:
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
+
+    def __enter__(self) -> "StandInSites":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    @property
+    def host_overrides(self) -> Dict[str, str]:
+        """本番ホスト -> 代役サーバーのベースURL（core.HOST_OVERRIDES / BOOK_SEARCH_HOST_OVERRIDES用）"""
+        return {host: self.servers[site].base_url for site, hosts in SITE_HOSTS.items() for host in hosts}
+
+    def status_counts(self) -> Dict[str, Dict[int, int]]:
+        """サイトごとのステータス別応答数"""
+        return {site: dict(server.behavior.counts) for site, server in self.servers.items()}
+
+
+def parse_latency(spec: Optional[str], default: float) -> Dict[str, float]:
+    """
+    "--latency" の指定（"0.05" または "gifu=0.3,kani=0.5"）をサイトごとの秒数にする
+    
+    Args:
+        spec: 指定文字列（Noneならdefault）
+        default: 指定のないサイトの遅延
+    
+    Returns:
+        サイトキー -> 秒
+    """
+    latency = {site: default for site in ROUTES}
+    if not spec:
+        return latency
+    for item in spec.split(","):
+        site, sep, value = item.strip().partition("=")
+        if not sep:
+            latency = {key: float(site) for key in latency}
+        elif site in latency:
+            latency[site] = float(value)
+        else:
+            raise ValueError(f"不明なサイト: {site}（指定可能: {', '.join(ROUTES)}）")
+    return latency
+
+
+def use_standins(standins: StandInSites) -> None:
+    """
+    検索エンジンの接続先を代役サーバーに向け、ホストごとの送信レート制限を外す
+    
+    代役サーバーは手元にあるため、本番向けのレート制限で待つと検索側の性能が測れない。
+    レート制限はホストごとに初回利用時に作られるので、検索を実行する前に呼ぶこと。
+    
+    Args:
+        standins: 起動済みの代役サーバー
+    """
+    from book_search_app import core
+
+    core.HOST_OVERRIDES.update(standins.host_overrides)
+    for host in standins.host_overrides:
+        core.HOST_RATE_LIMITS[host] = (100000.0, 100000)
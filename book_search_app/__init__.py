@@ -0,0 +1,7 @@
+"""
+書籍横断検索アプリ
+
+- book_search_app.core: Streamlitに依存しない検索エンジン（在庫チェック・書誌情報取得）
+- book_search_app.app: Streamlitアプリ（streamlit run book_search_app/app.py）
+- python -m book_search_app: コマンドライン（結果をJSONで出力）
+"""
@@ -0,0 +1,153 @@
+"""
+コマンドラインから検索する（Streamlitは読み込まない）
+
+使い方:
+    python -m book_search_app search "ノルウェイの森"
+    python -m book_search_app search 978-4-06-274868-1 --sites gifu,kani --no-book --pretty
+    python -m book_search_app search "ノルウェイの森" --trace trace.json
+    python -m book_search_app batch reading_list.csv -o results.jsonl --concurrency 4
+    python -m book_search_app serve --port 8765
+"""
+
+import argparse
+import contextlib
+import json
+import sys
+from typing import List, Optional
+
+
+def parse_sites(value: Optional[str]) -> Optional[List[str]]:
+    """
+    --sitesの値をサイトキーのリストに変換する
+    
+    Args:
+        value: カンマ区切りのサイトキー（未指定ならNone）
+    
+    Returns:
+        サイトキーのリスト（未指定ならNone）。不明なキーがあれば標準エラーに出してSystemExit(2)
+    """
+    from book_search_app.core import SITE_ADAPTERS
+
+    sites = [s.strip() for s in value.split(",") if s.strip()] if value else None
+    unknown = [s for s in sites or [] if s not in SITE_ADAPTERS]
+    if unknown:
+        print(f"不明なサイト: {', '.join(unknown)}（指定可能: {', '.join(SITE_ADAPTERS)}）", file=sys.stderr)
+        raise SystemExit(2)
+    return sites
+
+
+def cmd_search(args: argparse.Namespace) -> int:
+    """
+    searchサブコマンド: 1件検索して結果をJSONで標準出力に書く
+    
+    Args:
+        args: コマンドライン引数
+    
+    Returns:
+        終了コード
+    """
+    # コアの読み込みは引数の解析後に行う（--helpなどを速く返すため）
+    from book_search_app.core import run_search
+
+    sites = parse_sites(args.sites)
+
+    # コア内のログ出力（print）でJSONが崩れないよう、実行中の標準出力は標準エラーへ回す
+    with contextlib.redirect_stdout(sys.stderr):
+        result = run_search(args.keyword, sites=sites, include_book=not args.no_book)
+    print(json.dumps(result, ensure_ascii=False, indent=2 if args.pretty else None))
+    if args.trace:
+        from book_search_app import tracing
+
+        item = tracing.BUFFER.get(result["trace_id"]) if result["trace_id"] else None
+        with open(args.trace, "w", encoding="utf-8") as f:
+            json.dump(tracing.to_chrome_trace([item] if item else []), f, ensure_ascii=False)
+    return 0
+
+
+def cmd_batch(args: argparse.Namespace) -> int:
+    """
+    batchサブコマンド: 一覧ファイルを一括検索し、1件ごとにJSONLへ追記する
+    
+    Args:
+        args: コマンドライン引数
+    
+    Returns:
+        終了コード（エラーになったタイトルがあれば1）
+    """
+    from book_search_app.batch import print_progress, read_keywords, run_batch
+
+    sites = parse_sites(args.sites)
+    keywords = read_keywords(args.input)
+    with contextlib.redirect_stdout(sys.stderr):
+        stats = run_batch(
+            keywords,
+            args.output,
+            concurrency=args.concurrency,
+            sites=sites,
+            include_book=not args.no_book,
+            progress=print_progress,
+        )
+    print(json.dumps(stats, ensure_ascii=False), file=sys.stderr)
+    return 1 if stats["errors"] else 0
+
+
+def cmd_serve(args: argparse.Namespace) -> int:
+    """
+    serveサブコマンド: JSON HTTP APIを起動する
+    
+    Args:
+        args: コマンドライン引数
+    
+    Returns:
+        終了コード
+    """
+    from book_search_app.api import serve
+
+    serve(args.host, args.port)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """コマンドライン引数の定義"""
+    from book_search_app.batch import BATCH_DEFAULT_CONCURRENCY
+
+    parser = argparse.ArgumentParser(
+        prog="python -m book_search_app",
+        description="岐阜市立図書館・可児市立図書館・岐阜駅本屋・草叢BOOKSを一括検索する",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    search = subparsers.add_parser("search", help="キーワードまたはISBNで検索し、結果をJSONで出力")
+    search.add_argument("keyword", help="検索キーワードまたはISBN")
+    search.add_argument("--sites", help="検索するサイトキー（カンマ区切り。省略時は全サイト）")
+    search.add_argument("--no-book", action="store_true", help="Google Booksの書誌情報を取得しない")
+    search.add_argument("--pretty", action="store_true", help="JSONを整形して出力")
+    search.add_argument("--trace", metavar="FILE", help="処理の内訳をChromeのトレースイベント形式（JSON）で書き出す")
+    search.set_defaults(func=cmd_search)
+
+    batch = subparsers.add_parser("batch", help="一覧ファイル（CSV / JSONL / テキスト）を一括検索し、JSONLで出力")
+    batch.add_argument("input", help="キーワード・ISBNの一覧ファイル")
+    batch.add_argument("-o", "--output", required=True, help="出力JSONL（既存なら記録済みのタイトルを飛ばして再開）")
+    batch.add_argument(
+        "-c", "--concurrency", type=int, default=BATCH_DEFAULT_CONCURRENCY,
+        help=f"同時に検索するタイトル数（デフォルト: {BATCH_DEFAULT_CONCURRENCY}）",
+    )
+    batch.add_argument("--sites", help="検索するサイトキー（カンマ区切り。省略時は全サイト）")
+    batch.add_argument("--no-book", action="store_true", help="Google Booksの書誌情報を取得しない")
+    batch.set_defaults(func=cmd_batch)
+
+    serve = subparsers.add_parser("serve", help="JSON HTTP APIを起動（接続・キャッシュをプロセス内で使い回す）")
+    serve.add_argument("--host", default="127.0.0.1", help="待ち受けるアドレス（デフォルト: 127.0.0.1）")
+    serve.add_argument("--port", type=int, default=8765, help="待ち受けるポート（デフォルト: 8765）")
+    serve.set_defaults(func=cmd_serve)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """エントリーポイント"""
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,395 @@
+"""
+在庫検索のJSON HTTP API（ローカル常駐サービス）
+
+Streamlitの画面と同じ在庫・書誌情報を、他のツールからJSONで取得できるようにする。
+常駐プロセスなのでHTTP接続プール・OPACセッション・検索結果キャッシュをリクエスト間で使い回す。
+
+エンドポイント:
+    GET  /health                    稼働確認とキャッシュ・レート制限・サーキットブレーカー・応答時間の状態
+    GET  /metrics                   サイト別の応答時間・転送量・判定結果などをOpenMetrics形式で出力
+    GET  /sites                     検索できるサイトの一覧
+    GET  /search?q=...              全サイト＋書誌情報（sites=gifu,kani / book=0 で絞り込み）
+    GET  /search?q=...&stream=1     サイトごとに終わった順でNDJSONを返す
+    GET  /sites/<site>?q=...        1サイトだけ検索
+    GET  /book?q=...                書誌情報だけ取得
+    POST /batch                     {"keywords": [...], "sites": [...], "book": true} をまとめて検索
+    GET  /traces?limit=20           直近の検索のトレース一覧（format=chrome でChromeのトレースイベント形式）
+    GET  /traces/<trace_id>         1回の検索の処理の内訳（スパン一覧。format=chrome も可）
+"""
+
+import json
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from book_search_app.core import (
+    SEARCH_DEADLINE,
+    SITE_ADAPTERS,
+    canonicalize_keyword,
+    circuit_breaker_stats,
+    fetch_book_info_cached,
+    get_result_cache,
+    iter_until_deadline,
+    latency_stats,
+    rate_limiter_stats,
+    run_search,
+    run_site_check,
+    shared_resource,
+    site_result_to_dict,
+    start_search,
+)
+from book_search_app import tracing
+from book_search_app.metrics import OPENMETRICS_CONTENT_TYPE, render as render_metrics
+
+API_DEFAULT_HOST = "127.0.0.1"
+API_DEFAULT_PORT = 8765
+API_BATCH_MAX_KEYWORDS = 100  # POST /batch 1回で受け付けるキーワード数の上限
+API_BATCH_CONCURRENCY = 4  # POST /batch で同時に検索するタイトル数
+API_MAX_BODY_BYTES = 1024 * 1024
+
+
+class ApiError(Exception):
+    """HTTPステータス付きでクライアントに返すエラー"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+@shared_resource
+def get_batch_executor() -> ThreadPoolExecutor:
+    """
+    POST /batch 用のスレッドプールを取得（全リクエストで共有し、同時検索タイトル数を抑える）
+    
+    Returns:
+        ThreadPoolExecutor
+    """
+    return ThreadPoolExecutor(max_workers=API_BATCH_CONCURRENCY, thread_name_prefix="book-api-batch")
+
+
+def _parse_sites(value: Any) -> Optional[List[str]]:
+    """sites指定（カンマ区切り文字列またはリスト）を検証してサイトキーのリストにする"""
+    if not value:
+        return None
+    if not isinstance(value, (str, list)):
+        raise ApiError(400, "sitesはカンマ区切りの文字列かリストで指定してください")
+    sites = [s.strip() for s in value.split(",")] if isinstance(value, str) else [str(s) for s in value]
+    sites = [s for s in sites if s]
+    unknown = [s for s in sites if s not in SITE_ADAPTERS]
+    if unknown:
+        raise ApiError(400, f"不明なサイト: {', '.join(unknown)}（指定可能: {', '.join(SITE_ADAPTERS)}）")
+    return sites or None
+
+
+def _parse_flag(value: Optional[str], default: bool) -> bool:
+    """クエリ文字列の真偽値（1/0, true/false）を解釈する"""
+    if value is None:
+        return default
+    return value.lower() not in ("0", "false", "no", "off", "")
+
+
+def _require_keyword(query: Dict[str, str]) -> str:
+    """クエリ文字列から正規化済みキーワードを取り出す（空なら400）"""
+    keyword = canonicalize_keyword(query.get("q", ""))
+    if not keyword:
+        raise ApiError(400, "キーワード（q）を指定してください")
+    return keyword
+
+
+class BookSearchHandler(BaseHTTPRequestHandler):
+    """APIのリクエストハンドラー（1リクエスト1スレッド）"""
+
+    server_version = "BookSearchAPI/1.0"
+    protocol_version = "HTTP/1.1"
+
+    # ========================================================================
+    # ルーティング
+    # ========================================================================
+
+    def do_GET(self) -> None:
+        self._begin_request()
+        path, query = self._split_path()
+        try:
+            if path == "/health":
+                self._send_json(200, {
+                    "status": "ok",
+                    "cache": get_result_cache().stats(),
+                    "rate_limits": rate_limiter_stats(),
+                    "circuit_breakers": circuit_breaker_stats(),
+                    "latency": latency_stats(),
+                })
+            elif path == "/metrics":
+                self._send_text(200, render_metrics(), OPENMETRICS_CONTENT_TYPE)
+            elif path == "/sites":
+                self._send_json(200, {
+                    "sites": [
+                        {"key": key, "name": adapter.name, "icon": adapter.icon}
+                        for key, adapter in SITE_ADAPTERS.items()
+                    ]
+                })
+            elif path == "/search":
+                self._handle_search(query)
+            elif path.startswith("/sites/"):
+                self._handle_site(path[len("/sites/"):], query)
+            elif path == "/traces":
+                self._handle_traces(query)
+            elif path.startswith("/traces/"):
+                self._handle_trace(path[len("/traces/"):], query)
+            elif path == "/book":
+                keyword = _require_keyword(query)
+                self._send_json(200, {"keyword": keyword, "book": fetch_book_info_cached(keyword)})
+            else:
+                raise ApiError(404, f"不明なパス: {path}")
+        except ApiError as e:
+            self._send_error_json(e.status, e.message)
+        except Exception as e:
+            self._send_internal_error(e)
+
+    def do_POST(self) -> None:
+        self._begin_request()
+        path, _ = self._split_path()
+        try:
+            if path != "/batch":
+                raise ApiError(404, f"不明なパス: {path}")
+            self._handle_batch(self._read_json_body())
+        except ApiError as e:
+            self._send_error_json(e.status, e.message)
+        except Exception as e:
+            self._send_internal_error(e)
+
+    # ========================================================================
+    # 各エンドポイント
+    # ========================================================================
+
+    def _handle_search(self, query: Dict[str, str]) -> None:
+        """GET /search: 全サイト（または指定サイト）と書誌情報"""
+        keyword = _require_keyword(query)
+        sites = _parse_sites(query.get("sites"))
+        include_book = _parse_flag(query.get("book"), True)
+        if not _parse_flag(query.get("stream"), False):
+            self._send_json(200, run_search(keyword, sites=sites, include_book=include_book))
+            return
+
+        # stream=1: 終わったサイトから1行ずつ返す（制限時間を過ぎたら残りはタイムアウト、最後に done 行）
+        started = time.perf_counter()
+        deadline = time.monotonic() + SEARCH_DEADLINE
+        with tracing.trace("search", keyword=keyword, stream=True) as root:
+            futures = start_search(
+                keyword,
+                sites=sites,
+                book_fetcher=fetch_book_info_cached if include_book else None,
+                deadline=deadline,
+            )
+            self._start_chunked(200, "application/x-ndjson; charset=utf-8")
+            timed_out = []
+            for site, future in iter_until_deadline(futures, deadline):
+                if future is None:
+                    timed_out.append(site)
+                if site == "book":
+                    book = future.result() if future is not None and future.exception() is None else None
+                    line = {"keyword": keyword, "site": "book", "book": book}
+                else:
+                    result = future.result() if future is not None else None
+                    line = {"keyword": keyword, "site": site, **site_result_to_dict(site, keyword, result)}
+                self._write_chunk(json.dumps(line, ensure_ascii=False) + "\n")
+            root.set(timed_out=timed_out)
+        done = {
+            "keyword": keyword,
+            "done": True,
+            "timed_out": timed_out,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            "trace_id": root.trace_id,
+        }
+        self._write_chunk(json.dumps(done, ensure_ascii=False) + "\n")
+        self._write_chunk("")
+
+    def _handle_site(self, site: str, query: Dict[str, str]) -> None:
+        """GET /sites/<site>: 1サイトだけ検索"""
+        if site not in SITE_ADAPTERS:
+            raise ApiError(404, f"不明なサイト: {site}（指定可能: {', '.join(SITE_ADAPTERS)}）")
+        keyword = _require_keyword(query)
+        result = run_site_check(site, keyword)
+        self._send_json(200, {"keyword": keyword, "site": site, **site_result_to_dict(site, keyword, result)})
+
+    def _handle_batch(self, body: Any) -> None:
+        """POST /batch: 複数キーワードをまとめて検索（結果は入力順）"""
+        if not isinstance(body, dict) or not isinstance(body.get("keywords"), list):
+            raise ApiError(400, '{"keywords": [...]} の形式で送ってください')
+        keywords = [canonicalize_keyword(str(k)) for k in body["keywords"]]
+        keywords = [k for k in keywords if k]
+        if len(keywords) > API_BATCH_MAX_KEYWORDS:
+            raise ApiError(413, f"キーワードは1回{API_BATCH_MAX_KEYWORDS}件までです")
+        sites = _parse_sites(body.get("sites"))
+        include_book = bool(body.get("book", True))
+
+        started = time.perf_counter()
+        executor = get_batch_executor()
+        # 同じキーワードが複数あっても検索は1回にする
+        futures = {
+            keyword: executor.submit(run_search, keyword, sites, include_book)
+            for keyword in dict.fromkeys(keywords)
+        }
+        self._send_json(200, {
+            "results": [futures[keyword].result() for keyword in keywords],
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+
+    def _handle_traces(self, query: Dict[str, str]) -> None:
+        """GET /traces: 直近のトレース一覧（新しい順）"""
+        try:
+            limit = max(1, int(query.get("limit", "20")))
+        except ValueError:
+            raise ApiError(400, "limit は整数で指定してください")
+        traces = tracing.BUFFER.recent(limit)
+        if query.get("format") == "chrome":
+            self._send_json(200, tracing.to_chrome_trace(traces))
+            return
+        summaries = []
+        for item in traces:
+            data = item.to_dict()
+            summaries.append({
+                "trace_id": data["trace_id"],
+                "name": data["name"],
+                "started_at": data["started_at"],
+                "duration_ms": data["duration_ms"],
+                "attrs": data["attrs"],
+                "spans": len(data["spans"]),
+            })
+        self._send_json(200, {"traces": summaries})
+
+    def _handle_trace(self, trace_id: str, query: Dict[str, str]) -> None:
+        """GET /traces/<trace_id>: 1回の検索のスパン一覧"""
+        item = tracing.BUFFER.get(trace_id)
+        if item is None:
+            raise ApiError(404, f"トレースが見つかりません（古いものは破棄されます）: {trace_id}")
+        if query.get("format") == "chrome":
+            self._send_json(200, tracing.to_chrome_trace([item]))
+        else:
+            self._send_json(200, item.to_dict())
+
+    # ========================================================================
+    # 入出力
+    # ========================================================================
+
+    def _begin_request(self) -> None:
+        """リクエストごとの状態を初期化する（keep-aliveでは同じハンドラーが複数のリクエストを処理する）"""
+        self._body_consumed = self.command != "POST"
+        self._response_started = False
+
+    def send_response(self, code: int, message: Optional[str] = None) -> None:
+        self._response_started = True
+        super().send_response(code, message)
+
+    def _send_error_json(self, status: int, message: str) -> None:
+        """
+        エラーをJSONで返す
+        
+        ボディを読まずに返す場合（404・413など）は、残ったボディが次のリクエストとして
+        解釈されないよう接続を閉じる。
+        """
+        if not self._body_consumed:
+            self.close_connection = True
+        self._send_json(status, {"error": message})
+
+    def _send_internal_error(self, error: Exception) -> None:
+        """想定外の例外をログに残し、まだ応答していなければ500を返して接続を閉じる"""
+        self.log_error("想定外のエラー: %s %s: %s: %s", self.command, self.path, type(error).__name__, error)
+        traceback.print_exc(file=sys.stderr)
+        self.close_connection = True
+        if not self._response_started:
+            self._send_json(500, {"error": "サーバー内部でエラーが発生しました"})
+
+    def _split_path(self) -> Tuple[str, Dict[str, str]]:
+        """パスとクエリ文字列（各キーの先頭の値）に分ける"""
+        parts = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        return parts.path.rstrip("/") or "/", query
+
+    def _read_json_body(self) -> Any:
+        """リクエストボディをJSONとして読む"""
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            raise ApiError(400, "Content-Lengthが整数ではありません")
+        if length < 0:
+            raise ApiError(400, "Content-Lengthが負の値です")
+        if length > API_MAX_BODY_BYTES:
+            raise ApiError(413, "リクエストボディが大きすぎます")
+        data = self.rfile.read(length)
+        self._body_consumed = True
+        try:
+            return json.loads(data or b"null")
+        except ValueError:
+            raise ApiError(400, "リクエストボディがJSONではありません")
+
+    def _send_json(self, status: int, payload: Any) -> None:
+        """JSONレスポンスを返す（Content-Length付きなので接続は使い回せる）"""
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, status: int, text: str, content_type: str) -> None:
+        """テキストのレスポンスを返す"""
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_chunked(self, status: int, content_type: str) -> None:
+        """chunked転送でレスポンスを開始する"""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, text: str) -> None:
+        """chunkを1つ書いてすぐ送る（空文字列で終端）"""
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def create_server(host: str = API_DEFAULT_HOST, port: int = API_DEFAULT_PORT) -> ThreadingHTTPServer:
+    """
+    APIサーバーを作成する（serve_forever()で起動）
+    
+    Args:
+        host: 待ち受けるアドレス
+        port: 待ち受けるポート（0なら空いているポート）
+    
+    Returns:
+        ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer((host, port), BookSearchHandler)
+    server.daemon_threads = True
+    return server
+
+
+def serve(host: str = API_DEFAULT_HOST, port: int = API_DEFAULT_PORT) -> None:
+    """
+    APIサーバーを起動し、Ctrl+Cで止めるまで待ち受ける
+    
+    Args:
+        host: 待ち受けるアドレス
+        port: 待ち受けるポート
+    """
+    server = create_server(host, port)
+    print(f"📚 Book Search API: http://{server.server_address[0]}:{server.server_address[1]}/", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -2,17 +2,40 @@
 書籍横断検索アプリ
 
 岐阜市立図書館・可児市立図書館・岐阜駅本屋・草叢BOOKSを一括検索する
-Streamlitアプリケーション
+Streamlitアプリケーション（検索処理はbook_search_app.coreにある）
 """
 
+import json
 import os
-import re
+import sys
+import threading
 import time
 import urllib.parse
-from typing import Any, Dict, Optional, Tuple
-import requests
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
 import streamlit as st
-from bs4 import BeautifulSoup
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from streamlit.runtime.scriptrunner_utils.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
+
+# `streamlit run book_search_app/app.py` ではこのファイルのディレクトリしかsys.pathに入らないため、
+# パッケージとしてコアを読み込めるようにリポジトリのルートを追加する
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _REPO_ROOT not in sys.path:
+    sys.path.insert(0, _REPO_ROOT)
+
+from book_search_app import core, tracing  # noqa: E402
+from book_search_app.core import (  # noqa: E402
+    SEARCH_DEADLINE,
+    SITE_ADAPTERS,
+    Status,
+    canonicalize_keyword,
+    get_result_cache,
+    iter_until_deadline,
+    latency_stats,
+    register_task_context,
+    site_metrics_summary,
+    start_search,
+)
 
 # ============================================================================
 # 設定・定数
@@ -21,25 +44,13 @@ from bs4 import BeautifulSoup
 # Page Config
 st.set_page_config(page_title="本検索アプリ", layout="wide", page_icon="📚")
 
-# HTTP設定
-USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-HEADERS = {
-    "User-Agent": USER_AGENT,
-    "Accept": "application/json",
-    "Accept-Language": "ja,en-US;q=0.9,en;q=0.8",
-}
-TIMEOUT_SHORT = 10
-TIMEOUT_MEDIUM = 20  # Google Books API用に延長
-
 # アプリ設定
 HISTORY_LIMIT = 5
-KUSA_BOOKS_KEYWORD = "各務原店"
-
-# 外部API（書誌情報）
-GOOGLE_BOOKS_API_URL = "https://www.googleapis.com/books/v1/volumes"
+RESULT_GRID_COLUMNS = 2  # 結果カードを並べる列数
+RECENT_TRACES_LIMIT = 10  # 運用パネルに表示するトレース数
 
-# 型定義
-Status = Dict[str, str]
+# 結果待ちのカードに表示するステータス
+PENDING_STATUS: Status = {"text": "検索中...", "class": "border-pending", "icon": "⏳"}
 
 # ============================================================================
 # CSSスタイル
@@ -151,6 +162,7 @@ APP_CSS = """
     .border-ok { border-left: 5px solid var(--ok) !important; }
     .border-ng { border-left: 5px solid var(--ng) !important; }
     .border-warn { border-left: 5px solid var(--warn) !important; }
+    .border-pending { border-left: 5px solid var(--border) !important; }
 
     .card-top {
         display: flex;
@@ -201,6 +213,16 @@ APP_CSS = """
     .pill-ok { border-color: rgba(16,185,129,0.35); background: rgba(16,185,129,0.10); }
     .pill-ng { border-color: rgba(239,68,68,0.35); background: rgba(239,68,68,0.08); }
     .pill-warn { border-color: rgba(245,158,11,0.35); background: rgba(245,158,11,0.12); }
+    .pill-pending {
+        border-color: var(--border);
+        background: rgba(100,116,139,0.08);
+        color: var(--muted);
+        animation: pulse 1.4s ease-in-out infinite;
+    }
+    @keyframes pulse {
+        0%, 100% { opacity: 1; }
+        50% { opacity: 0.45; }
+    }
 
     /* Link buttons */
     .btn-link {
@@ -325,6 +347,7 @@ APP_CSS = """
     }
     @media (prefers-reduced-motion: reduce) {
         .loading-dot { animation: none; opacity: 1; transform: scale(1); }
+        .pill-pending { animation: none; }
     }
 
     /* Summary card (Book Info) */
@@ -373,24 +396,68 @@ APP_CSS = """
 
 
 # ============================================================================
-# ユーティリティ関数
+# Streamlit連携
 # ============================================================================
 
-def make_status(text: str, css_class: str, icon: str) -> Status:
+def _capture_script_run_ctx() -> Callable[[], Optional[Callable[[], None]]]:
     """
-    ステータス情報を生成する
+    呼び出し元のScriptRunContextを取得し、ワーカースレッドに付け替える関数を返す
     
-    Args:
-        text: ステータステキスト
-        css_class: CSSクラス名
-        icon: アイコン文字列
+    検索タスク内からデバッグ表示（st.info / st.errorなど）を使っても警告が出ないようにする。
+    ワーカースレッドは全セッションで共有するため、タスクが終わったら元のコンテキストに戻す
+    （他のセッションの検索やバックグラウンドの再取得が、このセッションの画面に書き込まないように）。
+    """
+    ctx = get_script_run_ctx(suppress_warning=True)
+
+    def apply() -> Optional[Callable[[], None]]:
+        if ctx is None:
+            return None
+        thread = threading.current_thread()
+        previous = get_script_run_ctx(suppress_warning=True)
+        add_script_run_ctx(thread, ctx)
+
+        def restore() -> None:
+            # add_script_run_ctx(thread, None)は呼び出し元のコンテキストを付けてしまうため、属性を直接戻す
+            if previous is None:
+                delattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME)
+            else:
+                add_script_run_ctx(thread, previous)
+
+        return restore
+
+    return apply
+
+
+register_task_context("streamlit", _capture_script_run_ctx)
+
+
+def _notify_streamlit(level: str, message: str) -> None:
+    """コアからの通知をst.info / st.success / st.warning / st.errorで表示"""
+    getattr(st, level)(message)
+
+
+def fetch_book_info_google_books(keyword: str, debug: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Google Books APIからキーワードに最も近い1冊の書誌情報を取得する（キャッシュ付き）
     
-    Returns:
-        ステータス辞書
+    キャッシュはコアの検索結果キャッシュ（全セッション共有）とBookInfoStoreに任せ、
+    取得できなかった場合（None）はキャッシュされず、次の検索で取り直す。
+    
+    Args:
+        keyword: 検索キーワード
+        debug: デバッグモード（進捗やエラーを画面に表示）
     """
-    return {"text": text, "class": css_class, "icon": icon}
+    return core.fetch_book_info_cached(
+        keyword,
+        debug=debug,
+        notify=_notify_streamlit if debug else None,
+    )
 
 
+# ============================================================================
+# ユーティリティ関数
+# ============================================================================
+
 def init_session_state() -> None:
     """セッションステートを初期化"""
     if "search_history" not in st.session_state:
@@ -413,169 +480,49 @@ def add_to_history(keyword: str) -> None:
         st.session_state.search_history = st.session_state.search_history[:HISTORY_LIMIT]
 
 
-def _fetch_book_info_google_books_internal(keyword: str, debug: bool = False) -> Optional[Dict[str, Any]]:
-    """
-    Google Books APIからキーワードに最も近い1冊の書誌情報を取得する（内部関数、リトライなし）
-    """
-    try:
-        params = {
-            "q": keyword,
-            "maxResults": 1,
-            "printType": "books",
-        }
-        
-        url = f"{GOOGLE_BOOKS_API_URL}?{urllib.parse.urlencode(params)}"
-        if debug:
-            print(f"[DEBUG] Google Books API URL: {url}")
-
-        # Google Books が組織プロキシで遮断される環境があるため、
-        # セッションで trust_env をオフにしてプロキシ設定を無効化
-        session = requests.Session()
-        session.trust_env = False
-        session.headers.update(HEADERS)
-
-        res = session.get(
-            GOOGLE_BOOKS_API_URL,
-            params=params,
-            timeout=TIMEOUT_MEDIUM,
-        )
-        
-        if debug:
-            print(f"[DEBUG] Response status: {res.status_code}")
-        
-        res.raise_for_status()
-        data = res.json()
-        items = data.get("items") or []
-        if not items:
-            if debug:
-                print(f"[DEBUG] No items found for keyword: {keyword}")
-            return None
+def detect_streamlit_cloud() -> bool:
+    """Streamlit Cloud環境の検出（複数の環境変数で判定）"""
+    return (
+        os.getenv("STREAMLIT_SERVER_PORT") is not None or
+        os.getenv("STREAMLIT_SHARING_MODE") is not None or
+        os.getenv("HOME") == "/home/appuser" or
+        "streamlit.app" in os.getenv("_", "")
+    )
 
-        volume_info = (items[0] or {}).get("volumeInfo") or {}
-        identifiers = volume_info.get("industryIdentifiers") or []
-        isbn_13 = None
-        isbn_10 = None
-        for it in identifiers:
-            if (it or {}).get("type") == "ISBN_13":
-                isbn_13 = (it or {}).get("identifier")
-            if (it or {}).get("type") == "ISBN_10":
-                isbn_10 = (it or {}).get("identifier")
-
-        image_links = volume_info.get("imageLinks") or {}
-        result = {
-            "title": volume_info.get("title"),
-            "subtitle": volume_info.get("subtitle"),
-            "authors": volume_info.get("authors") or [],
-            "publisher": volume_info.get("publisher"),
-            "publishedDate": volume_info.get("publishedDate"),
-            "description": volume_info.get("description"),
-            "categories": volume_info.get("categories") or [],
-            "pageCount": volume_info.get("pageCount"),
-            "language": volume_info.get("language"),
-            "thumbnail": image_links.get("thumbnail") or image_links.get("smallThumbnail"),
-            "infoLink": volume_info.get("infoLink"),
-            "isbn13": isbn_13,
-            "isbn10": isbn_10,
-        }
-        if debug:
-            print(f"[DEBUG] Successfully fetched book: {result.get('title', 'N/A')}")
-        return result
-    except requests.exceptions.RequestException as e:
-        print(f"[ERROR] Google Books API RequestException: {type(e).__name__}: {str(e)}")
-        if debug:
-            print(f"[DEBUG] Request URL: {GOOGLE_BOOKS_API_URL}")
-            print(f"[DEBUG] Headers: {HEADERS}")
-        raise
-    except Exception as e:
-        print(f"[ERROR] Google Books API Unexpected error: {type(e).__name__}: {str(e)}")
-        raise
 
+def is_book_api_debug() -> bool:
+    """デバッグモード: 環境変数、セッションステート、またはStreamlit Cloud環境で有効化"""
+    return (
+        os.getenv("DEBUG_BOOK_API", "").lower() == "true"
+        or st.session_state.get("debug_book_api", False)
+        or detect_streamlit_cloud()
+    )
 
-# キャッシュキーにバージョンを含めて、エラー時のキャッシュを回避
-# バージョンを変更するとキャッシュが無効化される
-_CACHE_VERSION = "v4"  # Streamlit Cloud対応のため更新
 
-@st.cache_data(ttl=60 * 60 * 24, show_spinner=False, max_entries=100)
-def fetch_book_info_google_books(keyword: str, debug: bool = False, cache_version: str = _CACHE_VERSION) -> Optional[Dict[str, Any]]:
-    """
-    Google Books APIからキーワードに最も近い1冊の書誌情報を取得する（無料枠あり）
-    リトライロジック付き（最大3回まで再試行）
-    
-    Args:
-        keyword: 検索キーワード
-        debug: デバッグモード（エラーを画面に表示）
-        cache_version: キャッシュバージョン（キャッシュ無効化用）
-    """
-    max_retries = 3
-    
-    if debug:
-        st.info(f"🔍 Google Books API リクエスト中: {keyword}")
-    
-    for attempt in range(max_retries):
-        try:
-            result = _fetch_book_info_google_books_internal(keyword, debug=debug)
-            if result:
-                if debug:
-                    st.success(f"✅ Google Books API: 本の情報を取得しました: {result.get('title', 'N/A')}")
-                return result
-            else:
-                # 本が見つからない場合
-                if debug and attempt == max_retries - 1:
-                    st.warning(f"⚠️ Google Books API: 「{keyword}」に該当する本が見つかりませんでした。")
-                return None
-        except requests.exceptions.Timeout as e:
-            if attempt < max_retries - 1:
-                if debug:
-                    st.info(f"⏱️ タイムアウト（試行 {attempt + 1}/{max_retries}）、再試行します...")
-                time.sleep(1)  # 1秒待機してから再試行
-                continue
-            error_msg = f"⏱️ Google Books API タイムアウト（{max_retries}回試行）: {str(e)}"
-            print(error_msg)
-            if debug:
-                st.error(error_msg)
-            return None
-        except requests.exceptions.RequestException as e:
-            if attempt < max_retries - 1:
-                if debug:
-                    st.info(f"🌐 リクエストエラー（試行 {attempt + 1}/{max_retries}）、再試行します...")
-                time.sleep(1)  # 1秒待機してから再試行
-                continue
-            error_msg = f"🌐 Google Books API リクエストエラー（{max_retries}回試行）: {type(e).__name__}: {str(e)}"
-            print(error_msg)
-            if debug:
-                st.error(error_msg)
-            return None
-        except Exception as e:
-            if attempt < max_retries - 1:
-                if debug:
-                    st.info(f"❌ エラー（試行 {attempt + 1}/{max_retries}）、再試行します...")
-                time.sleep(1)  # 1秒待機してから再試行
-                continue
-            error_msg = f"❌ Google Books API 予期しないエラー（{max_retries}回試行）: {type(e).__name__}: {str(e)}"
-            print(error_msg)
-            if debug:
-                st.error(error_msg)
-            return None
-    
-    return None
+def is_operator_panel_enabled() -> bool:
+    """運用パネル: 環境変数 BOOK_SEARCH_OPERATOR_PANEL=true または URLの ?ops=1 で表示"""
+    return (
+        os.getenv("BOOK_SEARCH_OPERATOR_PANEL", "").lower() == "true"
+        or st.query_params.get("ops", "") in ("1", "true")
+    )
 
 
-def render_book_summary_section(keyword: str) -> None:
+def render_book_summary_section(keyword: str, book_future: Optional["Future[Any]"] = None) -> None:
     """
     検索結果の下に、本の概要（Google Booksから取得した説明文を5行程度で表示）を表示する
+    
+    Args:
+        keyword: 検索キーワード
+        book_future: 並行検索で先行して投入した書誌情報取得のFuture（省略時はその場で取得）
     """
-    # デバッグモード: 環境変数、セッションステート、またはStreamlit Cloud環境で有効化
-    # Streamlit Cloud環境の検出（複数の環境変数で判定）
-    is_streamlit_cloud = (
-        os.getenv("STREAMLIT_SERVER_PORT") is not None or
-        os.getenv("STREAMLIT_SHARING_MODE") is not None or
-        os.getenv("HOME") == "/home/appuser" or
-        "streamlit.app" in os.getenv("_", "")
-    )
-    debug_mode = os.getenv("DEBUG_BOOK_API", "").lower() == "true" or st.session_state.get("debug_book_api", False) or is_streamlit_cloud
+    is_streamlit_cloud = detect_streamlit_cloud()
+    debug_mode = is_book_api_debug()
     
     try:
-        book = fetch_book_info_google_books(keyword, debug=debug_mode, cache_version=_CACHE_VERSION)
+        if book_future is not None:
+            book = book_future.result()
+        else:
+            book = fetch_book_info_google_books(keyword, debug=debug_mode)
     except Exception as e:
         # Streamlit Cloud環境では常にエラーを表示
         error_msg = f"❌ Google Books API エラー: {type(e).__name__}: {str(e)}"
@@ -590,13 +537,6 @@ def render_book_summary_section(keyword: str) -> None:
     if not book:
         # 本が見つからない場合の処理
         # Streamlit Cloud環境では、エラーの詳細を表示済みのため、簡潔なメッセージのみ
-        is_streamlit_cloud = (
-            os.getenv("STREAMLIT_SERVER_PORT") is not None or
-            os.getenv("STREAMLIT_SHARING_MODE") is not None or
-            os.getenv("HOME") == "/home/appuser" or
-            "streamlit.app" in os.getenv("_", "")
-        )
-        
         if not is_streamlit_cloud:
             # ローカル環境ではフォールバックメッセージを表示
             fallback_link = f"https://www.google.com/search?tbm=bks&q={urllib.parse.quote(keyword)}"
@@ -614,6 +554,50 @@ def render_book_summary_section(keyword: str) -> None:
         # Streamlit Cloud環境では、既にエラーメッセージが表示されているため、何も表示しない
         return
 
+    st.markdown("---")
+    candidates = book.get("candidates") or [book]
+    if len(candidates) > 1:
+        render_book_candidates(keyword, candidates)
+    else:
+        render_book_card(keyword, book)
+
+
+def _candidate_label(book: Dict[str, Any]) -> str:
+    """候補の選択肢に表示する文字列（タイトル・サブタイトル・著者・出版日）"""
+    title = " ".join(t for t in (book.get("title"), book.get("subtitle")) if t)
+    details = [d for d in (" / ".join(book.get("authors") or []), book.get("publishedDate")) if d]
+    return f"{title}（{', '.join(details)}）" if details else title
+
+
+@st.fragment
+def render_book_candidates(keyword: str, candidates: List[Dict[str, Any]]) -> None:
+    """
+    Google Booksの候補を切り替えて本の概要を表示する
+    
+    候補は最初の問い合わせでまとめて取得済みのため、切り替えてもAPIは呼ばない。
+    フラグメントとして描画するので、切り替えで検索全体はやり直さない。
+    
+    Args:
+        keyword: 検索キーワード
+        candidates: 候補の書誌情報（関連度順）
+    """
+    index = st.selectbox(
+        "📚 別の本を表示（Google Booksの候補）",
+        range(len(candidates)),
+        format_func=lambda i: _candidate_label(candidates[i]),
+        key=f"book_candidate_{keyword}",
+    )
+    render_book_card(keyword, candidates[index])
+
+
+def render_book_card(keyword: str, book: Dict[str, Any]) -> None:
+    """
+    本の概要カード（表紙・タイトル・著者・ISBN・説明文）を表示する
+    
+    Args:
+        keyword: 検索キーワード（タイトルがない場合の代わり）
+        book: 書誌情報
+    """
     title = book.get("title") or keyword
     subtitle = book.get("subtitle")
     authors_list = book.get("authors") or []
@@ -656,8 +640,6 @@ def render_book_summary_section(keyword: str) -> None:
     else:
         summary = "（説明文がありません）"
 
-    st.markdown("---")
-    
     # HTMLでリッチなデザインを生成
     # 画像がある場合とない場合でレイアウト調整
     
@@ -699,327 +681,6 @@ def render_book_summary_section(keyword: str) -> None:
     
     st.markdown(html_content, unsafe_allow_html=True)
 
-# ============================================================================
-# 各サイトの在庫チェック関数
-# ============================================================================
-
-def check_gifu_lib(keyword: str) -> Status:
-    """
-    岐阜市立図書館の在庫チェック
-    
-    Args:
-        keyword: 検索キーワード
-    
-    Returns:
-        ステータス情報
-    """
-    try:
-        session = requests.Session()
-        session.headers.update(HEADERS)
-        
-        # セッション初期化
-        session.get(
-            "https://www1.gifu-lib.jp/winj/opac/top.do",
-            timeout=TIMEOUT_SHORT
-        )
-        
-        # 検索実行
-        search_url = "https://www1.gifu-lib.jp/winj/opac/search-standard.do"
-        params = {
-            "txt_word": keyword,
-            "hid_word_column": "fulltext",
-            "submit_btn_searchEasy": "search"
-        }
-        res = session.get(
-            search_url,
-            params=params,
-            timeout=TIMEOUT_SHORT,
-            allow_redirects=True
-        )
-        res.encoding = res.apparent_encoding
-        
-        # 判定（0件表現が複数あるため両方見る）
-        nohit_phrases = (
-            "該当する資料はありません",
-            "該当するリストが存在しません",
-        )
-        if "g-mediacosmos.jp" in res.url or any(p in res.text for p in nohit_phrases):
-            return make_status("なし", "border-ng", "❌")
-        
-        soup = BeautifulSoup(res.text, 'html.parser')
-        page_title = soup.title.string if soup.title else ""
-        if "検索結果" in page_title or "資料検索" in page_title:
-            return make_status("あり", "border-ok", "⭕️")
-        return make_status("あり", "border-ok", "⭕️")
-    except Exception:
-        return make_status("エラー", "border-warn", "⚠️")
-
-
-def check_kani_lib(keyword: str) -> Status:
-    """
-    可児市立図書館の在庫チェック
-    
-    Args:
-        keyword: 検索キーワード
-    
-    Returns:
-        ステータス情報
-    """
-    try:
-        session = requests.Session()
-        session.headers.update(HEADERS)
-        
-        # セッション初期化
-        session.get(
-            "https://www.kani-lib.jp/csp/opw/OPW/OPWSRCH1.CSP?DB=LIB&MODE=1",
-            timeout=TIMEOUT_SHORT
-        )
-        
-        # 検索実行
-        url = "https://www.kani-lib.jp/csp/opw/OPW/OPWSRCHLIST.CSP"
-        params = {
-            "text(1)": keyword,
-            "opr(1)": "OR",
-            "DB": "LIB",
-            "PID": "OPWSRCH1",
-            "FLG": "SEARCH",
-            "MODE": "1",
-            "SORT": "-3",
-            "qual(1)": "MZALL"
-        }
-        res = session.get(url, params=params, timeout=TIMEOUT_MEDIUM)
-        res.encoding = res.apparent_encoding
-        
-        # 判定
-        if "該当する資料はありません" in res.text or "検索結果 0件" in res.text:
-            return make_status("なし", "border-ng", "❌")
-        elif "○ 在架あり" in res.text:
-            return make_status("在庫あり", "border-ok", "⭕️")
-        elif "貸出中" in res.text or "予約" in res.text:
-            return make_status("貸出中", "border-warn", "⚠️")
-        return make_status("あり", "border-ok", "⭕️")
-    except Exception:
-        return make_status("エラー", "border-warn", "⚠️")
-
-
-def check_sanseido(keyword: str) -> Status:
-    """
-    岐阜駅本屋の在庫チェック
-    
-    Args:
-        keyword: 検索キーワード
-    
-    Returns:
-        ステータス情報
-    """
-    try:
-        url = "https://www.books-sanseido.jp/booksearch/BookSearchExec.action"
-        params = {
-            "shopCode": "0458",
-            "keyword": keyword,
-            "defaultShopCode": "",
-            "title": "",
-            "author": "",
-            "isbn": "",
-            "genreCode": "",
-            "search": "検索"
-        }
-        res = requests.get(url, params=params, headers=HEADERS, timeout=TIMEOUT_SHORT)
-        res.encoding = res.apparent_encoding
-
-        # 0件判定（表記ゆれ）
-        if "検索結果：0件" in res.text or "検索結果:0件" in res.text:
-            return make_status("なし", "border-ng", "❌")
-
-        # 件数（例: "<strong>1</strong>件中"）
-        match = re.search(r'<strong>\s*(\d+)\s*</strong>\s*件中', res.text)
-        total = int(match.group(1)) if match else None
-        if total == 0:
-            return make_status("なし", "border-ng", "❌")
-
-        # 在庫（例: "在庫： ×" / "在庫： ○"）
-        stock_marks = re.findall(r'在庫：\s*([○×△▲])', res.text)
-        if stock_marks:
-            if any(mark != "×" for mark in stock_marks):
-                return make_status("在庫あり", "border-ok", "⭕️")
-            return make_status("なし", "border-ng", "❌")
-
-        # フォールバック：ヒットはあるが在庫表現が取れない（要確認）
-        if total is not None and total > 0:
-            return make_status(f"{total}件", "border-warn", "⚠️")
-        return make_status("判定保留", "border-warn", "⚠️")
-    except Exception:
-        return make_status("エラー", "border-warn", "⚠️")
-
-
-def _extract_first_tsutaya_work_id(html: str) -> Optional[str]:
-    """
-    草叢BOOKSキーワード検索結果HTMLから1位のworkIdを抽出（販売リンク）
-    
-    Args:
-        html: HTML文字列
-    
-    Returns:
-        workId文字列、見つからない場合はNone
-    """
-    try:
-        soup = BeautifulSoup(html, "html.parser")
-        anchor = soup.find("a", href=re.compile(r"/search/result/select\?"))
-        if not anchor or not anchor.get("href"):
-            return None
-        match = re.search(r"workId=(\d+)", anchor["href"])
-        return match.group(1) if match else None
-    except Exception:
-        return None
-
-
-def _extract_tsutaya_product_key_from_select(work_id: str) -> Optional[str]:
-    """
-    草叢BOOKSのselectページを開き、productKey(ISBN/JAN)を抽出
-    
-    Args:
-        work_id: 作品ID
-    
-    Returns:
-        productKey文字列、見つからない場合はNone
-    """
-    try:
-        select_url = "https://store-tsutaya.tsite.jp/search/result/select"
-        params = {
-            "saleType": "sell",
-            "workId": work_id,
-            "itemType": "book"
-        }
-        res = requests.get(
-            select_url,
-            params=params,
-            headers=HEADERS,
-            timeout=TIMEOUT_MEDIUM,
-            allow_redirects=True
-        )
-        # ページ内に在庫リンクがある（例: /search/result/stock?...&productKey=978...）
-        match = re.search(r"productKey=(\d+)", res.text)
-        if match:
-            return match.group(1)
-        # リダイレクトURL末尾にISBNが入るケース（.../43575108/978...）
-        match2 = re.search(r"/\d+/(\d{10,13})\b", res.url)
-        return match2.group(1) if match2 else None
-    except Exception:
-        return None
-
-
-def build_tsutaya_urls(
-    keyword: str,
-    store_keyword: str = KUSA_BOOKS_KEYWORD
-) -> Dict[str, Optional[str]]:
-    """
-    草叢BOOKSの検索URLと在庫URLを生成
-    
-    Args:
-        keyword: 検索キーワード
-        store_keyword: 店舗検索キーワード（デフォルト: "各務原"）
-    
-    Returns:
-        検索URL、在庫URL、work_id、product_keyを含む辞書
-    """
-    search_url = (
-        f"https://store-tsutaya.tsite.jp/search/result/"
-        f"?keyword={urllib.parse.quote(keyword)}&itemType=book&limit=20"
-    )
-    try:
-        res = requests.get(search_url, headers=HEADERS, timeout=TIMEOUT_MEDIUM)
-        work_id = _extract_first_tsutaya_work_id(res.text)
-        if not work_id:
-            return {
-                "search_url": search_url,
-                "stock_url": search_url,
-                "work_id": None,
-                "product_key": None
-            }
-        
-        product_key = _extract_tsutaya_product_key_from_select(work_id)
-        if not product_key:
-            return {
-                "search_url": search_url,
-                "stock_url": search_url,
-                "work_id": work_id,
-                "product_key": None
-            }
-        
-        stock_url = (
-            "https://store-tsutaya.tsite.jp/search/result/stock/result"
-            f"?workId={work_id}&saleType=sell&itemType=book&productKey={product_key}"
-            f"&storeSearchKeyword={urllib.parse.quote(store_keyword)}"
-        )
-        return {
-            "search_url": search_url,
-            "stock_url": stock_url,
-            "work_id": work_id,
-            "product_key": product_key
-        }
-    except Exception:
-        return {
-            "search_url": search_url,
-            "stock_url": search_url,
-            "work_id": None,
-            "product_key": None
-        }
-
-
-def check_tsutaya(
-    keyword: str,
-    store_keyword: str = KUSA_BOOKS_KEYWORD
-) -> Tuple[Status, str]:
-    """
-    草叢BOOKSの在庫チェック（1位の候補を採用）
-    
-    Args:
-        keyword: 検索キーワード
-        store_keyword: 店舗検索キーワード（デフォルト: "各務原"）
-    
-    Returns:
-        (ステータス情報, URL)のタプル
-    """
-    try:
-        urls = build_tsutaya_urls(keyword, store_keyword=store_keyword)
-        # そもそも候補が取れない＝判定不可（リンクは検索ページへ）
-        if not urls.get("work_id") or not urls.get("product_key"):
-            return (
-                make_status("判定保留", "border-warn", "⚠️"),
-                urls["stock_url"]
-            )
-
-        res = requests.get(urls["stock_url"], headers=HEADERS, timeout=TIMEOUT_MEDIUM)
-        res.encoding = res.apparent_encoding
-        if "在庫あり" in res.text:
-            return make_status("在庫あり", "border-ok", "⭕️"), urls["stock_url"]
-        if "在庫なし" in res.text or "入荷予定は店舗にお問い合わせ下さい" in res.text:
-            return make_status("なし", "border-ng", "❌"), urls["stock_url"]
-        return make_status("判定保留", "border-warn", "⚠️"), urls["stock_url"]
-    except Exception:
-        return (
-            make_status("エラー", "border-warn", "⚠️"),
-            "https://store-tsutaya.tsite.jp/search/?sheader_item-search"
-        )
-
-
-def check_status(keyword: str) -> Dict[str, Status]:
-    """
-    全サイトの在庫状況をチェック
-    
-    Args:
-        keyword: 検索キーワード
-    
-    Returns:
-        各サイトのステータス情報を含む辞書
-    """
-    return {
-        'gifu': check_gifu_lib(keyword),
-        'kani': check_kani_lib(keyword),
-        'sanseido': check_sanseido(keyword),
-    }
-
-
 # ============================================================================
 # UI生成関数
 # ============================================================================
@@ -1041,6 +702,7 @@ def create_result_card(site_name: str, icon: str, status: Status, url: str) -> s
         "border-ok": "pill-ok",
         "border-ng": "pill-ng",
         "border-warn": "pill-warn",
+        "border-pending": "pill-pending",
     }
     pill_class = pill_class_map.get(status.get("class", ""), "pill-warn")
     return f"""
@@ -1057,74 +719,6 @@ def create_result_card(site_name: str, icon: str, status: Status, url: str) -> s
     """
 
 
-def build_gifu_url(keyword: str) -> str:
-    """
-    岐阜市立図書館の検索URLを生成
-    
-    Args:
-        keyword: 検索キーワード
-    
-    Returns:
-        URL文字列
-    """
-    params = {
-        "lang": "ja",
-        "txt_word": keyword,
-        "hid_word_column": "fulltext",
-        "submit_btn_searchEasy": "search"
-    }
-    base_url = "https://www1.gifu-lib.jp/winj/opac/search-standard.do"
-    return f"{base_url}?{urllib.parse.urlencode(params)}"
-
-
-def build_kani_url(keyword: str) -> str:
-    """
-    可児市立図書館の検索URLを生成
-    
-    Args:
-        keyword: 検索キーワード
-    
-    Returns:
-        URL文字列
-    """
-    params = {
-        "opr(1)": "OR",
-        "DB": "LIB",
-        "PID": "OPWSRCH1",
-        "FLG": "SEARCH",
-        "MODE": "1",
-        "SORT": "-3",
-        "qual(1)": "MZALL",
-        "text(1)": keyword
-    }
-    base_url = "https://www.kani-lib.jp/csp/opw/OPW/OPWSRCHLIST.CSP"
-    return f"{base_url}?{urllib.parse.urlencode(params)}"
-
-
-def build_sanseido_url(keyword: str) -> str:
-    """
-    岐阜駅本屋の検索URLを生成
-    
-    Args:
-        keyword: 検索キーワード
-    
-    Returns:
-        URL文字列
-    """
-    params = {
-        "shopCode": "0458",
-        "keyword": keyword,
-        "defaultShopCode": "",
-        "title": "",
-        "author": "",
-        "isbn": "",
-        "genreCode": "",
-        "search": "検索",
-    }
-    base_url = "https://www.books-sanseido.jp/booksearch/BookSearchExec.action"
-    return f"{base_url}?{urllib.parse.urlencode(params)}"
-
-
 def build_amazon_url(keyword: str) -> str:
     """
     Amazonの検索URLを生成
@@ -1159,14 +753,46 @@ def render_search_results(keyword: str) -> None:
     """
     検索結果を表示
     
+    各カードは「検索中」の状態で先に描画し、サイトの応答が返ってきた順に埋めていく。
+    本の概要も他のカードを待たずに、取得でき次第表示する。
+    制限時間（SEARCH_DEADLINE）を過ぎたら、残りのカードは「タイムアウト」にして打ち切る。
+    
     Args:
         keyword: 検索キーワード
     """
     st.subheader(f"「{keyword}」の検索結果")
 
-    # カスタムローダーを表示
-    loader_placeholder = st.empty()
-    loader_placeholder.markdown(
+    with tracing.trace("search", keyword=keyword, ui=True):
+        _render_search_results(keyword)
+
+
+def _render_search_results(keyword: str) -> None:
+    """検索を実行し、カードと本の概要を結果が届いた順に描画する（render_search_resultsのトレース内で呼ぶ）"""
+    # 検索実行（全サイト + 書誌情報を並行して取得）
+    debug = is_book_api_debug()
+    deadline = time.monotonic() + SEARCH_DEADLINE
+    futures = start_search(
+        keyword,
+        book_fetcher=lambda kw: fetch_book_info_google_books(kw, debug=debug),
+        deadline=deadline,
+    )
+
+    # 2列のグリッド（スマホでも見やすい）に、サイト定義の順でカードを並べる
+    placeholders = {}
+    sites = list(SITE_ADAPTERS.values())
+    for row_start in range(0, len(sites), RESULT_GRID_COLUMNS):
+        columns = st.columns(RESULT_GRID_COLUMNS)
+        for adapter, column in zip(sites[row_start:row_start + RESULT_GRID_COLUMNS], columns):
+            with column:
+                placeholders[adapter.key] = st.empty()
+            placeholders[adapter.key].markdown(
+                create_result_card(adapter.name, adapter.icon, PENDING_STATUS, adapter.build_url(keyword)),
+                unsafe_allow_html=True
+            )
+
+    # 検索結果の下に本の概要を表示（取得中はローダー）
+    summary_placeholder = st.empty()
+    summary_placeholder.markdown(
         """
         <div class="loading-container">
             <div class="loading-dots">
@@ -1174,58 +800,117 @@ def render_search_results(keyword: str) -> None:
                 <div class="loading-dot"></div>
                 <div class="loading-dot"></div>
             </div>
-            <div class="loading-message">📚 各サイトを検索中...</div>
-            <div class="loading-submessage">図書館・書店の在庫を確認しています</div>
+            <div class="loading-message">📖 本の情報を取得中...</div>
+            <div class="loading-submessage">Google Books から概要を読み込んでいます</div>
         </div>
         """,
         unsafe_allow_html=True
     )
-    
-    # 検索実行
-    status = check_status(keyword)
-    tsutaya_status, tsutaya_url = check_tsutaya(keyword, store_keyword=KUSA_BOOKS_KEYWORD)
-    
-    # ローダーを消す
-    loader_placeholder.empty()
 
-    # 2x2 レイアウト（スマホでも見やすい）
-    r1c1, r1c2 = st.columns(2)
-    r2c1, r2c2 = st.columns(2)
-
-    with r1c1:
-        gifu_url = build_gifu_url(keyword)
-        st.markdown(
-            create_result_card("岐阜市立図書館", "🏢", status["gifu"], gifu_url),
+    # 応答が返ってきたものから順に描画（制限時間までに返らなかったものはfutureがNone）
+    for site, future in iter_until_deadline(futures, deadline):
+        if site == "book":
+            if future is None:
+                # 間に合わなかった場合は「取得できなかった」表示にする
+                future = Future()
+                future.set_result(None)
+            with summary_placeholder.container():
+                render_book_summary_section(keyword, book_future=future)
+            continue
+
+        adapter = SITE_ADAPTERS[site]
+        url = adapter.build_url(keyword)
+        result = future.result() if future is not None else core.make_status("タイムアウト", "border-warn", "⏱️")
+        if isinstance(result, tuple):
+            # 草叢BOOKSは在庫ページのURLも返す
+            result, url = result
+        placeholders[site].markdown(
+            create_result_card(adapter.name, adapter.icon, result, url),
             unsafe_allow_html=True
         )
 
-    with r1c2:
-        kani_url = build_kani_url(keyword)
-        st.markdown(
-            create_result_card("可児市立図書館", "🌲", status["kani"], kani_url),
-            unsafe_allow_html=True
-        )
 
-    with r2c1:
-        sanseido_url = build_sanseido_url(keyword)
-        st.markdown(
-            create_result_card("岐阜駅本屋", "📖", status["sanseido"], sanseido_url),
-            unsafe_allow_html=True
+def render_operator_panel() -> None:
+    """
+    運用パネルを表示
+    
+    このプロセスで記録したサイト別の判定結果・所要時間・転送量・再試行回数、
+    検索結果キャッシュのヒット率、手順ごとの応答時間（p50/p99）と現在のタイムアウトを表にする。
+    同じ値はAPIの /metrics からOpenMetrics形式でも取得できる。
+    直近の検索のトレースは一覧にし、Chromeのトレースイベント形式でダウンロードできる。
+    """
+    with st.expander("🛠️ 運用パネル", expanded=False):
+        cache = get_result_cache().stats()
+        col_hit, col_entries, col_coalesced = st.columns(3)
+        col_hit.metric("キャッシュヒット率", f"{cache['hit_ratio']:.0%}")
+        col_entries.metric("キャッシュ件数", cache["entries"])
+        col_coalesced.metric("同時取得の相乗り", cache["coalesced"])
+
+        names = {key: adapter.name for key, adapter in SITE_ADAPTERS.items()}
+        names["google_books"] = "Google Books"
+        st.dataframe(
+            [
+                {
+                    "サイト": names[site],
+                    "チェック数": stats["checks"],
+                    "平均(ms)": stats["avg_ms"],
+                    "判定": " / ".join(f"{text} {count}" for text, count in stats["results"].items()),
+                    "リクエスト": stats["requests"],
+                    "タイムアウト": stats["timeouts"],
+                    "再試行": stats["retries"],
+                    "受信(KB)": round(stats["bytes"] / 1024, 1),
+                    "回路": stats["circuit"],
+                }
+                for site, stats in site_metrics_summary().items()
+            ],
+            hide_index=True,
+            use_container_width=True,
         )
 
-    with r2c2:
-        st.markdown(
-            create_result_card(
-                "草叢BOOKS",
-                "☕",
-                tsutaya_status,
-                tsutaya_url
-            ),
-            unsafe_allow_html=True,
-        )
+        latency = latency_stats()
+        if latency:
+            st.caption("手順ごとの応答時間と現在のタイムアウト（秒: 接続, 読み込み）")
+            st.dataframe(
+                [
+                    {
+                        "サイト/手順": name,
+                        "件数": stats["samples"],
+                        "p50(ms)": stats["p50_ms"],
+                        "p99(ms)": stats["p99_ms"],
+                        "タイムアウト回数": stats["timeouts"],
+                        "タイムアウト": str(stats["timeout"]),
+                    }
+                    for name, stats in latency.items()
+                ],
+                hide_index=True,
+                use_container_width=True,
+            )
 
-    # 検索結果の下に本の概要を表示
-    render_book_summary_section(keyword)
+        traces = tracing.BUFFER.recent(RECENT_TRACES_LIMIT)
+        if traces:
+            st.caption("直近の検索のトレース（ダウンロードしたJSONは chrome://tracing や Perfetto で開ける）")
+            rows = []
+            for item in traces:
+                data = item.to_dict()
+                http_spans = [span for span in data["spans"] if span["name"] == "http"]
+                slowest = max(http_spans, key=lambda span: span["duration_ms"] or 0, default=None)
+                rows.append({
+                    "トレースID": data["trace_id"],
+                    "キーワード": data["attrs"].get("keyword", ""),
+                    "所要(ms)": data["duration_ms"],
+                    "リクエスト数": len(http_spans),
+                    "最も遅いリクエスト": (
+                        f"{slowest['attrs']['site']}/{slowest['attrs']['phase']} ({slowest['duration_ms']}ms)"
+                        if slowest else ""
+                    ),
+                })
+            st.dataframe(rows, hide_index=True, use_container_width=True)
+            st.download_button(
+                "📥 トレースをダウンロード（Chrome trace形式）",
+                data=json.dumps(tracing.to_chrome_trace(traces), ensure_ascii=False),
+                file_name="book_search_traces.json",
+                mime="application/json",
+            )
 
 
 def main() -> None:
@@ -1273,11 +958,16 @@ def main() -> None:
     st.markdown("---")
 
     if should_search:
-        if not keyword_input:
+        # 履歴・キャッシュ・各サイトのURLで同じ正規形を使う
+        keyword = canonicalize_keyword(keyword_input)
+        if not keyword:
             st.warning("⚠️ キーワードを入力してください")
         else:
-            add_to_history(keyword_input)
-            render_search_results(keyword_input)
+            add_to_history(keyword)
+            render_search_results(keyword)
+
+    if is_operator_panel_enabled():
+        render_operator_panel()
 
     st.markdown("<br><br>", unsafe_allow_html=True)
 
@@ -0,0 +1,256 @@
+"""
+読書リストの一括検索（バッチモード）
+
+キーワード・ISBNの一覧ファイル（CSV / JSONL / 1行1件のテキスト）を読み込み、
+同時実行数を抑えながら1件ずつ検索して、終わったものから順にJSONLで書き出す。
+出力ファイルに記録済みのキーワードは飛ばすため、中断しても同じコマンドで再開できる。
+再開時は、検索し直すキーワードの未完了の記録を取り除いてから追記するので、1タイトル1行のまま保たれる。
+"""
+
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from book_search_app.core import canonicalize_keyword, run_search
+
+# 一度に検索するタイトル数（1タイトルで全サイトへ並行アクセスするため控えめにする）
+BATCH_DEFAULT_CONCURRENCY = 4
+
+# CSV / JSONLでキーワードとして読む列名（先に見つかったものを使う）
+BATCH_KEYWORD_FIELDS = ("keyword", "isbn", "title", "キーワード", "ISBN", "書名")
+
+# 再開時に検索し直す（判定できなかった）サイトの結果
+INCOMPLETE_STATUSES = ("タイムアウト", "エラー", "一時停止中")
+
+
+def _pick_keyword(record: Dict[str, Any]) -> str:
+    """CSVの行・JSONLのオブジェクトからキーワードを取り出す"""
+    for name in BATCH_KEYWORD_FIELDS:
+        value = record.get(name)
+        if value:
+            return str(value)
+    return ""
+
+
+def read_keywords(path: str) -> List[str]:
+    """
+    入力ファイルからキーワードを読み込む
+    
+    - .jsonl / .ndjson: 1行1オブジェクト（keyword / isbn / title のいずれか）または文字列
+    - .csv: ヘッダーにkeyword / isbn / titleなどがあればその列、なければ1列目
+    - それ以外: 1行1キーワード
+    
+    空行・重複（正規化後に同じもの）は除く。JSONLのJSONとして読めない行は、行番号を警告して飛ばす。
+    
+    Args:
+        path: 入力ファイルのパス
+    
+    Returns:
+        正規化済みキーワードのリスト（入力順）
+    """
+    ext = os.path.splitext(path)[1].lower()
+    raw: List[str] = []
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if ext in (".jsonl", ".ndjson"):
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    value = json.loads(line)
+                except ValueError:
+                    print(f"[WARN] {path}:{line_no} はJSONとして読めないため飛ばしました", file=sys.stderr)
+                    continue
+                raw.append(_pick_keyword(value) if isinstance(value, dict) else str(value))
+        elif ext == ".csv":
+            rows = list(csv.reader(f))
+            header = rows[0] if rows else []
+            column = next((header.index(n) for n in BATCH_KEYWORD_FIELDS if n in header), None)
+            if column is None:
+                raw.extend(row[0] for row in rows if row)
+            else:
+                raw.extend(row[column] for row in rows[1:] if len(row) > column)
+        else:
+            raw.extend(f.read().splitlines())
+
+    keywords: List[str] = []
+    seen: Set[str] = set()
+    for value in raw:
+        keyword = canonicalize_keyword(value)
+        if keyword and keyword not in seen:
+            seen.add(keyword)
+            keywords.append(keyword)
+    return keywords
+
+
+def load_completed(output_path: str) -> Set[str]:
+    """
+    出力ファイルから検索済み（全サイトの結果が揃って記録済み）のキーワードを読み込む
+    
+    中断時に書きかけになった最終行などの壊れた行は無視する。
+    
+    Args:
+        output_path: 出力JSONLのパス
+    
+    Returns:
+        正規化済みキーワードの集合
+    """
+    completed: Set[str] = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and record.get("keyword") and _is_complete(record):
+                completed.add(record["keyword"])
+    return completed
+
+
+def _is_complete(record: Dict[str, Any]) -> bool:
+    """
+    記録が最後まで検索できた結果か（再開時に検索し直さなくてよいか）
+    
+    制限時間で打ち切られたサイトやエラーになったサイトがある部分的な結果は、未完了として扱う。
+    
+    Args:
+        record: 出力JSONLの1行
+    
+    Returns:
+        完了していればTrue
+    """
+    if "error" in record or record.get("timed_out"):
+        return False
+    sites = record.get("sites") or {}
+    return not any(
+        isinstance(site, dict) and site.get("status") in INCOMPLETE_STATUSES
+        for site in sites.values()
+    )
+
+
+def _drop_superseded(output_path: str, keywords: Set[str]) -> int:
+    """
+    出力ファイルから、これから検索し直すキーワードの記録（未完了の結果）と壊れた行を取り除く
+    
+    一時ファイルに書き出してからos.replaceで置き換えるため、途中で中断しても元のファイルは壊れない。
+    取り除く行がなければファイルには触れない。
+    
+    Args:
+        output_path: 出力JSONLのパス
+        keywords: 検索し直すキーワード
+    
+    Returns:
+        取り除いた行数
+    """
+    if not keywords or not os.path.exists(output_path):
+        return 0
+    kept: List[str] = []
+    dropped = 0
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if not isinstance(record, dict) or record.get("keyword") in keywords:
+                dropped += 1
+                continue
+            kept.append(line if line.endswith("\n") else line + "\n")
+    if dropped:
+        tmp_path = f"{output_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as out:
+            out.writelines(kept)
+        os.replace(tmp_path, output_path)
+    return dropped
+
+
+def _ends_with_newline(path: str) -> bool:
+    """ファイルの末尾が改行で終わっているか"""
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def run_batch(
+    keywords: List[str],
+    output_path: str,
+    concurrency: int = BATCH_DEFAULT_CONCURRENCY,
+    sites: Optional[List[str]] = None,
+    include_book: bool = True,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    キーワードを一括検索し、1件ごとにJSONLへ追記する
+    
+    Args:
+        keywords: 正規化済みキーワードのリスト
+        output_path: 出力JSONLのパス（追記。記録済みのキーワードは飛ばし、未完了の記録は検索し直して置き換える）
+        concurrency: 同時に検索するタイトル数
+        sites: 検索するサイトキー（省略時は全サイト）
+        include_book: 書誌情報も取得するか
+        progress: 1件終わるごとに呼ばれる関数（集計途中の辞書を受け取る）
+    
+    Returns:
+        total / skipped / done / errors / elapsed_sec / titles_per_minute を含む集計
+    """
+    completed = load_completed(output_path)
+    pending = [k for k in keywords if k not in completed]
+    # 検索し直すタイトルの古い記録を消しておき、出力を1タイトル1行に保つ
+    _drop_superseded(output_path, set(pending))
+    stats: Dict[str, Any] = {
+        "total": len(keywords),
+        "skipped": len(keywords) - len(pending),
+        "done": 0,
+        "errors": 0,
+        "elapsed_sec": 0.0,
+        "titles_per_minute": 0.0,
+    }
+    started = time.perf_counter()
+    lock = threading.Lock()
+
+    def search_one(keyword: str) -> Dict[str, Any]:
+        try:
+            return run_search(keyword, sites=sites, include_book=include_book)
+        except Exception as e:
+            return {"keyword": keyword, "error": f"{type(e).__name__}: {e}"}
+
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output_path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="book-batch") as pool:
+        # 中断で最終行が書きかけのまま残っていても、次の記録とつながらないよう改行しておく
+        if out.tell() > 0 and not _ends_with_newline(output_path):
+            out.write("\n")
+        futures = [pool.submit(search_one, keyword) for keyword in pending]
+        for future in as_completed(futures):
+            record = future.result()
+            with lock:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                stats["done"] += 1
+                stats["errors"] += 1 if "error" in record else 0
+                elapsed = time.perf_counter() - started
+                stats["elapsed_sec"] = round(elapsed, 2)
+                stats["titles_per_minute"] = round(stats["done"] / elapsed * 60, 1) if elapsed > 0 else 0.0
+                if progress is not None:
+                    progress(dict(stats))
+    return stats
+
+
+def print_progress(stats: Dict[str, Any]) -> None:
+    """進捗を標準エラーに1行で表示"""
+    remaining = stats["total"] - stats["skipped"] - stats["done"]
+    print(
+        f"[batch] {stats['done']}件完了 / 残り{remaining}件"
+        f"（スキップ{stats['skipped']}件・エラー{stats['errors']}件）"
+        f" {stats['titles_per_minute']} 件/分",
+        file=sys.stderr,
+    )
@@ -0,0 +1,3409 @@
+"""
+書籍横断検索エンジン（Streamlitに依存しないコア）
+
+岐阜市立図書館・可児市立図書館・岐阜駅本屋・草叢BOOKSの在庫チェックと、
+Google Books APIからの書誌情報取得をまとめたモジュール。
+Streamlitアプリ（app.py）のほか、CLI（python -m book_search_app）やバッチ処理、
+テストからも読み込めるよう、Streamlitは一切importしない。
+BeautifulSoupなど重いライブラリは使う時点で読み込む。
+"""
+
+import atexit
+import codecs
+import email.utils
+import contextlib
+import contextvars
+import functools
+import html
+import importlib.util
+import json
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+import urllib.parse
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from book_search_app import tracing
+from book_search_app.metrics import REGISTRY, MetricFamily
+
+# ============================================================================
+# 設定・定数
+# ============================================================================
+
+# HTTP設定
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+HEADERS = {
+    "User-Agent": USER_AGENT,
+    "Accept": "application/json",
+    "Accept-Language": "ja,en-US;q=0.9,en;q=0.8",
+}
+TIMEOUT_SHORT = 10
+TIMEOUT_MEDIUM = 20  # Google Books API用に延長
+
+# 適応タイムアウト設定（サイト・手順ごとの最近の応答時間のp99から(接続, 読み込み)タイムアウトを決める）
+# 上限は各サイトのSiteAdapter.timeout（従来の固定値）。サンプルが揃うまでは上限を使う
+ADAPTIVE_TIMEOUT_WINDOW = 200  # 直近この件数の応答時間で分布を見る
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = 20
+ADAPTIVE_TIMEOUT_FACTOR = 2.0  # p99 × この倍率 + 余裕 をタイムアウトにする
+ADAPTIVE_TIMEOUT_MARGIN = 0.5
+CONNECT_TIMEOUT_FLOOR = 1.0
+CONNECT_TIMEOUT_CEILING = 5.0
+READ_TIMEOUT_FLOOR = 2.0
+
+# 接続プール設定（ホストごとにKeep-Aliveのコネクションを保持して使い回す）
+HTTP_POOL_MAXSIZE = 8  # 1ホストあたりに保持するコネクション数の上限
+
+# 送信レート制限（ホストごとのトークンバケット: 1秒あたりのリクエスト数, 連続で送れる数）
+# 環境変数 BOOK_SEARCH_RATE_LIMITS="ホスト=レート:バースト,..." で上書きできる
+HOST_RATE_LIMITS: Dict[str, Tuple[float, int]] = {
+    "www1.gifu-lib.jp": (2.0, 4),
+    "www.kani-lib.jp": (2.0, 4),
+    "www.books-sanseido.jp": (2.0, 4),
+    "store-tsutaya.tsite.jp": (3.0, 6),  # 1回の判定で最大3ページ読むため少し多め
+    "www.googleapis.com": (5.0, 10),
+}
+HOST_RATE_LIMIT_DEFAULT = (2.0, 4)  # 上記以外（リダイレクト先など）
+
+# 接続先の差し替え（ホスト -> 実際に接続するベースURL）。ベンチマーク・負荷試験でローカルの代役サーバーへ向ける
+# 環境変数 BOOK_SEARCH_HOST_OVERRIDES="ホスト=http://127.0.0.1:ポート,..." で指定できる
+# URL（res.url・リダイレクト先）は元のままなので、サイトごとの判定はそのまま動く
+HOST_OVERRIDES: Dict[str, str] = {}
+
+# OPACセッション設定（図書館の検索前に必要なセッションCookieを使い回す）
+OPAC_SESSION_TTL = 10 * 60  # 最終利用からこの秒数を過ぎたセッションは温め直す
+OPAC_SESSION_POOL_SIZE = 4  # 図書館ごとに保持する温め済みセッション数の上限
+
+# 検索結果キャッシュ設定（TTLはサイトごとにSiteAdapter.cache_ttlで指定）
+RESULT_CACHE_MAX_ENTRIES = 512
+RESULT_CACHE_STALE_TTL = 60 * 60  # TTL切れ後この秒数までは古い結果を即返し、裏で更新する
+BOOK_INFO_CACHE_TTL = 60 * 60 * 24  # 書誌情報（Google Books）はほぼ変わらないので長めに持つ
+
+# サーキットブレーカー設定（落ちているサイトを待たずに「一時停止中」を返す）
+CIRCUIT_FAILURE_THRESHOLD = 3  # 連続でこの回数エラー（タイムアウト含む）になったら停止する
+CIRCUIT_RESET_TIMEOUT = 30  # 停止からこの秒数後に1件だけ試し（half-open）、成功すれば再開する
+
+# 草叢BOOKSの商品特定キャッシュ（キーワード→workId→productKeyの対応をディスクに保存）
+TSUTAYA_RESOLUTION_CACHE_PATH = os.getenv(
+    "TSUTAYA_RESOLUTION_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "book_search_app", "tsutaya_resolution.json"),
+)
+TSUTAYA_RESOLUTION_TTL = 7 * 24 * 60 * 60
+TSUTAYA_RESOLUTION_MAX_ENTRIES = 5000
+TSUTAYA_RESOLUTION_SAVE_DELAY = 2.0  # 更新をまとめてファイルへ書き出すまでの秒数
+
+# 書誌情報の保存先（SQLite。複数プロセスで共有し、再起動・デプロイ後もGoogle Booksを呼び直さない）
+BOOK_STORE_PATH = os.getenv(
+    "BOOK_SEARCH_BOOK_STORE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "book_search_app", "book_info.sqlite3"),
+)
+BOOK_STORE_TTL = float(os.getenv("BOOK_SEARCH_BOOK_STORE_TTL", str(30 * 24 * 60 * 60)))
+BOOK_STORE_NEGATIVE_TTL = float(os.getenv("BOOK_SEARCH_BOOK_STORE_NEGATIVE_TTL", str(24 * 60 * 60)))  # 「該当なし」
+BOOK_STORE_MAX_ENTRIES = int(os.getenv("BOOK_SEARCH_BOOK_STORE_MAX_ENTRIES", "20000"))  # キーワード・本それぞれの上限
+BOOK_STORE_PRUNE_INTERVAL = 100  # この件数を保存するごとに期限切れ・上限超過分を削除する
+# 保存する書誌情報の形式。形式を変えたら上げる（古い形式の行は読まずに取り直す）
+BOOK_INFO_FORMAT = 2
+
+# HTML解析バックエンド（"scan": 最初の一致で打ち切る軽量スキャナ / "html.parser" / "lxml"）
+HTML_PARSER_BACKEND = os.getenv("BOOK_SEARCH_HTML_PARSER", "scan")
+
+# ストリーミング判定設定（本文をチャンクごとに読み、判定が確定した時点で接続を閉じる）
+STREAM_CHUNK_SIZE = 16 * 1024
+STREAM_OVERLAP_CHARS = 256  # チャンク境界をまたぐマーカーを取りこぼさないための重なり
+
+# 並行検索設定（全サイト + 書誌情報を同時に実行。複数セッション分の余裕を持たせる）
+SEARCH_MAX_WORKERS = 16  # サイトが増えた場合は各サイトの同時実行数の合計まで広げる
+# 1回の検索全体の制限時間（秒）。過ぎたら揃った結果だけを返し、残りのサイトは「タイムアウト」にする
+SEARCH_DEADLINE = float(os.getenv("BOOK_SEARCH_DEADLINE", "15"))
+
+# 店舗設定
+KUSA_BOOKS_KEYWORD = "各務原店"
+
+# 外部API（書誌情報）
+GOOGLE_BOOKS_API_URL = "https://www.googleapis.com/books/v1/volumes"
+# 1回の問い合わせで取得する候補数（画面で切り替えられる。1なら最も近い1冊だけ）
+GOOGLE_BOOKS_CANDIDATES = max(1, int(os.getenv("BOOK_SEARCH_BOOK_CANDIDATES", "5")))
+# 部分レスポンス（fields）: 使う項目だけを返させて応答を小さくする
+GOOGLE_BOOKS_FIELDS = (
+    "items(volumeInfo(title,subtitle,authors,publisher,publishedDate,description,categories,"
+    "pageCount,language,imageLinks(thumbnail,smallThumbnail),infoLink,industryIdentifiers))"
+)
+# Google APIはUser-Agentに"gzip"を含めたときだけgzipで圧縮して返す
+GOOGLE_BOOKS_HEADERS = {"User-Agent": f"{USER_AGENT} (gzip)", "Accept-Encoding": "gzip"}
+
+# 型定義
+Status = Dict[str, str]
+RequestTimeout = Union[float, Tuple[float, float]]  # requestsのtimeout引数（秒数、または(接続, 読み込み)）
+
+# ============================================================================
+# プロセス共有リソース
+# ============================================================================
+
+def shared_resource(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    引数ごとに1つだけ生成したオブジェクトをプロセス全体で共有するデコレータ
+    
+    Streamlitのst.cache_resource相当（Streamlitには依存しない）。
+    モジュールは1度しかimportされないため、Streamlitの再実行や複数セッションをまたいでも
+    接続プール・キャッシュ・ワーカープールは1つのまま使い回される。
+    
+    Args:
+        fn: 共有するオブジェクトを生成する関数（引数はハッシュ可能であること）
+    
+    Returns:
+        生成済みのオブジェクトを返す関数（clear()で破棄できる）
+    """
+    instances: Dict[Tuple[Any, ...], Any] = {}
+    lock = threading.RLock()
+
+    @functools.wraps(fn)
+    def wrapper(*args: Any) -> Any:
+        with lock:
+            if args not in instances:
+                instances[args] = fn(*args)
+            return instances[args]
+
+    wrapper.clear = instances.clear  # type: ignore[attr-defined]
+    return wrapper
+
+
+# ============================================================================
+# 運用メトリクス
+# ============================================================================
+
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "book_search_http_request_duration_seconds",
+    "外部リクエストの応答時間（送信からヘッダー受信まで、レート制限の待ちを除く）",
+    ("site", "phase"),
+)
+HTTP_REQUESTS = REGISTRY.counter(
+    "book_search_http_requests",
+    "外部リクエスト数（code: HTTPステータス / timeout / error）",
+    ("site", "phase", "code"),
+)
+HTTP_RESPONSE_BYTES = REGISTRY.counter(
+    "book_search_http_response_bytes",
+    "受信した本文のバイト数（展開後。判定が確定して読むのをやめた分は含まない）",
+    ("site", "phase"),
+)
+SITE_CHECK_DURATION = REGISTRY.histogram(
+    "book_search_site_check_duration_seconds",
+    "在庫チェック1回（キャッシュなし、全手順）の所要時間",
+    ("site",),
+)
+SITE_RESULTS = REGISTRY.counter(
+    "book_search_site_results",
+    "在庫チェックの判定結果（キャッシュなしで実行したもの。outcome: SITE_OUTCOMESのキー）",
+    ("site", "outcome"),
+)
+RETRIES = REGISTRY.counter(
+    "book_search_retries",
+    "再試行ポリシーによる再試行の回数",
+    ("site",),
+)
+BOOK_STORE_LOOKUPS = REGISTRY.counter(
+    "book_search_book_store_lookups",
+    "書誌情報の保存先の参照数（result: hit / not_found / isbn / miss）",
+    ("result",),
+)
+CACHE_REFRESH_FAILURES = REGISTRY.counter(
+    "book_search_cache_refresh_failures",
+    "検索結果キャッシュのバックグラウンド再取得の失敗数（古い結果はそのまま使う）",
+    ("site",),
+)
+
+
+def _collect_runtime_metrics() -> List[MetricFamily]:
+    """
+    キャッシュ・書誌情報の保存先・レート制限・サーキットブレーカーの状態をメトリクスとして集める（出力時に呼ばれる）
+    
+    Returns:
+        (名前, 種類, 説明, サンプル)の一覧
+    """
+    cache = get_result_cache().stats()
+    limits = rate_limiter_stats()
+    breakers = circuit_breaker_stats()
+    store = get_book_info_store().stats()
+    return [
+        ("book_search_cache_lookups", "counter", "検索結果キャッシュの参照数（result: hit / stale / miss）", [
+            ("_total", {"result": "hit"}, cache["hits"]),
+            ("_total", {"result": "stale"}, cache["stale_hits"]),
+            ("_total", {"result": "miss"}, cache["misses"]),
+        ]),
+        ("book_search_cache_coalesced", "counter", "実行中の同じ取得を待って結果を共有した数", [
+            ("_total", {}, cache["coalesced"]),
+        ]),
+        ("book_search_cache_entries", "gauge", "検索結果キャッシュの件数", [
+            ("", {}, cache["entries"]),
+        ]),
+        ("book_search_book_store_entries", "gauge", "書誌情報の保存先の件数（table: searches / books）", [
+            ("", {"table": table}, count) for table, count in store.items()
+        ]),
+        ("book_search_rate_limit_acquired", "counter", "レート制限を通過したリクエスト数", [
+            ("_total", {"host": host}, stats["acquired"]) for host, stats in limits.items()
+        ]),
+        ("book_search_rate_limit_wait_seconds", "counter", "レート制限の順番待ちの合計秒数", [
+            ("_total", {"host": host}, get_rate_limiter(host).total_wait) for host in limits
+        ]),
+        ("book_search_rate_limit_waiting", "gauge", "レート制限で順番待ち中のリクエスト数", [
+            ("", {"host": host}, stats["waiting"]) for host, stats in limits.items()
+        ]),
+        ("book_search_circuit_state", "gauge", "サーキットブレーカーの状態（該当するstateが1）", [
+            ("", {"site": site, "state": state}, 1 if stats["state"] == state else 0)
+            for site, stats in breakers.items()
+            for state in ("closed", "open", "half-open")
+        ]),
+    ]
+
+
+REGISTRY.register_collector(_collect_runtime_metrics)
+
+
+def site_metrics_summary() -> Dict[str, Dict[str, Any]]:
+    """
+    サイトごとの運用メトリクスをまとめて返す（運用パネル表示用）
+    
+    Returns:
+        サイトキー -> {"checks", "avg_ms", "results", "requests", "timeouts", "retries", "bytes", "circuit"}
+    """
+    requests_by_site: Dict[str, Dict[str, float]] = {}
+    for labels, value in HTTP_REQUESTS.items():
+        counts = requests_by_site.setdefault(labels["site"], {})
+        counts[labels["code"]] = counts.get(labels["code"], 0) + value
+    bytes_by_site: Dict[str, float] = {}
+    for labels, value in HTTP_RESPONSE_BYTES.items():
+        bytes_by_site[labels["site"]] = bytes_by_site.get(labels["site"], 0) + value
+    results_by_site: Dict[str, Dict[str, int]] = {}
+    for labels, value in SITE_RESULTS.items():
+        results_by_site.setdefault(labels["site"], {})[SITE_OUTCOMES[labels["outcome"]]] = int(value)
+    breakers = circuit_breaker_stats()
+
+    summary = {}
+    for site in list(SITE_ADAPTERS) + ["google_books"]:
+        checks, total = SITE_CHECK_DURATION.summary(site=site)
+        codes = requests_by_site.get(site, {})
+        summary[site] = {
+            "checks": checks,
+            "avg_ms": round(total / checks * 1000, 1) if checks else None,
+            "results": results_by_site.get(site, {}),
+            "requests": int(sum(codes.values())),
+            "timeouts": int(codes.get("timeout", 0)),
+            "retries": int(RETRIES.value(site=site)),
+            "bytes": int(bytes_by_site.get(site, 0)),
+            "circuit": breakers.get(site, {}).get("state", "closed"),
+        }
+    return summary
+
+
+def _instrument_body(response: requests.Response, site: str, phase: str, http_span: tracing.Span) -> None:
+    """
+    レスポンス本文を読んだバイト数をHTTP_RESPONSE_BYTESに記録し、読み込みを"body"スパンにする
+    
+    stream=Trueの逐次読み込み（scan_response）も、.content / .text の一括読み込みも
+    iter_contentを通るため、インスタンスのiter_contentを包んで数える。
+    スパンは最初のチャンクの要求から読み終わり（または途中で閉じる）までで、
+    read_msはそのうち受信待ちで止まっていた時間。
+    """
+    iter_content = response.iter_content
+
+    def counting_iter_content(*args: Any, **kwargs: Any) -> Iterator[Any]:
+        started = time.perf_counter()
+        received = 0
+        reading = 0.0
+        chunks = iter_content(*args, **kwargs)
+        try:
+            while True:
+                read_started = time.perf_counter()
+                chunk = next(chunks, None)
+                reading += time.perf_counter() - read_started
+                if chunk is None:
+                    break
+                if isinstance(chunk, bytes):
+                    received += len(chunk)
+                    HTTP_RESPONSE_BYTES.inc(len(chunk), site=site, phase=phase)
+                yield chunk
+        finally:
+            tracing.record_span(
+                "body", http_span, started, time.perf_counter(), bytes=received, read_ms=round(reading * 1000, 3)
+            )
+
+    response.iter_content = counting_iter_content  # type: ignore[method-assign]
+
+
+# ============================================================================
+# 検索の制限時間（デッドライン）
+# ============================================================================
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """検索全体の制限時間を使い切ったため、リクエストを送らずに打ち切った"""
+
+
+# 実行中の検索の締め切り（time.monotonic()の値）。submit_search_taskでワーカーへ引き継がれる
+_search_deadline: "contextvars.ContextVar[Optional[float]]" = contextvars.ContextVar(
+    "book_search_deadline", default=None
+)
+
+
+def deadline_remaining() -> Optional[float]:
+    """
+    実行中の検索の残り時間を返す
+    
+    Returns:
+        残り秒数（0以下なら期限切れ）。制限時間のない処理ではNone
+    """
+    deadline = _search_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def deadline_expired() -> bool:
+    """実行中の検索が制限時間を過ぎたか"""
+    remaining = deadline_remaining()
+    return remaining is not None and remaining <= 0
+
+
+def clamp_timeout(timeout: Tuple[float, float]) -> Tuple[float, float]:
+    """
+    (接続, 読み込み)タイムアウトを検索の残り時間に収める
+    
+    Args:
+        timeout: 本来のタイムアウト
+    
+    Returns:
+        残り時間を超えないタイムアウト
+    
+    Raises:
+        DeadlineExceeded: 残り時間がない場合
+    """
+    remaining = deadline_remaining()
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        raise DeadlineExceeded("検索の制限時間を過ぎました")
+    return (min(timeout[0], remaining), min(timeout[1], remaining))
+
+
+def iter_until_deadline(
+    futures: Dict[str, "Future[Any]"],
+    deadline: Optional[float],
+) -> Iterator[Tuple[str, Optional["Future[Any]"]]]:
+    """
+    終わった順にFutureを返し、締め切りを過ぎたら残りをまとめてNoneで返す
+    
+    Args:
+        futures: キー -> Future
+        deadline: 締め切り（time.monotonic()の値。Noneなら全部終わるまで待つ）
+    
+    Yields:
+        (キー, 終わったFuture)。締め切りまでに終わらなかったものは(キー, None)
+    """
+    keys_by_future = {future: key for key, future in futures.items()}
+    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+    try:
+        for future in as_completed(keys_by_future, timeout=timeout):
+            yield keys_by_future.pop(future), future
+    except FuturesTimeoutError:
+        pass
+    for key in keys_by_future.values():
+        yield key, None
+
+
+# ============================================================================
+# 再試行ポリシー
+# ============================================================================
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    一時的な失敗だけを、指数バックオフ＋ジッターで再試行するポリシー
+    
+    - 再試行するのは接続エラー・タイムアウトと、retry_statusesのHTTPステータスだけ
+      （4xxやJSONの解析エラーなど、繰り返しても結果が変わらないものはすぐ諦める）
+    - 待ち時間は base_delay × 2^(試行回数-1) を上限とするランダム値（full jitter）。
+      429/503でRetry-Afterがあればそれに従う
+    - 全試行の合計はtotal_timeout秒まで（各リクエストのタイムアウトもこの残り時間に収める）。
+      検索全体の制限時間があればその短い方
+    
+    Attributes:
+        max_attempts: 最大試行回数（初回を含む）
+        base_delay: 最初の再試行までの待ち時間の上限（秒）
+        max_delay: 1回の待ち時間の上限（秒）
+        total_timeout: 全試行の合計時間の上限（秒）
+        retry_statuses: 再試行するHTTPステータス
+    """
+
+    max_attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 4.0
+    total_timeout: float = 15.0
+    retry_statuses: Tuple[int, ...] = (429, 500, 502, 503, 504)
+
+    def is_retryable(self, outcome: Any) -> bool:
+        """
+        再試行すべき失敗か判定する
+        
+        Args:
+            outcome: 発生した例外、またはレスポンス
+        
+        Returns:
+            再試行すべきならTrue
+        """
+        if isinstance(outcome, requests.Response):
+            return outcome.status_code in self.retry_statuses
+        if isinstance(outcome, DeadlineExceeded):
+            return False
+        if isinstance(outcome, requests.exceptions.HTTPError):
+            return outcome.response is not None and outcome.response.status_code in self.retry_statuses
+        return isinstance(outcome, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+    def delay(self, attempt: int, outcome: Any) -> float:
+        """
+        次の試行までの待ち時間を決める
+        
+        Args:
+            attempt: 失敗した試行の回数（1始まり）
+            outcome: 発生した例外、またはレスポンス
+        
+        Returns:
+            待ち秒数
+        """
+        response = outcome if isinstance(outcome, requests.Response) else getattr(outcome, "response", None)
+        if response is not None and response.status_code in (429, 503):
+            retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, fn: Callable[[], Any], on_retry: Optional[Callable[[int, Any, float], None]] = None) -> Any:
+        """
+        fnを実行し、再試行すべき失敗ならポリシーに従って再試行する
+        
+        fnがrequests.Responseを返す場合は、retry_statusesのステータスも失敗として扱う
+        （最後の試行ではそのまま返す）。
+        
+        Args:
+            fn: 実行する関数（1回分の試行）
+            on_retry: 再試行の前に呼ばれる関数（試行回数, 例外またはレスポンス, 待ち秒数）
+        
+        Returns:
+            fnの戻り値
+        
+        Raises:
+            DeadlineExceeded: 合計時間の上限（または検索の制限時間）内にタイムアウトした場合
+            Exception: 再試行しない失敗、または最後に発生した例外
+        """
+        deadline = time.monotonic() + self.total_timeout
+        outer = _search_deadline.get()
+        token = _search_deadline.set(deadline if outer is None else min(outer, deadline))
+        try:
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    outcome = fn()
+                except Exception as e:
+                    if isinstance(e, requests.exceptions.Timeout) and deadline_expired():
+                        raise DeadlineExceeded("再試行の制限時間を過ぎました") from e
+                    if attempt == self.max_attempts or not self.is_retryable(e):
+                        raise
+                    outcome = e
+                else:
+                    if attempt == self.max_attempts or not self.is_retryable(outcome):
+                        return outcome
+                # 待つと制限時間を過ぎる場合は、最後の結果（例外またはレスポンス）で諦める
+                wait = self.delay(attempt, outcome)
+                remaining = deadline_remaining()
+                if remaining is not None and wait >= remaining:
+                    if isinstance(outcome, Exception):
+                        raise outcome
+                    return outcome
+                if isinstance(outcome, requests.Response):
+                    outcome.close()
+                if on_retry is not None:
+                    on_retry(attempt, outcome, wait)
+                with tracing.span("backoff", attempt=attempt, wait_ms=round(wait * 1000, 1)):
+                    time.sleep(wait)
+        finally:
+            _search_deadline.reset(token)
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Retry-Afterヘッダー（秒数またはHTTP日付）を待ち秒数にする
+    
+    Args:
+        value: ヘッダーの値
+    
+    Returns:
+        待ち秒数（解釈できなければNone）
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+# Google Books: 1回の概要取得は（再試行込みで）最大15秒
+GOOGLE_BOOKS_RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=4.0, total_timeout=15.0)
+
+# 在庫チェック: 各サイトへの負荷を増やさないよう、一時的な失敗を1回だけ再試行する
+SITE_RETRY_POLICY = RetryPolicy(max_attempts=2, base_delay=0.3, max_delay=2.0, total_timeout=TIMEOUT_MEDIUM)
+
+
+# ============================================================================
+# 送信レート制限
+# ============================================================================
+
+def _parse_rate_limits(spec: str) -> Dict[str, Tuple[float, int]]:
+    """
+    BOOK_SEARCH_RATE_LIMITSの値（"ホスト=レート:バースト,..."）を解釈する
+    
+    Args:
+        spec: 環境変数の値（バースト省略時はレートの切り上げ）
+    
+    Returns:
+        ホスト -> (1秒あたりのリクエスト数, バースト)。レートが0以下・バーストが1未満の指定は無視する
+    """
+    limits: Dict[str, Tuple[float, int]] = {}
+    for item in spec.split(","):
+        host, _, value = item.strip().partition("=")
+        if not host or not value:
+            continue
+        rate, _, burst = value.partition(":")
+        try:
+            per_second = float(rate)
+            if not 0 < per_second < float("inf"):
+                raise ValueError(f"レートは正の数で指定してください: {rate}")
+            size = int(burst) if burst else max(1, int(-(-per_second // 1)))
+            if size < 1:
+                raise ValueError(f"バーストは1以上で指定してください: {burst}")
+            limits[host] = (per_second, size)
+        except ValueError:
+            print(f"⚠️ BOOK_SEARCH_RATE_LIMITSの指定を無視しました: {item}")
+    return limits
+
+
+HOST_RATE_LIMITS.update(_parse_rate_limits(os.getenv("BOOK_SEARCH_RATE_LIMITS", "")))
+
+
+def _parse_host_overrides(spec: str) -> Dict[str, str]:
+    """
+    BOOK_SEARCH_HOST_OVERRIDESの値（"ホスト=ベースURL,..."）を解釈する
+    
+    Args:
+        spec: 環境変数の値
+    
+    Returns:
+        ホスト -> 接続先のベースURL（スキーム://ホスト:ポート）
+    """
+    overrides: Dict[str, str] = {}
+    for item in spec.split(","):
+        host, _, target = item.strip().partition("=")
+        parts = urllib.parse.urlsplit(target.strip())
+        if not host or parts.scheme not in ("http", "https") or not parts.netloc:
+            if item.strip():
+                print(f"⚠️ BOOK_SEARCH_HOST_OVERRIDESの指定を無視しました: {item}")
+            continue
+        overrides[host] = f"{parts.scheme}://{parts.netloc}"
+    return overrides
+
+
+HOST_OVERRIDES.update(_parse_host_overrides(os.getenv("BOOK_SEARCH_HOST_OVERRIDES", "")))
+
+
+class TokenBucket:
+    """
+    1ホスト分の送信レート制限（トークンバケット）
+    
+    トークンは毎秒rate個ずつ貯まり、最大burst個まで持てる。1リクエストで1個使う。
+    空きを待つ呼び出しは到着順に送信時刻を予約するため、後から来た呼び出しに追い越されない
+    （公平なFIFO）。予約は一定間隔（1/rate秒）で並ぶので、待ち行列があっても上限ちょうどの速さで流れる。
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._interval = 1.0 / rate
+        # 次の1個が「バーストを使い切った状態」で送れる時刻（GCRAの理論到着時刻）
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.waited = 0
+        self.waiting = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def reserve(self, max_wait: Optional[float] = None) -> Optional[float]:
+        """
+        送信枠を1つ予約し、送信してよくなるまでの待ち秒数を返す（待機はしない）
+        
+        Args:
+            max_wait: これより長く待つ必要があれば予約しない
+        
+        Returns:
+            待ち秒数（0ならすぐ送れる）。max_waitを超える場合はNone
+        """
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_at - (self.burst - 1) * self._interval)
+            wait = start - now
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._next_at = max(self._next_at, start) + self._interval
+            self.acquired += 1
+            if wait > 0:
+                self.waited += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            return wait
+
+    def acquire(self, max_wait: Optional[float] = None) -> Optional[float]:
+        """
+        送信枠を1つ取得する（空きがなければ順番が来るまで待つ）
+        
+        Args:
+            max_wait: これより長く待つ必要があれば取得せずにNoneを返す
+        
+        Returns:
+            実際に待った秒数。取得しなかった場合はNone
+        """
+        wait = self.reserve(max_wait)
+        if wait is not None and wait > 0:
+            with self._lock:
+                self.waiting += 1
+            try:
+                time.sleep(wait)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+        return wait
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        待ち時間の統計を返す
+        
+        Returns:
+            rate / burst / acquired / waited / waiting / avg_wait_ms / max_wait_ms を含む辞書
+        """
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "acquired": self.acquired,
+                "waited": self.waited,
+                "waiting": self.waiting,
+                "avg_wait_ms": round(self.total_wait / self.acquired * 1000, 1) if self.acquired else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 1),
+            }
+
+
+@shared_resource
+def get_rate_limiter(host: str) -> TokenBucket:
+    """
+    ホストごとの送信レート制限を取得（プロセス全体・全セッションで共有）
+    
+    Args:
+        host: ホスト名（ポート付きの場合はそのまま）
+    
+    Returns:
+        TokenBucket
+    """
+    rate, burst = HOST_RATE_LIMITS.get(host, HOST_RATE_LIMIT_DEFAULT)
+    return TokenBucket(rate, burst)
+
+
+_rate_limited_hosts: Set[str] = set()
+_rate_limited_hosts_lock = threading.Lock()  # ワーカースレッドの追加と/health・/metricsの読み出しが重なるため
+
+
+def _note_rate_limited_host(host: str) -> None:
+    """送信したホストをrate_limiter_stats()の対象に加える"""
+    with _rate_limited_hosts_lock:
+        _rate_limited_hosts.add(host)
+
+
+def rate_limiter_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    これまでに送信したホストごとの待ち時間の統計を返す
+    
+    Returns:
+        ホスト -> TokenBucket.stats()
+    """
+    with _rate_limited_hosts_lock:
+        hosts = sorted(_rate_limited_hosts)
+    return {host: get_rate_limiter(host).stats() for host in hosts}
+
+
+# ============================================================================
+# 適応タイムアウト
+# ============================================================================
+
+class LatencyTracker:
+    """
+    1つのサイト・手順（warmup / search など）の応答時間の分布
+    
+    直近ADAPTIVE_TIMEOUT_WINDOW件の「送信からレスポンスヘッダー受信まで」の秒数を保持し、
+    p99に余裕を足した値をタイムアウトにする。タイムアウトした場合はその秒数を記録するので、
+    サイトが遅くなればタイムアウトも上限に向かって伸びる。
+    """
+
+    def __init__(self, window: int = ADAPTIVE_TIMEOUT_WINDOW):
+        self._samples: "deque[float]" = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.timeouts = 0
+
+    def record(self, seconds: float, timed_out: bool = False) -> None:
+        """
+        応答時間を1件記録する
+        
+        Args:
+            seconds: 応答時間（タイムアウトした場合は使ったタイムアウト秒数）
+            timed_out: タイムアウトしたか
+        """
+        with self._lock:
+            self._samples.append(seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        応答時間のパーセンタイルを返す
+        
+        Args:
+            p: パーセント（0〜100）
+        
+        Returns:
+            秒数（サンプルがなければNone）
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+    def timeout(self, ceiling: float) -> Tuple[float, float]:
+        """
+        最近の応答時間から(接続, 読み込み)タイムアウトを決める
+        
+        Args:
+            ceiling: 読み込みタイムアウトの上限（サイトの従来のタイムアウト）
+        
+        Returns:
+            requestsのtimeout引数に渡す(接続秒数, 読み込み秒数)
+        """
+        with self._lock:
+            enough = len(self._samples) >= ADAPTIVE_TIMEOUT_MIN_SAMPLES
+        p99 = self.percentile(99) if enough else None
+        if p99 is None:
+            return (min(CONNECT_TIMEOUT_CEILING, ceiling), ceiling)
+        budget = p99 * ADAPTIVE_TIMEOUT_FACTOR + ADAPTIVE_TIMEOUT_MARGIN
+        read = min(ceiling, max(READ_TIMEOUT_FLOOR, budget))
+        connect = min(CONNECT_TIMEOUT_CEILING, read, max(CONNECT_TIMEOUT_FLOOR, budget))
+        return (round(connect, 2), round(read, 2))
+
+    def stats(self, ceiling: float) -> Dict[str, Any]:
+        """
+        統計を返す
+        
+        Args:
+            ceiling: 読み込みタイムアウトの上限
+        
+        Returns:
+            samples / timeouts / p50_ms / p99_ms / timeout を含む辞書
+        """
+        p50, p99 = self.percentile(50), self.percentile(99)
+        with self._lock:
+            count = len(self._samples)
+        return {
+            "samples": count,
+            "timeouts": self.timeouts,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+            "timeout": self.timeout(ceiling),
+        }
+
+
+@shared_resource
+def get_latency_tracker(site: str, phase: str) -> LatencyTracker:
+    """
+    サイト・手順ごとの応答時間の分布を取得（プロセス全体・全セッションで共有）
+    
+    Args:
+        site: サイトキー（Google Booksは"google_books"）
+        phase: 手順名（SiteAdapter.stepsの名前）
+    
+    Returns:
+        LatencyTracker
+    """
+    return LatencyTracker()
+
+
+# 実行中のリクエストがどのサイト・手順のものか（PoliteHTTPAdapterで応答時間を記録するため）
+_request_phase: "contextvars.ContextVar[Optional[Tuple[str, str]]]" = contextvars.ContextVar(
+    "book_search_request_phase", default=None
+)
+_measured_phases: Dict[Tuple[str, str], float] = {}  # (サイト, 手順) -> タイムアウト上限
+_measured_phases_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def request_phase(site: str, phase: str, ceiling: float) -> Iterator[Tuple[float, float]]:
+    """
+    このブロック内のリクエストの応答時間を(サイト, 手順)の分布に記録する
+    
+    Args:
+        site: サイトキー
+        phase: 手順名
+        ceiling: 読み込みタイムアウトの上限
+    
+    Yields:
+        このリクエストに使う(接続, 読み込み)タイムアウト（検索の残り時間に収めたもの）
+    
+    Raises:
+        DeadlineExceeded: 検索の制限時間を使い切っている場合
+    """
+    timeout = clamp_timeout(get_latency_tracker(site, phase).timeout(ceiling))
+    with _measured_phases_lock:
+        _measured_phases[(site, phase)] = ceiling
+    token = _request_phase.set((site, phase))
+    try:
+        yield timeout
+    finally:
+        _request_phase.reset(token)
+
+
+def latency_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    これまでに記録したサイト・手順ごとの応答時間と現在のタイムアウトを返す
+    
+    Returns:
+        "サイト/手順" -> LatencyTracker.stats()
+    """
+    with _measured_phases_lock:
+        phases = sorted(_measured_phases.items())
+    return {
+        f"{site}/{phase}": get_latency_tracker(site, phase).stats(ceiling)
+        for (site, phase), ceiling in phases
+    }
+
+
+# ============================================================================
+# HTTP接続プール
+# ============================================================================
+
+class _TracedHTTPConnection(HTTPConnection):
+    """新しく接続するとき（DNS解決・TCP接続）を"connect"スパンに記録する"""
+
+    def connect(self) -> None:
+        with tracing.span("connect", host=self.host):
+            super().connect()
+
+
+class _TracedHTTPSConnection(HTTPSConnection):
+    """新しく接続するとき（DNS解決・TCP接続・TLSハンドシェイク）を"connect"スパンに記録する"""
+
+    def connect(self) -> None:
+        with tracing.span("connect", host=self.host, tls=True):
+            super().connect()
+
+
+class _TracedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TracedHTTPConnection
+
+
+class _TracedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TracedHTTPSConnection
+
+
+class PoliteHTTPAdapter(HTTPAdapter):
+    """
+    送信前に送信先ホストのレート制限を通すHTTPAdapter
+    
+    在庫チェック・Google Booksを含む全リクエスト（リダイレクト先も）がここを通るため、
+    セッションやバッチ処理がいくつ並んでもホストごとの上限を超えない。
+    request_phase()の中で送られたリクエストは、レート制限の待ち時間を除いた
+    応答時間（ヘッダー受信まで）を記録する。順番待ちが検索の制限時間を超える場合は送らない。
+    リクエスト数・応答時間・受信バイト数は運用メトリクスにも記録する（サイト外はホスト名で）。
+    トレース中は1リクエストを"http"スパンにし、レート制限の待ち・新規接続・本文の読み込みを子スパンにする
+    （スパンの長さから子スパンを引いた残りが、送信から最初の応答までの時間）。
+    HOST_OVERRIDESにあるホストは、URLを変えずに接続先だけ差し替える（プロキシも使わない）。
+    """
+
+    def get_connection_with_tls_context(self, request: requests.PreparedRequest, verify: Any, proxies: Any = None, cert: Any = None) -> Any:
+        target = HOST_OVERRIDES.get(urllib.parse.urlsplit(request.url).netloc)
+        if target is not None:
+            return self.poolmanager.connection_from_url(target)
+        return super().get_connection_with_tls_context(request, verify, proxies=proxies, cert=cert)
+
+    def request_url(self, request: requests.PreparedRequest, proxies: Any) -> str:
+        if urllib.parse.urlsplit(request.url).netloc in HOST_OVERRIDES:
+            return request.path_url
+        return super().request_url(request, proxies)
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TracedHTTPConnectionPool,
+            "https": _TracedHTTPSConnectionPool,
+        }
+
+    def send(self, request: requests.PreparedRequest, *args: Any, **kwargs: Any) -> requests.Response:
+        host = urllib.parse.urlsplit(request.url).netloc
+        phase = _request_phase.get()
+        site, step = phase or (host, "")
+        with tracing.span("http", site=site, phase=step, method=request.method, url=request.url) as http_span:
+            _note_rate_limited_host(host)
+            with tracing.span("rate_limit", host=host) as wait_span:
+                waited = get_rate_limiter(host).acquire(max_wait=deadline_remaining())
+                wait_span.set(waited_ms=round((waited or 0.0) * 1000, 3))
+            if waited is None:
+                raise DeadlineExceeded(f"{host} の送信待ちが検索の制限時間を超えます", request=request)
+            response = self._send_measured(request, site, step, phase, *args, **kwargs)
+            http_span.set(status=response.status_code)
+            _instrument_body(response, site, step, http_span)
+            return response
+
+    def _send_measured(
+        self,
+        request: requests.PreparedRequest,
+        site: str,
+        step: str,
+        phase: Optional[Tuple[str, str]],
+        *args: Any,
+        **kwargs: Any,
+    ) -> requests.Response:
+        """送信して応答ヘッダーを受け取るまでの時間を応答時間・メトリクスに記録する"""
+        started = time.monotonic()
+        try:
+            response = super().send(request, *args, **kwargs)
+        except requests.exceptions.Timeout as e:
+            HTTP_REQUESTS.inc(site=site, phase=step, code="timeout")
+            # 検索の制限時間で短く切ったタイムアウトはサイトの遅さではないので記録しない
+            if phase is not None and not deadline_expired():
+                get_latency_tracker(*phase).record(_timed_out_after(e, kwargs.get("timeout"), started), True)
+            raise
+        except requests.exceptions.RequestException:
+            HTTP_REQUESTS.inc(site=site, phase=step, code="error")
+            raise
+        elapsed = time.monotonic() - started
+        HTTP_REQUESTS.inc(site=site, phase=step, code=str(response.status_code))
+        HTTP_REQUEST_DURATION.observe(elapsed, site=site, phase=step)
+        if phase is not None:
+            get_latency_tracker(*phase).record(elapsed)
+        return response
+
+
+def _timed_out_after(error: requests.exceptions.Timeout, timeout: Any, started: float) -> float:
+    """
+    タイムアウトしたリクエストの応答時間として記録する秒数
+    
+    (接続, 読み込み)の指定なら、接続でのタイムアウトは接続の上限、それ以外は読み込みの上限にする。
+    
+    Args:
+        error: 発生したタイムアウト
+        timeout: requestsに渡したtimeout引数
+        started: 送信を始めた時刻（time.monotonic()）
+    
+    Returns:
+        秒数
+    """
+    if isinstance(timeout, tuple):
+        return timeout[0] if isinstance(error, requests.exceptions.ConnectTimeout) else timeout[-1]
+    return timeout or time.monotonic() - started
+
+
+@shared_resource
+def get_http_adapter(host: str) -> HTTPAdapter:
+    """
+    ホストごとの接続プール（HTTPAdapter）を取得（プロセス全体で共有）
+    
+    全セッション・全検索で同じアダプタを使うため、DNS解決やTCP/TLSハンドシェイクは
+    初回のみで、以降はKeep-Aliveのコネクションが再利用される。
+    HTTPAdapter（urllib3のPoolManager）はスレッドセーフ。
+    送信前にホストごとのレート制限を通す（PoliteHTTPAdapter）。
+    
+    Args:
+        host: ホスト名（空文字列はリダイレクト先など未登録ホスト用の共有プール）
+    
+    Returns:
+        HTTPAdapter
+    """
+    return PoliteHTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_MAXSIZE)
+
+
+def open_http_session(url: str, trust_env: bool = True) -> requests.Session:
+    """
+    共有接続プールを使うrequests.Sessionを生成
+    
+    Cookieは呼び出しごとに独立させたいので、Session自体は都度生成し、
+    コネクションを持つアダプタだけを共有する。共有アダプタを閉じないよう、
+    返したSessionのclose()は呼ばないこと。
+    
+    Args:
+        url: 接続先URL（このURLのホスト用プールをマウントする）
+        trust_env: Falseにすると環境変数のプロキシ設定を無視する
+    
+    Returns:
+        requests.Session
+    """
+    parsed = urllib.parse.urlsplit(url)
+    session = requests.Session()
+    session.trust_env = trust_env
+    session.headers.update(HEADERS)
+    session.mount("https://", get_http_adapter(""))
+    session.mount("http://", get_http_adapter(""))
+    session.mount(f"{parsed.scheme}://{parsed.netloc}/", get_http_adapter(parsed.netloc))
+    return session
+
+
+class OpacSessionPool:
+    """
+    温め済み（セッションCookie取得済み）のOPACセッションを保持するプール
+    
+    図書館OPACは検索前にトップページでセッションCookieを受け取る必要がある。
+    温めたセッションを有効期限付きで保持し、次の検索では検索リクエスト1回だけで済ませる。
+    同じセッションを同時に2つの検索で使わないよう、貸し出し（acquire）と返却（release）で管理する。
+    """
+
+    def __init__(self, warmup_url: str, ttl: float = OPAC_SESSION_TTL, max_idle: int = OPAC_SESSION_POOL_SIZE):
+        self.warmup_url = warmup_url
+        self.ttl = ttl
+        self.max_idle = max_idle
+        self._idle: List[Tuple[requests.Session, float]] = []  # (セッション, 有効期限)
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: RequestTimeout) -> Tuple[requests.Session, bool]:
+        """
+        温め済みセッションを借りる（なければ新しく温める）
+        
+        Args:
+            timeout: 温め直しリクエストのタイムアウト秒数
+        
+        Returns:
+            (セッション, 今回温めたかどうか)のタプル
+        """
+        now = time.time()
+        with self._lock:
+            while self._idle:
+                session, expires_at = self._idle.pop()
+                if expires_at > now:
+                    return session, False
+        return self.warm(timeout), True
+
+    def warm(self, timeout: RequestTimeout) -> requests.Session:
+        """
+        新しいセッションを作り、トップページにアクセスしてCookieを受け取る
+        
+        Args:
+            timeout: タイムアウト秒数
+        
+        Returns:
+            温め済みセッション
+        """
+        session = open_http_session(self.warmup_url)
+        session.get(self.warmup_url, timeout=timeout)
+        return session
+
+    def release(self, session: requests.Session) -> None:
+        """
+        使い終わったセッションを返却する
+        
+        有効期限は「最終利用 + TTL」と、Cookieに期限があればその早い方。
+        
+        Args:
+            session: acquireで借りたセッション
+        """
+        expires_at = time.time() + self.ttl
+        cookie_expiries = [c.expires for c in session.cookies if c.expires]
+        if cookie_expiries:
+            expires_at = min(expires_at, min(cookie_expiries))
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append((session, expires_at))
+
+    def is_rejected(self, res: requests.Response) -> bool:
+        """
+        セッション切れなどで検索が受け付けられなかったかを判定
+        
+        エラーステータス、またはトップページ（温め用URL）へ戻された場合を拒否とみなす。
+        
+        Args:
+            res: 検索リクエストのレスポンス
+        
+        Returns:
+            拒否された場合True
+        """
+        if res.status_code >= 400:
+            return True
+        warmup = urllib.parse.urlsplit(self.warmup_url)
+        landed = urllib.parse.urlsplit(res.url)
+        return landed.netloc == warmup.netloc and landed.path == warmup.path
+
+
+@shared_resource
+def get_opac_session_pool(site: str) -> OpacSessionPool:
+    """
+    図書館ごとのOPACセッションプールを取得（プロセス全体で共有）
+    
+    Args:
+        site: サイトキー（warmup_urlを持つSITE_ADAPTERSのキー）
+    
+    Returns:
+        OpacSessionPool
+    """
+    return OpacSessionPool(SITE_ADAPTERS[site].warmup_url)
+
+
+def site_get(
+    site: str,
+    phase: str,
+    url: str,
+    session: Optional[requests.Session] = None,
+    **kwargs: Any,
+) -> requests.Response:
+    """
+    サイトの1手順分のGETを、適応タイムアウトと再試行ポリシー（SiteAdapter.retry）付きで送る
+    
+    Args:
+        site: サイトキー
+        phase: 手順名（SiteAdapter.stepsの名前）
+        url: URL
+        session: 使うセッション（省略時は共有接続プールの新しいセッション）
+        **kwargs: session.getへ渡す追加引数（timeoutは指定しない）
+    
+    Returns:
+        レスポンス
+    """
+    adapter = SITE_ADAPTERS[site]
+    session = session or open_http_session(url)
+
+    def attempt() -> requests.Response:
+        with request_phase(site, phase, adapter.timeout) as timeout:
+            return session.get(url, timeout=timeout, **kwargs)
+
+    return adapter.retry.call(attempt, on_retry=lambda *_: RETRIES.inc(site=site))
+
+
+@contextlib.contextmanager
+def opac_search(site: str, url: str, params: Dict[str, str], **kwargs: Any) -> Iterator[requests.Response]:
+    """
+    温め済みセッションでOPACを検索する（withの中で本文を読む）
+    
+    使い回したセッションが期限切れ等で拒否された場合のみ、温め直して1回だけ再検索する。
+    タイムアウトは温め（warmup）・検索（search）それぞれの最近の応答時間から決める。
+    本文を読み終える（withを抜ける）までセッションはプールに返さないため、
+    ストリーミングで読んでいる途中のセッションを別の検索が使うことはない。
+    
+    Args:
+        site: サイトキー（warmup_urlを持つSITE_ADAPTERSのキー）
+        url: 検索URL
+        params: クエリパラメータ
+        **kwargs: session.getへ渡す追加引数
+    
+    Yields:
+        検索結果のレスポンス（withを抜けると閉じる）
+    """
+    pool = get_opac_session_pool(site)
+    ceiling = SITE_ADAPTERS[site].timeout
+
+    with request_phase(site, "warmup", ceiling) as timeout:
+        session, warmed = pool.acquire(timeout)
+    res = site_get(site, "search", url, session=session, params=params, **kwargs)
+    if not warmed and pool.is_rejected(res):
+        res.close()
+        with request_phase(site, "warmup", ceiling) as timeout:
+            session = pool.warm(timeout)
+        res = site_get(site, "search", url, session=session, params=params, **kwargs)
+    try:
+        yield res
+    finally:
+        res.close()
+        if not pool.is_rejected(res):
+            pool.release(session)
+
+
+# ============================================================================
+# HTML解析
+# ============================================================================
+
+class HtmlParserBackend:
+    """
+    スクレイピングで使うHTML抽出処理の共通インターフェース
+    
+    各チェック関数が必要とするのは<title>や最初のリンクなどごく一部なので、
+    その抽出だけを定義し、実装（バックエンド）を差し替えられるようにする。
+    """
+
+    name = ""
+
+    def title(self, html_text: str) -> str:
+        """<title>の文字列を返す（なければ空文字列）"""
+        raise NotImplementedError
+
+    def first_href(self, html_text: str, pattern: "re.Pattern[str]") -> Optional[str]:
+        """hrefがpatternに一致する最初の<a>のhrefを返す（なければNone）"""
+        raise NotImplementedError
+
+
+class SoupParserBackend(HtmlParserBackend):
+    """BeautifulSoupでDOM全体を構築して抽出するバックエンド（html.parser / lxml）"""
+
+    def __init__(self, features: str):
+        self.name = features
+        self.features = features
+
+    def _soup(self, html_text: str) -> Any:
+        # BeautifulSoupは読み込みに時間がかかるため、このバックエンドを使うときだけimportする
+        from bs4 import BeautifulSoup
+        return BeautifulSoup(html_text, self.features)
+
+    def title(self, html_text: str) -> str:
+        soup = self._soup(html_text)
+        return (soup.title.string or "") if soup.title else ""
+
+    def first_href(self, html_text: str, pattern: "re.Pattern[str]") -> Optional[str]:
+        soup = self._soup(html_text)
+        anchor = soup.find("a", href=pattern)
+        return anchor.get("href") if anchor else None
+
+
+class ScanParserBackend(HtmlParserBackend):
+    """
+    DOMを作らずに文字列を走査し、最初の一致で打ち切るバックエンド
+    
+    <title>はページ先頭付近にあり、草叢BOOKSの1位の候補も結果一覧の最初のリンクなので、
+    ページ全体を解析せずに済む。
+    """
+
+    name = "scan"
+    _TITLE_RE = re.compile(r"<title[^>]*>(.*?)</title\s*>", re.IGNORECASE | re.DOTALL)
+    _ANCHOR_HREF_RE = re.compile(r"""<a\b[^>]*?\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+
+    def title(self, html_text: str) -> str:
+        match = self._TITLE_RE.search(html_text)
+        return html.unescape(match.group(1)).strip() if match else ""
+
+    def first_href(self, html_text: str, pattern: "re.Pattern[str]") -> Optional[str]:
+        for match in self._ANCHOR_HREF_RE.finditer(html_text):
+            href = html.unescape(match.group(1) or match.group(2) or match.group(3) or "")
+            if pattern.search(href):
+                return href
+        return None
+
+
+HTML_PARSER_BACKENDS: Dict[str, HtmlParserBackend] = {
+    "scan": ScanParserBackend(),
+    "html.parser": SoupParserBackend("html.parser"),
+    "lxml": SoupParserBackend("lxml"),
+}
+
+
+def get_html_parser(name: Optional[str] = None) -> HtmlParserBackend:
+    """
+    HTML解析バックエンドを取得
+    
+    lxmlが指定されてもインストールされていない場合はhtml.parserを使う。
+    
+    Args:
+        name: バックエンド名（省略時はHTML_PARSER_BACKEND）
+    
+    Returns:
+        HtmlParserBackend
+    """
+    name = name or HTML_PARSER_BACKEND
+    if name == "lxml" and importlib.util.find_spec("lxml") is None:
+        name = "html.parser"
+    return HTML_PARSER_BACKENDS.get(name) or HTML_PARSER_BACKENDS["scan"]
+
+
+# ============================================================================
+# レスポンス判定（ストリーミング）
+# ============================================================================
+
+_META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?([A-Za-z0-9_\-]+)""", re.IGNORECASE)
+
+
+def _detect_stream_encoding(res: requests.Response, head: bytes, declared: Optional[str] = None) -> str:
+    """
+    本文を読み切らずに文字コードを決める（本文全体の文字コード推定は行わない）
+    
+    Content-Typeのcharset、サイト定義で宣言された文字コード、先頭チャンクの<meta charset>の順に見て、
+    なければUTF-8。
+    
+    Args:
+        res: stream=Trueで取得したレスポンス
+        head: 本文の先頭チャンク
+        declared: サイト定義で宣言された文字コード
+    
+    Returns:
+        エンコーディング名
+    """
+    if "charset" in (res.headers.get("Content-Type") or "").lower() and res.encoding:
+        return res.encoding
+    if declared:
+        return declared
+    match = _META_CHARSET_RE.search(head)
+    if match:
+        try:
+            return codecs.lookup(match.group(1).decode("ascii")).name
+        except LookupError:
+            pass
+    return "utf-8"
+
+
+def scan_response(
+    res: requests.Response,
+    markers: Dict[str, str],
+    decisive: Tuple[str, ...] = (),
+    encoding: Optional[str] = None,
+) -> Dict[str, List[str]]:
+    """
+    レスポンス本文をチャンクごとに読みながら、全マーカーを1回の走査で探す
+    
+    マーカーは1つの正規表現（名前付きグループの選択）にまとめて照合する。
+    decisiveに含まれるマーカーが見つかった時点で判定は確定とみなし、
+    残りの本文は読まずに接続を閉じる。
+    
+    Args:
+        res: stream=Trueで取得したレスポンス
+        markers: マーカー名 -> 正規表現（グループがあれば1番目のグループの値を記録）
+        decisive: 見つかった時点で読み込みを打ち切るマーカー名
+        encoding: サイト定義で宣言された文字コード（ヘッダーにcharsetがなければこれを使う）
+    
+    Returns:
+        マーカー名 -> 一致した文字列のリスト（見つからなかったマーカーは含まない）
+    """
+    patterns = {name: re.compile(pattern) for name, pattern in markers.items()}
+    combined = re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern in markers.items()))
+    found: Dict[str, List[str]] = {}
+    decoder = None
+    tail = ""
+    scan_span = tracing.current_span()
+    try:
+        for chunk in res.iter_content(STREAM_CHUNK_SIZE):
+            if decoder is None:
+                with tracing.span("detect_encoding") as encoding_span:
+                    detected = _detect_stream_encoding(res, chunk, encoding)
+                    encoding_span.set(encoding=detected)
+                decoder = codecs.getincrementaldecoder(detected)(errors="replace")
+            text = tail + decoder.decode(chunk)
+            for match in combined.finditer(text):
+                # 前回の重なり部分だけに収まる一致は前のチャンクで記録済み
+                if match.end() <= len(tail):
+                    continue
+                name = next(n for n in markers if match.group(n) is not None)
+                inner = patterns[name].match(match.group(name))
+                value = inner.group(1) if inner and inner.groups() else match.group(name)
+                found.setdefault(name, []).append(value)
+            if any(name in found for name in decisive):
+                scan_span.set(stopped_early=True)
+                break
+            tail = text[-STREAM_OVERLAP_CHARS:]
+    finally:
+        res.close()
+    scan_span.set(found=sorted(found))
+    return found
+
+
+# ============================================================================
+# ユーティリティ関数
+# ============================================================================
+
+def make_status(text: str, css_class: str, icon: str, cacheable: bool = True) -> Status:
+    """
+    ステータス情報を生成する
+    
+    Args:
+        text: ステータステキスト
+        css_class: CSSクラス名
+        icon: アイコン文字列
+        cacheable: Falseにすると検索結果キャッシュに保存しない（例外・タイムアウト・一時停止から作った結果）
+    
+    Returns:
+        ステータス辞書（キャッシュしない結果には "cacheable": False が入る）
+    """
+    status = {"text": text, "class": css_class, "icon": icon}
+    if not cacheable:
+        status["cacheable"] = False
+    return status
+
+
+# 判定結果のラベル -> 表示名。ラベルは表示文言（「3件」など）ではなく決まった値にし、種類が増え続けないようにする
+SITE_OUTCOMES = {
+    "found": "あり",
+    "not_found": "なし",
+    "on_loan": "貸出中",
+    "undetermined": "判定保留",
+    "error": "エラー",
+    "timeout": "タイムアウト",
+    "paused": "一時停止中",
+}
+_OUTCOME_BY_TEXT = {"貸出中": "on_loan", "エラー": "error", "タイムアウト": "timeout", "一時停止中": "paused"}
+_OUTCOME_BY_CLASS = {"border-ok": "found", "border-ng": "not_found"}
+
+
+def status_outcome(status: Status) -> str:
+    """
+    ステータス情報を判定結果のラベル（SITE_OUTCOMESのキー）にまとめる
+    
+    Args:
+        status: ステータス情報
+    
+    Returns:
+        "found" / "not_found" / "on_loan" / "undetermined" / "error" / "timeout" / "paused"
+    """
+    return _OUTCOME_BY_TEXT.get(status["text"]) or _OUTCOME_BY_CLASS.get(status["class"], "undetermined")
+
+
+# 表記ゆれの多い記号を1つに寄せる（NFKC後に適用）
+_PUNCTUATION_FOLD = str.maketrans({
+    "\u2010": "-", "\u2011": "-", "\u2012": "-", "\u2013": "-",
+    "\u2014": "-", "\u2015": "-", "\u2212": "-", "\ufe63": "-",
+    "\u301c": "~",
+    "\u2018": "'", "\u2019": "'", "\u201c": '"', "\u201d": '"',
+})
+_ISBN_PATTERN = re.compile(r"^(?:ISBN(?:-?1[03])?:?\s*)?([0-9][0-9\- ]{8,16}[0-9X])$", re.IGNORECASE)
+
+
+def _normalize_isbn(text: str) -> Optional[str]:
+    """
+    ISBNらしき文字列をハイフンなしのISBN-13に揃える
+    
+    Args:
+        text: NFKC正規化済みの文字列
+    
+    Returns:
+        ISBN-13（13桁の数字）、ISBNとして妥当でなければNone
+    """
+    match = _ISBN_PATTERN.match(text)
+    if not match:
+        return None
+    digits = re.sub(r"[\- ]", "", match.group(1)).upper()
+    if len(digits) == 10 and re.fullmatch(r"\d{9}[\dX]", digits):
+        check = sum((10 - i) * (10 if c == "X" else int(c)) for i, c in enumerate(digits))
+        if check % 11 != 0:
+            return None
+        digits = "978" + digits[:9]
+        return digits + str((10 - sum((3 if i % 2 else 1) * int(c) for i, c in enumerate(digits)) % 10) % 10)
+    if len(digits) == 13 and digits.isdigit():
+        if sum((3 if i % 2 else 1) * int(c) for i, c in enumerate(digits)) % 10 != 0:
+            return None
+        return digits
+    return None
+
+
+def canonicalize_keyword(keyword: str) -> str:
+    """
+    検索キーワードを正規形に揃える
+    
+    キャッシュキー・検索履歴・各サイトのURL生成で同じ正規形を使うことで、
+    全角/半角や空白、ISBNのハイフン有無による重複検索をなくす。
+    
+    - NFKC正規化（全角英数・全角スペースなどを半角に）
+    - ダッシュ・波ダッシュ・引用符の表記ゆれを統一
+    - 前後の空白を除去し、連続する空白を1つに
+    - ISBN-10/ISBN-13（ハイフン・"ISBN"接頭辞あり/なし）はハイフンなしのISBN-13に
+    
+    Args:
+        keyword: 入力されたキーワード
+    
+    Returns:
+        正規化済みキーワード（空の入力には空文字列）
+    """
+    text = unicodedata.normalize("NFKC", keyword or "").translate(_PUNCTUATION_FOLD)
+    text = " ".join(text.split())
+    return _normalize_isbn(text) or text
+
+
+class BookInfoUnavailable(Exception):
+    """Google Booksから書誌情報を取得できなかった（通信エラー・タイムアウトなど。「該当なし」とは区別する）"""
+
+
+def build_google_books_params(keyword: str) -> Dict[str, Any]:
+    """
+    Google Books APIの検索パラメータを生成
+    
+    Args:
+        keyword: 検索キーワード
+    
+    Returns:
+        クエリパラメータの辞書（候補数・部分レスポンスの項目を含む）
+    """
+    return {
+        "q": keyword,
+        "maxResults": GOOGLE_BOOKS_CANDIDATES,
+        "printType": "books",
+        "fields": GOOGLE_BOOKS_FIELDS,
+    }
+
+
+def _parse_google_books_volume(volume_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Google BooksのvolumeInfoを画面・APIで使う書誌情報の辞書に変換する"""
+    identifiers = volume_info.get("industryIdentifiers") or []
+    isbn_13 = None
+    isbn_10 = None
+    for it in identifiers:
+        if (it or {}).get("type") == "ISBN_13":
+            isbn_13 = (it or {}).get("identifier")
+        if (it or {}).get("type") == "ISBN_10":
+            isbn_10 = (it or {}).get("identifier")
+
+    image_links = volume_info.get("imageLinks") or {}
+    return {
+        "title": volume_info.get("title"),
+        "subtitle": volume_info.get("subtitle"),
+        "authors": volume_info.get("authors") or [],
+        "publisher": volume_info.get("publisher"),
+        "publishedDate": volume_info.get("publishedDate"),
+        "description": volume_info.get("description"),
+        "categories": volume_info.get("categories") or [],
+        "pageCount": volume_info.get("pageCount"),
+        "language": volume_info.get("language"),
+        "thumbnail": image_links.get("thumbnail") or image_links.get("smallThumbnail"),
+        "infoLink": volume_info.get("infoLink"),
+        "isbn13": isbn_13,
+        "isbn10": isbn_10,
+    }
+
+
+def _parse_google_books_candidates(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Google Books APIの応答から候補の書誌情報を関連度順に取り出す
+    
+    Args:
+        data: APIの応答（JSON）
+    
+    Returns:
+        書誌情報のリスト（タイトルのない項目は除く）
+    """
+    candidates = []
+    for item in data.get("items") or []:
+        volume_info = (item or {}).get("volumeInfo") or {}
+        if volume_info.get("title"):
+            candidates.append(_parse_google_books_volume(volume_info))
+    return candidates
+
+
+def _fetch_book_info_google_books_internal(keyword: str, debug: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Google Books APIからキーワードに最も近い1冊の書誌情報を取得する（内部関数、リトライなし）
+    
+    同じ問い合わせで上位GOOGLE_BOOKS_CANDIDATES件を取得し、"candidates"に入れて返す
+    （画面で別の候補に切り替えても再度問い合わせずに済む）。
+    """
+    try:
+        params = build_google_books_params(keyword)
+        
+        url = f"{GOOGLE_BOOKS_API_URL}?{urllib.parse.urlencode(params)}"
+        if debug:
+            print(f"[DEBUG] Google Books API URL: {url}")
+
+        # Google Books が組織プロキシで遮断される環境があるため、
+        # セッションで trust_env をオフにしてプロキシ設定を無効化
+        session = open_http_session(GOOGLE_BOOKS_API_URL, trust_env=False)
+
+        with request_phase("google_books", "volumes", TIMEOUT_MEDIUM) as timeout:
+            res = session.get(
+                GOOGLE_BOOKS_API_URL,
+                params=params,
+                headers=GOOGLE_BOOKS_HEADERS,
+                timeout=timeout,
+            )
+        
+        if debug:
+            print(f"[DEBUG] Response status: {res.status_code} ({res.headers.get('Content-Encoding', 'identity')})")
+        
+        res.raise_for_status()
+        with tracing.span("decode", site="google_books", step="volumes"):
+            data = res.json()
+        candidates = _parse_google_books_candidates(data)
+        if not candidates:
+            if debug:
+                print(f"[DEBUG] No items found for keyword: {keyword}")
+            return None
+
+        # 最も近い1冊を従来どおりトップレベルに置き、候補は"candidates"に並べる
+        result = {**candidates[0], "candidates": candidates}
+        if debug:
+            print(f"[DEBUG] Successfully fetched book: {result.get('title', 'N/A')} ({len(candidates)} candidates)")
+        return result
+    except requests.exceptions.RequestException as e:
+        print(f"[ERROR] Google Books API RequestException: {type(e).__name__}: {str(e)}")
+        if debug:
+            print(f"[DEBUG] Request URL: {GOOGLE_BOOKS_API_URL}")
+            print(f"[DEBUG] Headers: {HEADERS}")
+        raise
+    except Exception as e:
+        print(f"[ERROR] Google Books API Unexpected error: {type(e).__name__}: {str(e)}")
+        raise
+
+
+def fetch_book_info_google_books(
+    keyword: str,
+    debug: bool = False,
+    notify: Optional[Callable[[str, str], None]] = None,
+    raise_errors: bool = False,
+) -> Optional[Dict[str, Any]]:
+    """
+    Google Books APIからキーワードに最も近い1冊の書誌情報を取得する（無料枠あり）
+    一時的な失敗（接続エラー・タイムアウト・429/5xx）だけをGOOGLE_BOOKS_RETRY_POLICYに従って再試行する
+    取得できた結果（「該当なし」を含む）はBookInfoStoreに保存し、期限内は（他のプロセス・再起動後も）APIを呼ばない
+    
+    Args:
+        keyword: 検索キーワード
+        debug: デバッグモード（リクエスト内容などを標準出力に出す）
+        notify: 進捗・エラーの通知先（レベル名 "info"/"success"/"warning"/"error" とメッセージを受け取る）
+        raise_errors: Trueにすると、取得できなかった場合にNoneではなくBookInfoUnavailableを送出する
+            （キャッシュする呼び出し元が「該当なし」と失敗を区別するため）
+    
+    Returns:
+        書誌情報の辞書（最も近い1冊。"candidates"に上位の候補のリストを含む）、
+        見つからない・取得できない場合はNone
+    
+    Raises:
+        DeadlineExceeded: 検索の制限時間内に取得できなかった場合（キャッシュさせないため例外にする）
+        BookInfoUnavailable: raise_errors=Trueで、通信エラー・タイムアウトなどで取得できなかった場合
+    """
+    policy = GOOGLE_BOOKS_RETRY_POLICY
+
+    def _notify(level: str, message: str) -> None:
+        if notify is not None:
+            notify(level, message)
+
+    def _fail(message: str, cause: Exception) -> None:
+        print(message)
+        _notify("error", message)
+        if raise_errors:
+            raise BookInfoUnavailable(message) from cause
+        return None
+
+    def _on_retry(attempt: int, outcome: Any, wait: float) -> None:
+        RETRIES.inc(site="google_books")
+        reason = f"HTTP {outcome.response.status_code}" if isinstance(outcome, requests.exceptions.HTTPError) else type(outcome).__name__
+        _notify("info", f"🔁 {reason}（試行 {attempt}/{policy.max_attempts}）、{wait:.1f}秒後に再試行します...")
+    
+    # 保存済み（他のプロセス・再起動前に取得したものを含む）ならAPIを呼ばない
+    store = get_book_info_store()
+    store_key = canonicalize_keyword(keyword)
+    with tracing.span("book_store", keyword=store_key) as store_span:
+        stored, book = store.lookup(store_key)
+        if not stored and store_key.isdigit():
+            # ISBNでの検索は、以前に取得した候補の本からも引ける
+            isbn_book = store.get_by_isbn(store_key)
+            if isbn_book is not None:
+                stored, book = True, {**isbn_book, "candidates": [isbn_book]}
+                BOOK_STORE_LOOKUPS.inc(result="isbn")
+        elif stored:
+            BOOK_STORE_LOOKUPS.inc(result="hit" if book is not None else "not_found")
+        if not stored:
+            BOOK_STORE_LOOKUPS.inc(result="miss")
+        store_span.set(hit=stored)
+    if stored:
+        if book is not None:
+            _notify("success", f"✅ 保存済みの書誌情報を使いました: {book.get('title', 'N/A')}")
+        else:
+            _notify("warning", f"⚠️ Google Books API: 「{keyword}」に該当する本が見つかりませんでした。（保存済みの結果）")
+        return book
+
+    _notify("info", f"🔍 Google Books API リクエスト中: {keyword}")
+    
+    try:
+        result = policy.call(lambda: _fetch_book_info_google_books_internal(keyword, debug=debug), on_retry=_on_retry)
+    except DeadlineExceeded as e:
+        if deadline_expired():
+            _notify("warning", "⏱️ Google Books API: 検索の制限時間を過ぎたため打ち切りました")
+            raise
+        error_msg = f"⏱️ Google Books API タイムアウト（再試行込みで{policy.total_timeout:.0f}秒）: {str(e)}"
+        return _fail(error_msg, e)
+    except requests.exceptions.Timeout as e:
+        error_msg = f"⏱️ Google Books API タイムアウト: {str(e)}"
+        return _fail(error_msg, e)
+    except requests.exceptions.RequestException as e:
+        error_msg = f"🌐 Google Books API リクエストエラー: {type(e).__name__}: {str(e)}"
+        return _fail(error_msg, e)
+    except Exception as e:
+        error_msg = f"❌ Google Books API 予期しないエラー: {type(e).__name__}: {str(e)}"
+        return _fail(error_msg, e)
+
+    # 取得できた結果（「該当なし」を含む）だけを保存する。エラー・タイムアウトは保存しない
+    store.put(store_key, result or None)
+    if result:
+        _notify("success", f"✅ Google Books API: 本の情報を取得しました: {result.get('title', 'N/A')}")
+        return result
+    # 本が見つからない場合
+    _notify("warning", f"⚠️ Google Books API: 「{keyword}」に該当する本が見つかりませんでした。")
+    return None
+
+
+# ============================================================================
+# 各サイトの在庫チェック関数
+# ============================================================================
+
+def check_gifu_lib(keyword: str) -> Status:
+    """
+    岐阜市立図書館の在庫チェック
+    
+    Args:
+        keyword: 検索キーワード
+    
+    Returns:
+        ステータス情報
+    """
+    adapter = SITE_ADAPTERS["gifu"]
+    try:
+        # 検索実行（セッション初期化は温め済みセッションがなければopac_search内で行う）
+        search_url = "https://www1.gifu-lib.jp/winj/opac/search-standard.do"
+        params = {
+            "txt_word": keyword,
+            "hid_word_column": "fulltext",
+            "submit_btn_searchEasy": "search"
+        }
+        with opac_search(
+            "gifu",
+            search_url,
+            params,
+            allow_redirects=True,
+            stream=True
+        ) as res:
+            # 判定（0件表現が複数あるため両方見る）
+            if "g-mediacosmos.jp" in res.url:
+                return make_status("なし", "border-ng", "❌")
+            found = scan_step(res, adapter, "search")
+        if "nohit" in found:
+            return make_status("なし", "border-ng", "❌")
+        # 0件表現がなければヒットあり（ページタイトルに関わらず結果は同じなので解析しない）
+        return make_status("あり", "border-ok", "⭕️")
+    except Exception:
+        return make_status("エラー", "border-warn", "⚠️", cacheable=False)
+
+
+def check_kani_lib(keyword: str) -> Status:
+    """
+    可児市立図書館の在庫チェック
+    
+    Args:
+        keyword: 検索キーワード
+    
+    Returns:
+        ステータス情報
+    """
+    adapter = SITE_ADAPTERS["kani"]
+    try:
+        # 検索実行（セッション初期化は温め済みセッションがなければopac_search内で行う）
+        url = "https://www.kani-lib.jp/csp/opw/OPW/OPWSRCHLIST.CSP"
+        params = {
+            "text(1)": keyword,
+            "opr(1)": "OR",
+            "DB": "LIB",
+            "PID": "OPWSRCH1",
+            "FLG": "SEARCH",
+            "MODE": "1",
+            "SORT": "-3",
+            "qual(1)": "MZALL"
+        }
+        with opac_search("kani", url, params, stream=True) as res:
+            found = scan_step(res, adapter, "search")
+        
+        # 判定
+        if "nohit" in found:
+            return make_status("なし", "border-ng", "❌")
+        elif "on_shelf" in found:
+            return make_status("在庫あり", "border-ok", "⭕️")
+        elif "on_loan" in found:
+            return make_status("貸出中", "border-warn", "⚠️")
+        return make_status("あり", "border-ok", "⭕️")
+    except Exception:
+        return make_status("エラー", "border-warn", "⚠️", cacheable=False)
+
+
+def check_sanseido(keyword: str) -> Status:
+    """
+    岐阜駅本屋の在庫チェック
+    
+    Args:
+        keyword: 検索キーワード
+    
+    Returns:
+        ステータス情報
+    """
+    adapter = SITE_ADAPTERS["sanseido"]
+    try:
+        url = "https://www.books-sanseido.jp/booksearch/BookSearchExec.action"
+        params = {
+            "shopCode": "0458",
+            "keyword": keyword,
+            "defaultShopCode": "",
+            "title": "",
+            "author": "",
+            "isbn": "",
+            "genreCode": "",
+            "search": "検索"
+        }
+        res = site_get("sanseido", "search", url, params=params, stream=True)
+        # 0件表記か在庫ありの印が見つかれば、残りの本文は読まない
+        found = scan_step(res, adapter, "search")
+
+        # 0件判定（表記ゆれ）
+        if "nohit" in found:
+            return make_status("なし", "border-ng", "❌")
+
+        # 件数（例: "<strong>1</strong>件中"）
+        total = int(found["total"][0]) if "total" in found else None
+        if total == 0:
+            return make_status("なし", "border-ng", "❌")
+
+        # 在庫（例: "在庫： ×" / "在庫： ○"）
+        if "in_stock" in found:
+            return make_status("在庫あり", "border-ok", "⭕️")
+        if "out_of_stock" in found:
+            return make_status("なし", "border-ng", "❌")
+
+        # フォールバック：ヒットはあるが在庫表現が取れない（要確認）
+        if total is not None and total > 0:
+            return make_status(f"{total}件", "border-warn", "⚠️")
+        return make_status("判定保留", "border-warn", "⚠️")
+    except Exception:
+        return make_status("エラー", "border-warn", "⚠️", cacheable=False)
+
+
+_TSUTAYA_SELECT_HREF_RE = re.compile(r"/search/result/select\?")
+
+
+def _raise_for_tsutaya_status(res: requests.Response) -> None:
+    """
+    エラーステータス（4xx/5xx）なら接続を閉じてHTTPErrorを送出する
+    
+    草叢BOOKSは3ページをたどるため、途中の失敗を「判定保留」にせず「エラー」として
+    サーキットブレーカーに数えさせる。
+    
+    Args:
+        res: レスポンス
+    
+    Raises:
+        requests.exceptions.HTTPError: ステータスが400以上の場合
+    """
+    if res.status_code >= 400:
+        res.close()
+        res.raise_for_status()
+
+
+def _extract_first_tsutaya_work_id(html: str) -> Optional[str]:
+    """
+    草叢BOOKSキーワード検索結果HTMLから1位のworkIdを抽出（販売リンク）
+    
+    Args:
+        html: HTML文字列
+    
+    Returns:
+        workId文字列、見つからない場合はNone
+    """
+    try:
+        href = get_html_parser().first_href(html, _TSUTAYA_SELECT_HREF_RE)
+        if not href:
+            return None
+        match = re.search(r"workId=(\d+)", href)
+        return match.group(1) if match else None
+    except Exception:
+        return None
+
+
+def _extract_tsutaya_product_key_from_select(work_id: str) -> Optional[str]:
+    """
+    草叢BOOKSのselectページを開き、productKey(ISBN/JAN)を抽出
+    
+    Args:
+        work_id: 作品ID
+    
+    Returns:
+        productKey文字列、見つからない場合はNone
+    
+    Raises:
+        requests.exceptions.RequestException: 接続エラー・タイムアウト・エラーステータスの場合
+    """
+    adapter = SITE_ADAPTERS["tsutaya"]
+    try:
+        select_url = "https://store-tsutaya.tsite.jp/search/result/select"
+        params = {
+            "saleType": "sell",
+            "workId": work_id,
+            "itemType": "book"
+        }
+        res = site_get(
+            "tsutaya",
+            "select",
+            select_url,
+            params=params,
+            allow_redirects=True,
+            stream=True
+        )
+        _raise_for_tsutaya_status(res)
+        # ページ内に在庫リンクがある（例: /search/result/stock?...&productKey=978...）
+        found = scan_step(res, adapter, "select")
+        if "product_key" in found:
+            return found["product_key"][0]
+        # リダイレクトURL末尾にISBNが入るケース（.../43575108/978...）
+        match2 = re.search(r"/\d+/(\d{10,13})\b", res.url)
+        return match2.group(1) if match2 else None
+    except requests.exceptions.RequestException:
+        # 通信の失敗は「見つからない」と区別し、呼び出し元でエラーにする
+        raise
+    except Exception:
+        return None
+
+
+def build_tsutaya_urls(
+    keyword: str,
+    store_keyword: str = KUSA_BOOKS_KEYWORD,
+    use_cache: bool = True
+) -> Dict[str, Any]:
+    """
+    草叢BOOKSの検索URLと在庫URLを生成
+    
+    workId・productKeyはTsutayaResolutionCacheにあればそれを使い、
+    なければ検索ページ・selectページから取得してキャッシュに保存する。
+    
+    Args:
+        keyword: 検索キーワード
+        store_keyword: 店舗検索キーワード（デフォルト: "各務原"）
+        use_cache: Falseにするとキャッシュを読まずにサイトから取り直す
+    
+    Returns:
+        検索URL、在庫URL、work_id、product_key、from_cache（両方キャッシュから得たか）を含む辞書
+    
+    Raises:
+        requests.exceptions.RequestException: 検索ページ・selectページの取得に失敗した場合
+    """
+    search_url = build_tsutaya_search_url(keyword)
+    cache = get_tsutaya_resolution_cache()
+    cache_key = canonicalize_keyword(keyword)
+    try:
+        work_id = cache.get_work_id(cache_key) if use_cache else None
+        from_cache = work_id is not None
+        if not work_id:
+            res = site_get("tsutaya", "search", search_url)
+            _raise_for_tsutaya_status(res)
+            # Content-Typeにcharsetがないと、res.textは本文全体から文字コードを推定する（apparent_encoding）
+            with tracing.span("decode", site="tsutaya", step="search") as decode_span:
+                page = res.text
+                decode_span.set(encoding=res.encoding, chars=len(page))
+            with tracing.span("parse", site="tsutaya", step="search"):
+                work_id = _extract_first_tsutaya_work_id(page)
+            if not work_id:
+                return {
+                    "search_url": search_url,
+                    "stock_url": search_url,
+                    "work_id": None,
+                    "product_key": None,
+                    "from_cache": False
+                }
+            cache.put_work_id(cache_key, work_id)
+        
+        product_key = cache.get_product_key(work_id) if use_cache else None
+        from_cache = from_cache and product_key is not None
+        if not product_key:
+            product_key = _extract_tsutaya_product_key_from_select(work_id)
+            if not product_key:
+                return {
+                    "search_url": search_url,
+                    "stock_url": search_url,
+                    "work_id": work_id,
+                    "product_key": None,
+                    "from_cache": False
+                }
+            cache.put_product_key(work_id, product_key)
+        
+        stock_url = (
+            "https://store-tsutaya.tsite.jp/search/result/stock/result"
+            f"?workId={work_id}&saleType=sell&itemType=book&productKey={product_key}"
+            f"&storeSearchKeyword={urllib.parse.quote(store_keyword)}"
+        )
+        return {
+            "search_url": search_url,
+            "stock_url": stock_url,
+            "work_id": work_id,
+            "product_key": product_key,
+            "from_cache": from_cache
+        }
+    except requests.exceptions.RequestException:
+        raise
+    except Exception:
+        return {
+            "search_url": search_url,
+            "stock_url": search_url,
+            "work_id": None,
+            "product_key": None,
+            "from_cache": False
+        }
+
+
+def _judge_tsutaya_stock(stock_url: str) -> Optional[Status]:
+    """
+    草叢BOOKSの在庫ページを開いて判定する
+    
+    Args:
+        stock_url: 在庫ページURL
+    
+    Returns:
+        ステータス情報、ページから判定できなければNone
+    
+    Raises:
+        requests.exceptions.RequestException: 在庫ページの取得に失敗した場合
+    """
+    adapter = SITE_ADAPTERS["tsutaya"]
+    res = site_get("tsutaya", "stock", stock_url, stream=True)
+    _raise_for_tsutaya_status(res)
+    found = scan_step(res, adapter, "stock")
+    if "in_stock" in found:
+        return make_status("在庫あり", "border-ok", "⭕️")
+    if "out_of_stock" in found:
+        return make_status("なし", "border-ng", "❌")
+    return None
+
+
+def check_tsutaya(
+    keyword: str,
+    store_keyword: str = KUSA_BOOKS_KEYWORD
+) -> Tuple[Status, str]:
+    """
+    草叢BOOKSの在庫チェック（1位の候補を採用）
+    
+    Args:
+        keyword: 検索キーワード
+        store_keyword: 店舗検索キーワード（デフォルト: "各務原"）
+    
+    Returns:
+        (ステータス情報, URL)のタプル（どのページの取得に失敗しても「エラー」）
+    """
+    try:
+        urls = build_tsutaya_urls(keyword, store_keyword=store_keyword)
+        # そもそも候補が取れない＝判定不可（リンクは検索ページへ）
+        if not urls.get("work_id") or not urls.get("product_key"):
+            return (
+                make_status("判定保留", "border-warn", "⚠️"),
+                urls["stock_url"]
+            )
+
+        status = _judge_tsutaya_stock(urls["stock_url"])
+        if status is None and urls.get("from_cache"):
+            # キャッシュした対応が古くなった可能性があるため、取り直して1回だけ再判定
+            get_tsutaya_resolution_cache().forget(canonicalize_keyword(keyword))
+            urls = build_tsutaya_urls(keyword, store_keyword=store_keyword, use_cache=False)
+            if not urls.get("work_id") or not urls.get("product_key"):
+                return (
+                    make_status("判定保留", "border-warn", "⚠️"),
+                    urls["stock_url"]
+                )
+            status = _judge_tsutaya_stock(urls["stock_url"])
+        if status is None:
+            return make_status("判定保留", "border-warn", "⚠️"), urls["stock_url"]
+        return status, urls["stock_url"]
+    except Exception:
+        return (
+            make_status("エラー", "border-warn", "⚠️", cacheable=False),
+            "https://store-tsutaya.tsite.jp/search/?sheader_item-search"
+        )
+
+
+def check_status(keyword: str) -> Dict[str, Status]:
+    """
+    全サイトの在庫状況をチェック（各サイトを並行して検索）
+    
+    Args:
+        keyword: 検索キーワード
+    
+    Returns:
+        各サイトのステータス情報を含む辞書（草叢BOOKSはcheck_tsutayaで別途取得）
+    """
+    futures = {
+        site: submit_search_task(run_site_check, site, keyword)
+        for site in SITE_ADAPTERS
+        if site != 'tsutaya'
+    }
+    return {site: future.result() for site, future in futures.items()}
+
+
+# ============================================================================
+# サイト定義
+# ============================================================================
+
+@dataclass(frozen=True)
+class RequestStep:
+    """
+    サイトへのリクエスト1回分の定義
+    
+    Attributes:
+        name: ステップ名（"warmup" / "search" / "select" / "stock" など）
+        markers: 判定マーカー（名前 -> 正規表現、scan_responseに渡す）
+        decisive: 見つかった時点で判定が確定するマーカー名
+    """
+
+    name: str
+    markers: Dict[str, str] = field(default_factory=dict)
+    decisive: Tuple[str, ...] = ()
+
+
+@dataclass(frozen=True)
+class SiteAdapter:
+    """
+    検索対象サイトの定義
+    
+    並行検索・結果キャッシュ・結果カードの描画はこの定義だけを見てサイトを扱うため、
+    サイトを追加するときはチェック関数とURL生成関数を書いてSITE_ADAPTERSに登録すればよい。
+    
+    Attributes:
+        key: サイトキー
+        name: 表示名
+        icon: カードのアイコン
+        check: 在庫チェック関数（ステータス情報、または(ステータス情報, URL)のタプルを返す）
+        build_url: 結果カードのリンク先URLを生成する関数
+        steps: リクエストの手順（順番どおり）
+        timeout: 1リクエストのタイムアウト秒数の上限（実際は手順ごとの最近の応答時間から決める）
+        encoding: 既知の文字コード（Content-Typeにcharsetがない場合に使う。Noneなら<meta>から判定）
+        max_parallel: このサイトへ同時に実行するチェックの上限
+        cache_ttl: 結果キャッシュのTTL秒数
+        warmup_url: 検索前にセッションCookieを取得するURL（OPACのみ）
+        retry: 各リクエストの再試行ポリシー（site_get()で使う）
+    """
+
+    key: str
+    name: str
+    icon: str
+    check: Callable[[str], Any]
+    build_url: Callable[[str], str]
+    steps: Tuple[RequestStep, ...]
+    timeout: float
+    encoding: Optional[str] = None
+    max_parallel: int = 4
+    cache_ttl: float = 10 * 60
+    warmup_url: Optional[str] = None
+    retry: RetryPolicy = SITE_RETRY_POLICY
+
+    def step(self, name: str) -> RequestStep:
+        """ステップ名からRequestStepを取得"""
+        return next(step for step in self.steps if step.name == name)
+
+
+def scan_step(res: requests.Response, adapter: SiteAdapter, step_name: str) -> Dict[str, List[str]]:
+    """
+    サイト定義のマーカーと文字コードでレスポンスを判定する
+    
+    Args:
+        res: stream=Trueで取得したレスポンス
+        adapter: サイト定義
+        step_name: ステップ名
+    
+    Returns:
+        マーカー名 -> 一致した文字列のリスト
+    """
+    step = adapter.step(step_name)
+    with tracing.span("scan", site=adapter.key, step=step_name):
+        return scan_response(res, step.markers, step.decisive, adapter.encoding)
+
+
+# 検索対象サイト（登録順に結果カードを並べる）
+SITE_ADAPTERS: Dict[str, SiteAdapter] = {
+    adapter.key: adapter
+    for adapter in (
+        SiteAdapter(
+            key="gifu",
+            name="岐阜市立図書館",
+            icon="🏢",
+            check=check_gifu_lib,
+            build_url=lambda keyword: build_gifu_url(keyword),
+            steps=(
+                RequestStep("warmup"),
+                RequestStep(
+                    "search",
+                    markers={"nohit": r"該当する資料はありません|該当するリストが存在しません"},
+                    decisive=("nohit",),
+                ),
+            ),
+            timeout=TIMEOUT_SHORT,
+            cache_ttl=30 * 60,
+            warmup_url="https://www1.gifu-lib.jp/winj/opac/top.do",
+        ),
+        SiteAdapter(
+            key="kani",
+            name="可児市立図書館",
+            icon="🌲",
+            check=check_kani_lib,
+            build_url=lambda keyword: build_kani_url(keyword),
+            steps=(
+                RequestStep("warmup"),
+                RequestStep(
+                    "search",
+                    markers={
+                        "nohit": r"該当する資料はありません|検索結果 0件",
+                        "on_shelf": r"○ 在架あり",
+                        "on_loan": r"貸出中|予約",
+                    },
+                    decisive=("nohit", "on_shelf"),
+                ),
+            ),
+            timeout=TIMEOUT_MEDIUM,
+            cache_ttl=30 * 60,
+            warmup_url="https://www.kani-lib.jp/csp/opw/OPW/OPWSRCH1.CSP?DB=LIB&MODE=1",
+        ),
+        SiteAdapter(
+            key="sanseido",
+            name="岐阜駅本屋",
+            icon="📖",
+            check=check_sanseido,
+            build_url=lambda keyword: build_sanseido_url(keyword),
+            steps=(
+                RequestStep(
+                    "search",
+                    markers={
+                        "nohit": r"検索結果[：:]0件",
+                        "total": r"<strong>\s*(\d+)\s*</strong>\s*件中",
+                        "in_stock": r"在庫：\s*([○△▲])",
+                        "out_of_stock": r"在庫：\s*×",
+                    },
+                    decisive=("nohit", "in_stock"),
+                ),
+            ),
+            timeout=TIMEOUT_SHORT,
+        ),
+        SiteAdapter(
+            key="tsutaya",
+            name="草叢BOOKS",
+            icon="☕",
+            check=check_tsutaya,
+            build_url=lambda keyword: build_tsutaya_search_url(keyword),
+            steps=(
+                RequestStep("search"),
+                RequestStep(
+                    "select",
+                    markers={"product_key": r"productKey=(\d+)"},
+                    decisive=("product_key",),
+                ),
+                RequestStep(
+                    "stock",
+                    markers={
+                        "in_stock": r"在庫あり",
+                        "out_of_stock": r"在庫なし|入荷予定は店舗にお問い合わせ下さい",
+                    },
+                    decisive=("in_stock",),
+                ),
+            ),
+            timeout=TIMEOUT_MEDIUM,
+            encoding="utf-8",
+        ),
+    )
+}
+
+
+# ============================================================================
+# 検索結果キャッシュ
+# ============================================================================
+
+class SingleFlight:
+    """
+    同じキーの取得が実行中なら、後から来た呼び出しはその完了を待って結果を共有する
+    
+    人気のタイトルが複数セッションから同時に検索されても、上流サイトへのリクエストは1回で済む。
+    例外も待っていた全員に同じものが伝わる。
+    待つ側は自分の検索の制限時間までしか待たない（先に始めた検索の締め切りが遅くても巻き込まれない）。
+    """
+
+    def __init__(self):
+        self._calls: Dict[Any, "Future[Any]"] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key: Any, fn: Callable[[], Any]) -> Any:
+        """
+        キーごとに1回だけfnを実行し、同時に来た呼び出しには同じ結果を返す
+        
+        Args:
+            key: 重複をまとめるキー（ハッシュ可能な値）
+            fn: 結果を取得する関数
+        
+        Returns:
+            fnの戻り値
+        
+        Raises:
+            DeadlineExceeded: 実行中の取得を待つうちに、呼び出し元の検索の制限時間を過ぎた場合
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self.coalesced += 1
+        if not leader:
+            remaining = deadline_remaining()
+            try:
+                return future.result(timeout=None if remaining is None else max(0.0, remaining))
+            except FuturesTimeoutError:
+                raise DeadlineExceeded("実行中の同じ取得を待つうちに検索の制限時間を過ぎました") from None
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+@shared_resource
+def get_single_flight() -> SingleFlight:
+    """
+    キャッシュの外で使う重複排除を取得（プロセス全体・全セッションで共有）
+    
+    Returns:
+        SingleFlight
+    """
+    return SingleFlight()
+
+
+class SiteResultCache:
+    """
+    サイトごとの在庫チェック結果キャッシュ（TTL + LRU + stale-while-revalidate）
+    
+    - キーは (サイトキー, canonicalize_keyword()で正規化したキーワード)
+    - TTL内はそのまま返す。TTL切れでもRESULT_CACHE_STALE_TTL以内なら古い結果を即返し、
+      バックグラウンドで取り直す
+    - 件数がmax_entriesを超えたら最も長く使われていないものから捨てる
+    - 例外・タイムアウト・一時停止から作った結果（make_statusでcacheable=False）はキャッシュしない
+    - 同じキーの取得が実行中なら、その完了を待って結果を共有する（SingleFlight）
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[Any, float]]" = OrderedDict()
+        self._refreshing: Set[Tuple[str, str]] = set()
+        self._flights = SingleFlight()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get_or_fetch(
+        self,
+        site: str,
+        keyword: str,
+        fetch: Callable[[], Any],
+        ttl: Optional[float] = None,
+        refresh: Optional[Callable[[], Any]] = None,
+    ) -> Any:
+        """
+        キャッシュから結果を返す（なければfetchを呼んで保存）
+        
+        Args:
+            site: サイトキー（書誌情報など、サイト以外の結果は任意のキー）
+            keyword: 検索キーワード
+            fetch: キャッシュにない場合に結果を取得する関数
+            ttl: キャッシュの有効秒数（省略時はSiteAdapter.cache_ttl）
+            refresh: 期限切れの結果をバックグラウンドで取り直す関数（省略時はfetch）。
+                呼び出し元の画面への通知など、検索が終わった後に動かしてはいけないものを含めないこと
+        
+        Returns:
+            在庫チェック結果
+        """
+        key = (site, canonicalize_keyword(keyword))
+        if ttl is None:
+            adapter = SITE_ADAPTERS.get(site)
+            ttl = adapter.cache_ttl if adapter else 0
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                age = time.time() - stored_at
+                if age < ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if age < ttl + RESULT_CACHE_STALE_TTL:
+                    self._entries.move_to_end(key)
+                    self.stale_hits += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        # 取り直しは今の検索の締め切り・トレースを引き継がない（空のcontextで実行する）
+                        get_search_executor().submit(contextvars.Context().run, self._refresh, key, refresh or fetch)
+                    return value
+            self.misses += 1
+        return self._flights.do(key, lambda: self._fetch_and_store(key, fetch, ttl))
+
+    def _fetch_and_store(self, key: Tuple[str, str], fetch: Callable[[], Any], ttl: float) -> Any:
+        """取得して保存する（直前に別の呼び出しが保存し終えていればそれを返す）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] < ttl:
+                return entry[0]
+        value = fetch()
+        self._store(key, value)
+        return value
+
+    def _refresh(self, key: Tuple[str, str], fetch: Callable[[], Any]) -> None:
+        """
+        バックグラウンドで結果を取り直す（新しいcontextで呼ぶ。制限時間は検索1回分を別に持つ）
+        
+        失敗しても古い結果を使い続ける。結果を待つ呼び出し元はいないため、失敗はログとメトリクスに残す。
+        """
+        _search_deadline.set(time.monotonic() + SEARCH_DEADLINE)
+        try:
+            self._store(key, fetch())
+        except Exception as e:
+            CACHE_REFRESH_FAILURES.inc(site=key[0])
+            print(f"[WARN] キャッシュの再取得に失敗しました（{key[0]} / {key[1]}）: {type(e).__name__}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key: Tuple[str, str], value: Any) -> None:
+        """キャッシュ可能な結果だけを保存し、上限を超えたら古いものを捨てる"""
+        status = value[0] if isinstance(value, tuple) else value
+        if isinstance(status, dict) and not status.get("cacheable", True):
+            return
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        ヒット率などの統計を返す
+        
+        Returns:
+            hits / stale_hits / misses / hit_ratio / coalesced / entries を含む辞書
+        """
+        with self._lock:
+            total = self.hits + self.stale_hits + self.misses
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.stale_hits) / total if total else 0.0,
+                "coalesced": self._flights.coalesced,
+                "entries": len(self._entries),
+            }
+
+
+@shared_resource
+def get_result_cache() -> SiteResultCache:
+    """
+    在庫チェック結果キャッシュを取得（プロセス全体・全セッションで共有）
+    
+    Returns:
+        SiteResultCache
+    """
+    return SiteResultCache()
+
+
+class TsutayaResolutionCache:
+    """
+    草叢BOOKSの「キーワード→workId」「workId→productKey」の対応キャッシュ
+    
+    同じタイトルなら検索ページ・selectページの結果はほぼ変わらないため、
+    対応をJSONファイルに保存して再起動後も使い回す。温まっていれば在庫ページ1回で判定できる。
+    ファイルは初回アクセス時に読み込む。更新はTSUTAYA_RESOLUTION_SAVE_DELAY秒ごとにまとめて、
+    ファイルの内容（他のプロセスが書いた対応）と合わせてから一時ファイル経由で置き換える。
+    """
+
+    def __init__(self, path: str = TSUTAYA_RESOLUTION_CACHE_PATH, ttl: float = TSUTAYA_RESOLUTION_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._work_ids: Dict[str, Tuple[str, float]] = {}
+        self._product_keys: Dict[str, Tuple[str, float]] = {}
+        # 前回の書き出し以降に更新したキーと、削除したキー -> 削除時刻（書き出すのはこの差分だけ）
+        self._changed: Dict[str, Set[str]] = {"work_ids": set(), "product_keys": set()}
+        self._forgotten: Dict[str, Dict[str, float]] = {"work_ids": {}, "product_keys": {}}
+        self._loaded = False
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # 書き出し同士を順番にする（参照・更新は待たせない）
+
+    def _tables(self) -> Dict[str, Dict[str, Tuple[str, float]]]:
+        return {"work_ids": self._work_ids, "product_keys": self._product_keys}
+
+    def _read_file(self) -> Dict[str, Dict[str, Tuple[str, float]]]:
+        """ファイルの内容を読む（ない・壊れている場合は空）"""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            return {
+                name: {k: (v[0], v[1]) for k, v in (data.get(name) or {}).items()}
+                for name in ("work_ids", "product_keys")
+            }
+        except (OSError, ValueError, TypeError, IndexError, AttributeError):
+            return {"work_ids": {}, "product_keys": {}}
+
+    def _load(self) -> None:
+        """ファイルから読み込む（ロック取得済みで呼ぶ）"""
+        if self._loaded:
+            return
+        self._loaded = True
+        for name, entries in self._read_file().items():
+            self._tables()[name].update(entries)
+
+    def _schedule_save(self) -> None:
+        """書き出しを予約する（ロック取得済みで呼ぶ。予約済みなら次の書き出しにまとめる）"""
+        if self._timer is None:
+            self._timer = threading.Timer(TSUTAYA_RESOLUTION_SAVE_DELAY, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self) -> None:
+        """
+        未保存の更新をファイルへ書き出す（書き込めない環境では何もしない）
+        
+        ファイルを読み直し、このプロセスが前回の書き出し以降に更新・削除した分だけを反映して置き換える
+        （他のプロセスが書いた対応・消した対応はそのまま残る）。このプロセスのキャッシュもファイルの内容に揃える。
+        ファイルの読み書きはロックの外で行うため、書き出し中も参照・更新は待たされない。
+        """
+        with self._save_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not any(self._changed.values()) and not any(self._forgotten.values()):
+                    return
+                updates = {
+                    name: {k: table[k] for k in self._changed[name] if k in table}
+                    for name, table in self._tables().items()
+                }
+                forgotten = {name: dict(keys) for name, keys in self._forgotten.items()}
+                for name in self._changed:
+                    self._changed[name].clear()
+                    self._forgotten[name].clear()
+
+            on_disk = self._read_file()
+            merged = {
+                name: self._merge(on_disk[name], updates[name], forgotten[name])
+                for name in ("work_ids", "product_keys")
+            }
+            try:
+                directory = os.path.dirname(self.path) or "."
+                os.makedirs(directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(merged, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"[WARN] 草叢BOOKSキャッシュを保存できませんでした: {e}")
+                return
+
+            with self._lock:
+                for name, table in self._tables().items():
+                    # 書き出し中に更新・削除された分は次の書き出しまで手元の値を優先する
+                    entries = dict(merged[name])
+                    entries.update({k: table[k] for k in self._changed[name] if k in table})
+                    for k in self._forgotten[name]:
+                        entries.pop(k, None)
+                    table.clear()
+                    table.update(entries)
+
+    @staticmethod
+    def _merge(
+        on_disk: Dict[str, Tuple[str, float]],
+        updates: Dict[str, Tuple[str, float]],
+        forgotten: Dict[str, float],
+    ) -> Dict[str, Tuple[str, float]]:
+        """ファイルの対応にこのプロセスの更新・削除を反映する（削除より後に他のプロセスが書いた対応は残す）"""
+        merged = {k: v for k, v in on_disk.items() if v[1] > forgotten.get(k, float("-inf"))}
+        for k, v in updates.items():
+            if k not in merged or merged[k][1] < v[1]:
+                merged[k] = v
+        if len(merged) > TSUTAYA_RESOLUTION_MAX_ENTRIES:
+            oldest = sorted(merged, key=lambda k: merged[k][1])
+            for k in oldest[:len(merged) - TSUTAYA_RESOLUTION_MAX_ENTRIES]:
+                del merged[k]
+        return merged
+
+    def _get(self, table: Dict[str, Tuple[str, float]], key: str) -> Optional[str]:
+        with self._lock:
+            self._load()
+            entry = table.get(key)
+            if entry is None or time.time() - entry[1] > self.ttl:
+                return None
+            return entry[0]
+
+    def _put(self, table: Dict[str, Tuple[str, float]], key: str, value: str) -> None:
+        with self._lock:
+            self._load()
+            table[key] = (value, time.time())
+            name = "work_ids" if table is self._work_ids else "product_keys"
+            self._changed[name].add(key)
+            self._forgotten[name].pop(key, None)
+            self._schedule_save()
+
+    def get_work_id(self, keyword: str) -> Optional[str]:
+        """正規化済みキーワードに対応するworkIdを返す（期限切れ・未登録はNone）"""
+        return self._get(self._work_ids, keyword)
+
+    def put_work_id(self, keyword: str, work_id: str) -> None:
+        """キーワードとworkIdの対応を保存"""
+        self._put(self._work_ids, keyword, work_id)
+
+    def get_product_key(self, work_id: str) -> Optional[str]:
+        """workIdに対応するproductKeyを返す（期限切れ・未登録はNone）"""
+        return self._get(self._product_keys, work_id)
+
+    def put_product_key(self, work_id: str, product_key: str) -> None:
+        """workIdとproductKeyの対応を保存"""
+        self._put(self._product_keys, work_id, product_key)
+
+    def forget(self, keyword: str) -> None:
+        """
+        キーワードの対応を削除（在庫ページで判定できなかったときに取り直すため）
+        
+        Args:
+            keyword: 正規化済みキーワード
+        """
+        with self._lock:
+            self._load()
+            now = time.time()
+            entry = self._work_ids.pop(keyword, None)
+            self._changed["work_ids"].discard(keyword)
+            self._forgotten["work_ids"][keyword] = now
+            if entry is not None:
+                self._product_keys.pop(entry[0], None)
+                self._changed["product_keys"].discard(entry[0])
+                self._forgotten["product_keys"][entry[0]] = now
+            self._schedule_save()
+
+
+@shared_resource
+def get_tsutaya_resolution_cache() -> TsutayaResolutionCache:
+    """
+    草叢BOOKSの商品特定キャッシュを取得（プロセス全体で共有）
+    
+    Returns:
+        TsutayaResolutionCache
+    """
+    cache = TsutayaResolutionCache()
+    # 書き出し待ちの更新を終了時に保存する
+    atexit.register(cache.flush)
+    return cache
+
+
+class BookInfoStore:
+    """
+    Google Booksの書誌情報をSQLiteに保存するストア
+    
+    正規化済みキーワード→検索結果（候補を含む。「該当なし」も短めのTTLで保存）と、
+    候補の本ごとのISBN-13/ISBN-10→書誌情報の2つの表を持つ。ISBNで検索されたときは、
+    以前に別のキーワードで取得した候補からも引ける。
+    WALモードで開くため、同じファイルを複数のワーカープロセスから同時に読み書きできる。
+    ファイルは初回アクセス時に開き、必要な行だけをその都度読む（全件をメモリには載せない）。
+    開けない・書き込めない環境では保存せず、常に未登録として扱う。
+    """
+
+    _SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS book_searches (
+            keyword TEXT PRIMARY KEY,
+            format INTEGER NOT NULL,
+            payload TEXT,
+            fetched_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS book_searches_fetched_at ON book_searches (fetched_at)",
+        """
+        CREATE TABLE IF NOT EXISTS books (
+            isbn TEXT PRIMARY KEY,
+            isbn13 TEXT,
+            isbn10 TEXT,
+            format INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS books_isbn13 ON books (isbn13)",
+        "CREATE INDEX IF NOT EXISTS books_isbn10 ON books (isbn10)",
+        "CREATE INDEX IF NOT EXISTS books_fetched_at ON books (fetched_at)",
+    )
+
+    def __init__(
+        self,
+        path: str = BOOK_STORE_PATH,
+        ttl: float = BOOK_STORE_TTL,
+        negative_ttl: float = BOOK_STORE_NEGATIVE_TTL,
+        max_entries: int = BOOK_STORE_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._conn: Optional[sqlite3.Connection] = None
+        self._disabled = not path
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        """接続を返す（初回は開いてテーブルを作る。ロック取得済みで呼ぶ。使えなければNone）"""
+        if self._conn is not None or self._disabled:
+            return self._conn
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # 他のプロセスが書き込み中なら最大5秒待つ
+            conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in self._SCHEMA:
+                conn.execute(statement)
+        except (OSError, sqlite3.Error) as e:
+            print(f"[WARN] 書誌情報の保存先を開けませんでした（保存せずに続行します）: {e}")
+            self._disabled = True
+            return None
+        self._conn = conn
+        self._prune(conn)
+        return conn
+
+    def _execute(self, sql: str, params: Tuple[Any, ...] = ()) -> List[Tuple[Any, ...]]:
+        """SQLを実行して結果の行を返す（使えない・失敗したときは空）"""
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return []
+            try:
+                return conn.execute(sql, params).fetchall()
+            except sqlite3.Error as e:
+                print(f"[WARN] 書誌情報の保存先の読み書きに失敗しました: {e}")
+                return []
+
+    def lookup(self, keyword: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """
+        キーワードの保存済みの検索結果を返す
+        
+        Args:
+            keyword: 正規化済みキーワード
+        
+        Returns:
+            (保存済みか, 書誌情報)。「該当なし」が保存されていれば (True, None)、
+            未登録・期限切れ・古い形式なら (False, None)
+        """
+        rows = self._execute(
+            "SELECT payload, fetched_at FROM book_searches WHERE keyword = ? AND format = ?",
+            (keyword, BOOK_INFO_FORMAT),
+        )
+        if not rows:
+            return False, None
+        payload, fetched_at = rows[0]
+        ttl = self.ttl if payload is not None else self.negative_ttl
+        if time.time() - fetched_at > ttl:
+            return False, None
+        return True, json.loads(payload) if payload is not None else None
+
+    def get_by_isbn(self, isbn: str) -> Optional[Dict[str, Any]]:
+        """
+        ISBN-13またはISBN-10で保存済みの本を探す
+        
+        Args:
+            isbn: ハイフンなしのISBN
+        
+        Returns:
+            書誌情報（candidatesは含まない）、見つからない・期限切れならNone
+        """
+        rows = self._execute(
+            "SELECT payload FROM books WHERE (isbn13 = ? OR isbn10 = ?) AND format = ? AND fetched_at >= ? "
+            "ORDER BY fetched_at DESC LIMIT 1",
+            (isbn, isbn, BOOK_INFO_FORMAT, time.time() - self.ttl),
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def put(self, keyword: str, book: Optional[Dict[str, Any]]) -> None:
+        """
+        検索結果を保存する（候補の本はISBNでも引けるようにする）
+        
+        Args:
+            keyword: 正規化済みキーワード
+            book: fetch_book_info_google_books()の結果（Noneなら「該当なし」として保存）
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                with conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute(
+                        "INSERT OR REPLACE INTO book_searches (keyword, format, payload, fetched_at) VALUES (?, ?, ?, ?)",
+                        (keyword, BOOK_INFO_FORMAT, json.dumps(book, ensure_ascii=False) if book is not None else None, now),
+                    )
+                    candidates = (book.get("candidates") or [book]) if book is not None else []
+                    for candidate in candidates:
+                        isbn = candidate.get("isbn13") or candidate.get("isbn10")
+                        if not isbn:
+                            continue
+                        entry = {k: v for k, v in candidate.items() if k != "candidates"}
+                        conn.execute(
+                            "INSERT OR REPLACE INTO books (isbn, isbn13, isbn10, format, payload, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+                            (isbn, candidate.get("isbn13"), candidate.get("isbn10"), BOOK_INFO_FORMAT,
+                             json.dumps(entry, ensure_ascii=False), now),
+                        )
+            except sqlite3.Error as e:
+                print(f"[WARN] 書誌情報を保存できませんでした: {e}")
+                return
+            self._puts += 1
+            if self._puts % BOOK_STORE_PRUNE_INTERVAL == 0:
+                self._prune(conn)
+
+    def forget(self, keyword: str) -> None:
+        """キーワードの保存済みの検索結果を削除する（誤った結果を取り直すため）"""
+        self._execute("DELETE FROM book_searches WHERE keyword = ?", (keyword,))
+
+    def _prune(self, conn: sqlite3.Connection) -> None:
+        """期限切れ・古い形式の行と、上限を超えた古い行を削除する（ロック取得済みで呼ぶ）"""
+        now = time.time()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    "DELETE FROM book_searches WHERE format != ? OR fetched_at < ? OR (payload IS NULL AND fetched_at < ?)",
+                    (BOOK_INFO_FORMAT, now - self.ttl, now - self.negative_ttl),
+                )
+                conn.execute("DELETE FROM books WHERE format != ? OR fetched_at < ?", (BOOK_INFO_FORMAT, now - self.ttl))
+                for table, key in (("book_searches", "keyword"), ("books", "isbn")):
+                    conn.execute(
+                        f"DELETE FROM {table} WHERE {key} IN ("
+                        f"SELECT {key} FROM {table} ORDER BY fetched_at DESC LIMIT -1 OFFSET ?)",
+                        (self.max_entries,),
+                    )
+        except sqlite3.Error as e:
+            print(f"[WARN] 書誌情報の保存先を整理できませんでした: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        """
+        保存件数を返す
+        
+        Returns:
+            {"searches": キーワードの件数, "books": 本の件数}
+        """
+        searches = self._execute("SELECT COUNT(*) FROM book_searches")
+        books = self._execute("SELECT COUNT(*) FROM books")
+        return {"searches": searches[0][0] if searches else 0, "books": books[0][0] if books else 0}
+
+
+@shared_resource
+def get_book_info_store() -> BookInfoStore:
+    """
+    書誌情報の保存先を取得（プロセス全体で共有。ファイルは他のプロセスとも共有）
+    
+    Returns:
+        BookInfoStore
+    """
+    return BookInfoStore()
+
+
+def fetch_book_info_cached(
+    keyword: str,
+    debug: bool = False,
+    notify: Optional[Callable[[str, str], None]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    書誌情報を検索結果キャッシュ経由で取得（プロセス全体・全セッションで共有）
+    
+    キャッシュするのはAPIが答えた結果（本・「該当なし」）だけで、
+    通信エラー・タイムアウトで取得できなかった場合は保存せず、次の呼び出しで取り直す。
+    同時に来た同じキーワードの取得は、実行中の1回の結果を待って共有する。
+    
+    Args:
+        keyword: 検索キーワード
+        debug: デバッグモード（キャッシュになく実際に取得する場合だけ有効）
+        notify: 進捗・エラーの通知先（fetch_book_info_google_books()と同じ）
+    
+    Returns:
+        fetch_book_info_google_books()と同じ
+    
+    Raises:
+        DeadlineExceeded: 検索の制限時間内に取得できなかった場合
+    """
+    try:
+        return get_result_cache().get_or_fetch(
+            "book",
+            keyword,
+            lambda: fetch_book_info_google_books(keyword, debug=debug, notify=notify, raise_errors=True),
+            ttl=BOOK_INFO_CACHE_TTL,
+            # バックグラウンドの取り直しは画面が閉じた後にも動くので、通知先を渡さない
+            refresh=lambda: fetch_book_info_google_books(keyword, raise_errors=True),
+        )
+    except BookInfoUnavailable:
+        return None
+
+
+class CircuitBreaker:
+    """
+    サイトごとのサーキットブレーカー
+    
+    - closed: 通常どおりチェックする。連続してfailure_threshold回エラーになったらopenへ
+    - open: チェックせず即座に「一時停止中」を返す。reset_timeout秒たったらhalf-openへ
+    - half-open: 1件だけ試しにチェックし（他は引き続き即時に返す）、成功ならclosed、失敗ならopenに戻る
+    
+    落ちているサイトのタイムアウト（温め直しを含めると最大で数十秒）を毎回待たずに済む。
+    """
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.short_circuited = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        チェックを実行してよいか判定する（half-openでは試しの1件だけ許可）
+        
+        Returns:
+            実行してよければTrue
+        """
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half-open"
+                self._probing = False
+            if self.state == "closed" or (self.state == "half-open" and not self._probing):
+                self._probing = self.state == "half-open"
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self) -> None:
+        """チェックが成功した（サイトが応答した）ことを記録する"""
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def record_cancelled(self) -> None:
+        """検索の制限時間で打ち切られた（サイトの状態は分からない）ことを記録する"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> None:
+        """チェックがエラー・タイムアウトになったことを記録する"""
+        with self._lock:
+            self.failures += 1
+            if self.state == "half-open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"⏸️ サーキットブレーカー: {self.failures}回連続のエラーで一時停止します")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        状態を返す
+        
+        Returns:
+            state / failures / short_circuited を含む辞書
+        """
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "short_circuited": self.short_circuited,
+            }
+
+
+@shared_resource
+def get_circuit_breaker(site: str) -> CircuitBreaker:
+    """
+    サイトごとのサーキットブレーカーを取得（プロセス全体・全セッションで共有）
+    
+    Args:
+        site: サイトキー
+    
+    Returns:
+        CircuitBreaker
+    """
+    return CircuitBreaker()
+
+
+def circuit_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    全サイトのサーキットブレーカーの状態を返す
+    
+    Returns:
+        サイトキー -> CircuitBreaker.stats()
+    """
+    return {site: get_circuit_breaker(site).stats() for site in SITE_ADAPTERS}
+
+
+@shared_resource
+def get_site_semaphore(site: str) -> threading.BoundedSemaphore:
+    """
+    サイトごとの同時実行数を制限するセマフォを取得（プロセス全体で共有）
+    
+    Args:
+        site: サイトキー
+    
+    Returns:
+        SiteAdapter.max_parallel個まで同時に取得できるセマフォ
+    """
+    return threading.BoundedSemaphore(SITE_ADAPTERS[site].max_parallel)
+
+
+def run_site_check(site: str, keyword: str) -> Any:
+    """
+    キャッシュを通してサイトの在庫チェックを実行する
+    
+    キャッシュにない場合のみ、サイトごとの同時実行数の上限内でチェック関数を呼ぶ。
+    サイトが連続してエラーになっている間は、チェックせずに「一時停止中」を返す。
+    検索の制限時間を過ぎて打ち切られた場合は「タイムアウト」を返す（キャッシュしない）。
+    
+    Args:
+        site: サイトキー（SITE_ADAPTERSのキー）
+        keyword: 検索キーワード
+    
+    Returns:
+        在庫チェック関数の戻り値（草叢BOOKSは(ステータス情報, URL)のタプル）
+    """
+    adapter = SITE_ADAPTERS[site]
+    breaker = get_circuit_breaker(site)
+
+    def fetch() -> Any:
+        started = time.monotonic()
+        # キャッシュにあった場合はこのスパンがない（古いキャッシュの裏での取り直しは検索の後に続く）
+        with tracing.span("check", site=site) as check_span:
+            result = check()
+            status = result[0] if isinstance(result, tuple) else result
+            check_span.set(status=status["text"])
+        SITE_RESULTS.inc(site=site, outcome=status_outcome(status))
+        SITE_CHECK_DURATION.observe(time.monotonic() - started, site=site)
+        return result
+
+    def check() -> Any:
+        if not breaker.allow():
+            return make_status("一時停止中", "border-warn", "⏸️", cacheable=False)
+        semaphore = get_site_semaphore(site)
+        remaining = deadline_remaining()
+        with tracing.span("queue", site=site):
+            acquired = semaphore.acquire(timeout=None if remaining is None else max(0.0, remaining))
+        if not acquired:
+            breaker.record_cancelled()
+            return make_status("タイムアウト", "border-warn", "⏱️", cacheable=False)
+        try:
+            result = adapter.check(keyword)
+        except BaseException:
+            breaker.record_failure()
+            raise
+        finally:
+            semaphore.release()
+        status = result[0] if isinstance(result, tuple) else result
+        # 制限時間で途中の手順が打ち切られると、草叢BOOKSなどは「判定保留」で返るためまとめて扱う
+        if status["text"] in ("エラー", "判定保留") and deadline_expired():
+            breaker.record_cancelled()
+            return make_status("タイムアウト", "border-warn", "⏱️", cacheable=False)
+        if status["text"] == "エラー":
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return result
+
+    with tracing.span(f"site:{site}", site=site, keyword=keyword) as site_span:
+        try:
+            result = get_result_cache().get_or_fetch(site, keyword, fetch)
+        except DeadlineExceeded:
+            # 別の検索が実行中の同じチェックを待つうちに、この検索の制限時間を過ぎた
+            result = make_status("タイムアウト", "border-warn", "⏱️", cacheable=False)
+        site_span.set(status=(result[0] if isinstance(result, tuple) else result)["text"])
+        return result
+
+
+# ============================================================================
+# 並行検索エンジン
+# ============================================================================
+
+# ワーカーへ引き継ぐ呼び出し元スレッドの状態（名前 -> 取得関数）
+_TASK_CONTEXT_HOOKS: Dict[str, Callable[[], Callable[[], Optional[Callable[[], None]]]]] = {}
+
+
+def register_task_context(name: str, capture: Callable[[], Callable[[], Optional[Callable[[], None]]]]) -> None:
+    """
+    ワーカースレッドへ引き継ぐ状態を登録する
+    
+    captureはタスク投入時に呼び出し元スレッドで呼ばれ、ワーカースレッドで
+    タスク実行前に呼ぶ関数を返す（例: StreamlitのScriptRunContextの付け替え）。
+    その関数が元に戻す関数を返した場合は、タスクの終了後に呼ぶ
+    （ワーカースレッドは他の検索でも使い回すため、状態を残さないようにする）。
+    同じ名前で登録し直すと置き換わる。
+    
+    Args:
+        name: 登録名
+        capture: 状態を取得し、ワーカー側で適用する関数を返す関数
+    """
+    _TASK_CONTEXT_HOOKS[name] = capture
+
+
+@shared_resource
+def get_search_executor() -> ThreadPoolExecutor:
+    """
+    検索用ワーカープールを取得（プロセス全体で共有）
+    
+    Returns:
+        ThreadPoolExecutor
+    """
+    return ThreadPoolExecutor(
+        max_workers=max(SEARCH_MAX_WORKERS, sum(a.max_parallel for a in SITE_ADAPTERS.values()) + 2),
+        thread_name_prefix="book-search",
+    )
+
+
+def submit_search_task(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> "Future[Any]":
+    """
+    ワーカープールにタスクを投入する
+    
+    呼び出し元のcontextvarsと、register_task_contextで登録された状態をワーカーに引き継ぐ。
+    
+    Args:
+        fn: 実行する関数
+        *args: 位置引数
+        **kwargs: キーワード引数
+    
+    Returns:
+        実行結果のFuture
+    """
+    appliers = [capture() for capture in list(_TASK_CONTEXT_HOOKS.values())]
+    context = contextvars.copy_context()
+
+    def run() -> Any:
+        restores = []
+        try:
+            for apply in appliers:
+                restore = apply()
+                if restore is not None:
+                    restores.append(restore)
+            return context.run(fn, *args, **kwargs)
+        finally:
+            for restore in reversed(restores):
+                restore()
+
+    return get_search_executor().submit(run)
+
+
+def _traced_book_fetch(book_fetcher: Callable[[str], Any], keyword: str) -> Any:
+    """書誌情報の取得を"book"スパンの中で実行する"""
+    with tracing.span("book", keyword=keyword) as book_span:
+        book = book_fetcher(keyword)
+        book_span.set(found=book is not None)
+        return book
+
+
+def start_search(
+    keyword: str,
+    sites: Optional[List[str]] = None,
+    book_fetcher: Optional[Callable[[str], Any]] = fetch_book_info_cached,
+    deadline: Optional[float] = None,
+) -> Dict[str, "Future[Any]"]:
+    """
+    全サイトの在庫チェックと書誌情報の取得をまとめて並行実行する
+    
+    所要時間は各サイトの合計ではなく、最も遅いサイト1つ分に近くなる。
+    締め切りは各タスクに引き継がれ、草叢BOOKSの各ページや再試行を含む全リクエストの
+    タイムアウトが残り時間に収まる。結果はiter_until_deadline()で締め切りまで待って受け取る。
+    
+    Args:
+        keyword: 検索キーワード
+        sites: 検索するサイトキー（省略時はSITE_ADAPTERSの全サイト）
+        book_fetcher: 書誌情報の取得関数（省略時はキャッシュ・保存先を通すfetch_book_info_cached。Noneなら書誌情報は取得しない）
+        deadline: 検索全体の締め切り（time.monotonic()の値。Noneなら制限なし）
+    
+    Returns:
+        サイトキー（SITE_ADAPTERSのキー + 書誌情報の"book"）ごとのFuture
+    """
+    token = _search_deadline.set(deadline)
+    try:
+        futures = {
+            site: submit_search_task(run_site_check, site, keyword)
+            for site in (sites or SITE_ADAPTERS)
+        }
+        if book_fetcher is not None:
+            futures['book'] = submit_search_task(_traced_book_fetch, book_fetcher, keyword)
+    finally:
+        _search_deadline.reset(token)
+    return futures
+
+
+def site_result_to_dict(site: str, keyword: str, result: Any) -> Dict[str, Any]:
+    """
+    在庫チェック結果をJSONにできる辞書に変換する
+    
+    Args:
+        site: サイトキー
+        keyword: 検索キーワード
+        result: 在庫チェック関数の戻り値（締め切りまでに終わらなかった場合はNone）
+    
+    Returns:
+        name / status / class / icon / url を含む辞書
+    """
+    adapter = SITE_ADAPTERS[site]
+    url = adapter.build_url(keyword)
+    if result is None:
+        result = make_status("タイムアウト", "border-warn", "⏱️", cacheable=False)
+    if isinstance(result, tuple):
+        result, url = result
+    return {
+        "name": adapter.name,
+        "status": result["text"],
+        "class": result["class"],
+        "icon": result["icon"],
+        "url": url,
+    }
+
+
+def run_search(
+    keyword: str,
+    sites: Optional[List[str]] = None,
+    include_book: bool = True,
+    deadline_seconds: Optional[float] = SEARCH_DEADLINE,
+) -> Dict[str, Any]:
+    """
+    検索を実行し、全結果が揃う（または制限時間になる）まで待ってJSONにできる辞書で返す
+    
+    Args:
+        keyword: 検索キーワード（正規化前でよい）
+        sites: 検索するサイトキー（省略時は全サイト）
+        include_book: 書誌情報も取得するか
+        deadline_seconds: 検索全体の制限時間（Noneなら制限なし）。
+            間に合わなかったサイトは「タイムアウト」、書誌情報はNoneになる
+    
+    Returns:
+        keyword / sites（サイトキー -> 結果）/ book / timed_out（間に合わなかったキー）/ elapsed_ms /
+        trace_id（tracing.BUFFERで処理の内訳を参照できる）を含む辞書
+    """
+    started = time.perf_counter()
+    keyword = canonicalize_keyword(keyword)
+    deadline = time.monotonic() + deadline_seconds if deadline_seconds is not None else None
+    with tracing.trace("search", keyword=keyword) as root:
+        futures = start_search(
+            keyword,
+            sites=sites,
+            book_fetcher=fetch_book_info_cached if include_book else None,
+            deadline=deadline,
+        )
+        done = dict(iter_until_deadline(futures, deadline))
+        timed_out = [key for key in futures if done[key] is None]
+        root.set(timed_out=timed_out)
+    book_future = done.pop('book', None)
+    return {
+        "keyword": keyword,
+        "sites": {
+            site: site_result_to_dict(site, keyword, done[site].result() if done[site] is not None else None)
+            for site in futures
+            if site != 'book'
+        },
+        # 書誌情報が制限時間で打ち切られた（DeadlineExceeded）場合も None
+        "book": book_future.result() if book_future is not None and book_future.exception() is None else None,
+        "timed_out": timed_out,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "trace_id": root.trace_id,
+    }
+
+
+# ============================================================================
+# URL生成関数
+# ============================================================================
+
+def build_gifu_url(keyword: str) -> str:
+    """
+    岐阜市立図書館の検索URLを生成
+    
+    Args:
+        keyword: 検索キーワード
+    
+    Returns:
+        URL文字列
+    """
+    params = {
+        "lang": "ja",
+        "txt_word": keyword,
+        "hid_word_column": "fulltext",
+        "submit_btn_searchEasy": "search"
+    }
+    base_url = "https://www1.gifu-lib.jp/winj/opac/search-standard.do"
+    return f"{base_url}?{urllib.parse.urlencode(params)}"
+
+
+def build_kani_url(keyword: str) -> str:
+    """
+    可児市立図書館の検索URLを生成
+    
+    Args:
+        keyword: 検索キーワード
+    
+    Returns:
+        URL文字列
+    """
+    params = {
+        "opr(1)": "OR",
+        "DB": "LIB",
+        "PID": "OPWSRCH1",
+        "FLG": "SEARCH",
+        "MODE": "1",
+        "SORT": "-3",
+        "qual(1)": "MZALL",
+        "text(1)": keyword
+    }
+    base_url = "https://www.kani-lib.jp/csp/opw/OPW/OPWSRCHLIST.CSP"
+    return f"{base_url}?{urllib.parse.urlencode(params)}"
+
+
+def build_sanseido_url(keyword: str) -> str:
+    """
+    岐阜駅本屋の検索URLを生成
+    
+    Args:
+        keyword: 検索キーワード
+    
+    Returns:
+        URL文字列
+    """
+    params = {
+        "shopCode": "0458",
+        "keyword": keyword,
+        "defaultShopCode": "",
+        "title": "",
+        "author": "",
+        "isbn": "",
+        "genreCode": "",
+        "search": "検索",
+    }
+    base_url = "https://www.books-sanseido.jp/booksearch/BookSearchExec.action"
+    return f"{base_url}?{urllib.parse.urlencode(params)}"
+
+
+def build_tsutaya_search_url(keyword: str) -> str:
+    """
+    草叢BOOKSの検索URLを生成
+    
+    Args:
+        keyword: 検索キーワード
+    
+    Returns:
+        URL文字列
+    """
+    return (
+        f"https://store-tsutaya.tsite.jp/search/result/"
+        f"?keyword={urllib.parse.quote(keyword)}&itemType=book&limit=20"
+    )
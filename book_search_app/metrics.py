@@ -0,0 +1,253 @@
+"""
+運用メトリクス（カウンター・ヒストグラム）とOpenMetrics形式での出力
+
+検索エンジン（core.py）が外部リクエストごとの応答時間・転送量・判定結果・再試行回数などを記録し、
+API（/metrics）やStreamlitの運用パネルから参照する。Prometheusからそのまま収集できる。
+外部ライブラリには依存しない。
+"""
+
+import math
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# 応答時間ヒストグラムのバケット（秒）。図書館OPACは数秒かかることがあるため上の方も細かめにする
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 20.0)
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# 型定義
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, str], float]  # (サフィックス, ラベル, 値)
+MetricFamily = Tuple[str, str, str, List[Sample]]  # (名前, 種類, 説明, サンプル)
+
+
+def _label_key(labelnames: Tuple[str, ...], labels: Dict[str, Any]) -> Labels:
+    """ラベルの辞書を、定義順に並べたハッシュ可能なタプルにする"""
+    if set(labels) != set(labelnames):
+        raise ValueError(f"ラベルが定義と一致しません: {sorted(labels)} != {sorted(labelnames)}")
+    return tuple((name, str(labels[name])) for name in labelnames)
+
+
+class Counter:
+    """単調に増えるカウンター（ラベルの組み合わせごと）"""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        """
+        カウンターを増やす
+        
+        Args:
+            amount: 増やす量（0以上）
+            **labels: ラベル（labelnamesと同じキー）
+        """
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        """ラベルの組み合わせの現在値を返す（未記録なら0）"""
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def items(self) -> List[Tuple[Dict[str, str], float]]:
+        """(ラベル, 値)の一覧を返す"""
+        with self._lock:
+            return [(dict(key), value) for key, value in self._values.items()]
+
+    def samples(self) -> List[Sample]:
+        return [("_total", labels, value) for labels, value in self.items()]
+
+
+class Histogram:
+    """値の分布（バケットごとの件数・合計・件数）をラベルの組み合わせごとに記録する"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Labels, Tuple[List[int], float, int]] = {}  # (バケット別件数, 合計, 件数)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        """
+        値を1件記録する
+        
+        Args:
+            value: 観測値（秒など）
+            **labels: ラベル（labelnamesと同じキー）
+        """
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    def summary(self, **labels: Any) -> Tuple[int, float]:
+        """ラベルの組み合わせの(件数, 合計)を返す"""
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            _, total, count = self._values.get(key) or ([], 0.0, 0)
+            return count, total
+
+    def samples(self) -> List[Sample]:
+        samples: List[Sample] = []
+        with self._lock:
+            values = [(dict(key), list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        for labels, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", {**labels, "le": repr(float(bound))}, cumulative))
+            samples.append(("_bucket", {**labels, "le": "+Inf"}, count))
+            samples.append(("_count", labels, count))
+            samples.append(("_sum", labels, total))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    メトリクスの登録先
+    
+    記録するメトリクス（Counter / Histogram）のほか、出力時に値を集める関数（collector）を登録できる。
+    キャッシュのヒット率など、既に別の場所で数えている値はcollectorで出力する。
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls: type, name: str, documentation: str, labelnames: Tuple[str, ...], **kwargs: Any) -> Any:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        """
+        カウンターを取得（なければ登録）
+        
+        Args:
+            name: メトリクス名（_totalは付けない）
+            documentation: 説明
+            labelnames: ラベル名
+        
+        Returns:
+            Counter
+        """
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        """
+        ヒストグラムを取得（なければ登録）
+        
+        Args:
+            name: メトリクス名
+            documentation: 説明
+            labelnames: ラベル名
+            buckets: バケットの上限値
+        
+        Returns:
+            Histogram
+        """
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def register_collector(self, collector: Callable[[], Iterable[MetricFamily]]) -> None:
+        """
+        出力時に呼ばれ、(名前, 種類, 説明, サンプル)を返す関数を登録する
+        
+        Args:
+            collector: メトリクスを集める関数
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self) -> List[MetricFamily]:
+        """登録されている全メトリクスを(名前, 種類, 説明, サンプル)の一覧で返す"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        families = [(m.name, m.type, m.documentation, m.samples()) for m in metrics]
+        for collector in collectors:
+            families.extend(collector())
+        return families
+
+    def render(self) -> str:
+        """
+        OpenMetrics（Prometheusのテキスト形式）で出力する
+        
+        Returns:
+            "# EOF"で終わるテキスト
+        """
+        lines: List[str] = []
+        for name, kind, documentation, samples in self.collect():
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"# HELP {name} {_escape(documentation)}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    """ラベル値・説明文のエスケープ（バックスラッシュ・ダブルクォート・改行）"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(float(value))
+    return repr(float(value))
+
+
+# プロセス全体で共有するレジストリ
+REGISTRY = MetricsRegistry()
+
+
+def render(registry: Optional[MetricsRegistry] = None) -> str:
+    """
+    レジストリの内容をOpenMetrics形式で出力する
+    
+    Args:
+        registry: 出力するレジストリ（省略時はREGISTRY）
+    
+    Returns:
+        OpenMetricsのテキスト
+    """
+    return (registry or REGISTRY).render()
@@ -0,0 +1,280 @@
+"""
+検索1回分の処理を区間（スパン）に分けて記録する軽量トレース
+
+検索ごとにトレースIDを振り、サイト・HTTPリクエスト（接続・最初の応答・本文）・文字コード判定・解析などを
+入れ子のスパンとして記録する。スパンはcontextvarsで引き継ぐため、ワーカースレッドで動くサイトの処理も
+同じトレースに入る（submit_search_taskが呼び出し元のcontextを引き継ぐ）。
+直近のトレースは件数上限付きのリングバッファに残り、JSONまたはChromeのトレースイベント形式
+（chrome://tracing / Perfetto で開ける）で書き出せる。外部ライブラリには依存しない。
+"""
+
+import contextlib
+import contextvars
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional
+
+# 保持するトレース数（0ならトレースを記録しない）
+TRACE_BUFFER_SIZE = int(os.getenv("BOOK_SEARCH_TRACE_BUFFER", "200"))
+
+_span_ids = itertools.count(1)
+
+
+class Span:
+    """処理の1区間（開始・終了時刻、親スパン、属性）"""
+
+    __slots__ = ("name", "trace", "span_id", "parent_id", "start", "end", "thread_id", "thread_name", "attrs", "error")
+
+    def __init__(self, name: str, trace: Optional["Trace"], parent_id: Optional[int], attrs: Dict[str, Any]):
+        self.name = name
+        self.trace = trace
+        self.span_id = next(_span_ids)
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        thread = threading.current_thread()
+        self.thread_id = thread.native_id or thread.ident or 0
+        self.thread_name = thread.name
+        self.attrs = attrs
+        self.error: Optional[str] = None
+
+    def set(self, **attrs: Any) -> None:
+        """属性を追加する（トレース外の空スパンでは何もしない）"""
+        if self.trace is not None:
+            self.attrs.update(attrs)
+
+    def finish(self, end: Optional[float] = None) -> None:
+        """スパンを終了する（2回目以降は無視）"""
+        if self.end is None:
+            self.end = time.perf_counter() if end is None else end
+
+    @property
+    def trace_id(self) -> Optional[str]:
+        return self.trace.trace_id if self.trace is not None else None
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        return round((self.end - self.start) * 1000, 3) if self.end is not None else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSONにできる辞書に変換する（開始はトレース開始からのミリ秒）"""
+        origin = self.trace.start if self.trace is not None else self.start
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": self.duration_ms,
+            "thread": self.thread_name,
+            "attrs": dict(self.attrs),
+            "error": self.error,
+        }
+
+
+# トレース外で使われたときに返す空のスパン（属性は記録しない）
+_NULL_SPAN = Span("", None, None, {})
+
+
+class Trace:
+    """検索1回分のスパンの集まり"""
+
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.start = time.perf_counter()
+        self.started_at = time.time()
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def snapshot(self) -> List[Span]:
+        """記録済みのスパンを返す（先頭がルートスパン）"""
+        with self._lock:
+            return list(self.spans)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        JSONにできる辞書に変換する
+        
+        Returns:
+            trace_id / name / started_at（UNIX時刻）/ duration_ms / attrs / spans を含む辞書
+        """
+        spans = self.snapshot()
+        root = spans[0] if spans else None
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": root.duration_ms if root is not None else None,
+            "attrs": dict(root.attrs) if root is not None else {},
+            "spans": [span.to_dict() for span in spans],
+        }
+
+
+class TraceBuffer:
+    """直近のトレースを件数上限付きで保持するリングバッファ（スレッドセーフ）"""
+
+    def __init__(self, maxlen: int = TRACE_BUFFER_SIZE):
+        self._traces: Deque[Trace] = deque(maxlen=max(1, maxlen))
+        self._lock = threading.Lock()
+
+    def add(self, trace: Trace) -> None:
+        with self._lock:
+            self._traces.append(trace)
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        """トレースIDで探す（バッファから押し出されていればNone）"""
+        with self._lock:
+            return next((t for t in self._traces if t.trace_id == trace_id), None)
+
+    def recent(self, limit: Optional[int] = None) -> List[Trace]:
+        """新しい順にトレースを返す"""
+        with self._lock:
+            traces = list(reversed(self._traces))
+        return traces[:limit] if limit is not None else traces
+
+    def clear(self) -> None:
+        with self._lock:
+            self._traces.clear()
+
+
+# プロセス全体で共有するバッファ
+BUFFER = TraceBuffer()
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("book_search_current_span", default=None)
+
+
+@contextlib.contextmanager
+def trace(name: str, **attrs: Any) -> Iterator[Span]:
+    """
+    新しいトレースを始め、そのルートスパンの中で処理を実行する
+    
+    トレースは開始時にバッファへ入るため、制限時間で打ち切られて後から終わった
+    ワーカーのスパンも同じトレースに追記される。
+    
+    Args:
+        name: トレース名（"search"など）
+        **attrs: ルートスパンの属性（キーワードなど）
+    
+    Yields:
+        ルートスパン（TRACE_BUFFER_SIZEが0なら空のスパン）
+    """
+    if TRACE_BUFFER_SIZE <= 0:
+        yield _NULL_SPAN
+        return
+    new_trace = Trace(name)
+    BUFFER.add(new_trace)
+    root = Span(name, new_trace, None, dict(attrs))
+    root.start = new_trace.start
+    new_trace.add(root)
+    token = _current_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        root.finish()
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Span]:
+    """
+    現在のスパンの子スパンの中で処理を実行する（トレース外なら何も記録しない）
+    
+    Args:
+        name: スパン名
+        **attrs: 属性
+    
+    Yields:
+        スパン（トレース外なら空のスパン）
+    """
+    parent = _current_span.get()
+    if parent is None or parent.trace is None:
+        yield _NULL_SPAN
+        return
+    child = Span(name, parent.trace, parent.span_id, dict(attrs))
+    parent.trace.add(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        child.finish()
+
+
+def record_span(name: str, parent: Span, start: float, end: float, **attrs: Any) -> None:
+    """
+    終わった区間を後からスパンとして記録する（本文の読み込みなど、withで囲めない処理用）
+    
+    Args:
+        name: スパン名
+        parent: 親スパン（空のスパンなら記録しない）
+        start: 開始時刻（time.perf_counter()の値）
+        end: 終了時刻（time.perf_counter()の値）
+        **attrs: 属性
+    """
+    if parent.trace is None:
+        return
+    child = Span(name, parent.trace, parent.span_id, dict(attrs))
+    child.start = start
+    child.finish(end)
+    parent.trace.add(child)
+
+
+def current_span() -> Span:
+    """現在のスパンを返す（トレース外なら空のスパン）"""
+    return _current_span.get() or _NULL_SPAN
+
+
+def current_trace_id() -> Optional[str]:
+    """現在のトレースIDを返す（トレース外ならNone）"""
+    return current_span().trace_id
+
+
+def to_chrome_trace(traces: Iterable[Trace]) -> Dict[str, Any]:
+    """
+    Chromeのトレースイベント形式（chrome://tracing / Perfetto）に変換する
+    
+    トレースごとに別プロセス（pid）として並べ、スレッドはワーカースレッドごとの行になる。
+    
+    Args:
+        traces: 書き出すトレース
+    
+    Returns:
+        {"traceEvents": [...], "displayTimeUnit": "ms"}
+    """
+    events: List[Dict[str, Any]] = []
+    for pid, item in enumerate(traces, start=1):
+        spans = item.snapshot()
+        keyword = spans[0].attrs.get("keyword") if spans else None
+        label = f"{item.name} {keyword}" if keyword else item.name
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": f"{label} [{item.trace_id}]"}})
+        threads: Dict[int, str] = {}
+        for s in spans:
+            threads.setdefault(s.thread_id, s.thread_name)
+            end = s.end if s.end is not None else s.start
+            events.append({
+                "name": s.name,
+                "cat": item.name,
+                "ph": "X",
+                "ts": round((item.started_at + (s.start - item.start)) * 1e6, 1),
+                "dur": round((end - s.start) * 1e6, 1),
+                "pid": pid,
+                "tid": s.thread_id,
+                "args": {**s.attrs, **({"error": s.error} if s.error else {}), "span_id": s.span_id, "parent_id": s.parent_id},
+            })
+        for tid, thread_name in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread_name}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
@@ -0,0 +1,52 @@
+"""
+テスト共通の設定とフィクスチャ
+
+コアはimport時に環境変数を読むため、保存先をimportより前に一時ディレクトリへ向けておく
+（テストがホームディレクトリのキャッシュを読み書きしないように）。
+"""
+
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+import pytest
+
+_WORK_DIR = tempfile.mkdtemp(prefix="book_search_test_")
+os.environ["BOOK_SEARCH_BOOK_STORE_PATH"] = ""
+os.environ["TSUTAYA_RESOLUTION_CACHE_PATH"] = os.path.join(_WORK_DIR, "tsutaya_resolution.json")
+os.environ.pop("BOOK_SEARCH_RATE_LIMITS", None)
+os.environ.pop("BOOK_SEARCH_HOST_OVERRIDES", None)
+
+from book_search_app import core  # noqa: E402
+
+
+class FakeClock:
+    """time.monotonic()とtime.sleep()の代わり（sleepは待たずに時計を進める）"""
+
+    def __init__(self, start: float = 1000.0):
+        self.now = start
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> FakeClock:
+    """コアが使う時計を差し替える（timeモジュール自体は変えない）"""
+    fake = FakeClock()
+    monkeypatch.setattr(core, "time", SimpleNamespace(
+        monotonic=fake.monotonic,
+        sleep=fake.sleep,
+        time=time.time,
+        perf_counter=time.perf_counter,
+    ))
+    return fake
@@ -0,0 +1,148 @@
+"""JSON HTTP API（api.py）のエラー応答とkeep-aliveのテスト"""
+
+import http.client
+import json
+import socket
+import threading
+
+import pytest
+
+from book_search_app import api
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = api.create_server("127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def conn(server):
+    conn = http.client.HTTPConnection(*server.server_address, timeout=5)
+    yield conn
+    conn.close()
+
+
+def _json(response: http.client.HTTPResponse):
+    return json.loads(response.read().decode("utf-8"))
+
+
+def _post_raw(server, head: bytes, body: bytes = b"") -> bytes:
+    """生のリクエストを送り、サーバーが接続を閉じるまで（または5秒）の応答をまとめて返す"""
+    with socket.create_connection(server.server_address, timeout=5) as sock:
+        sock.sendall(head + body)
+        chunks = []
+        try:
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                chunks.append(data)
+        except socket.timeout:
+            pass
+    return b"".join(chunks)
+
+
+# ============================================================================
+# エラー応答
+# ============================================================================
+
+def test_unknown_path_is_404(conn):
+    conn.request("GET", "/nope")
+    response = conn.getresponse()
+    assert response.status == 404
+    assert "不明なパス" in _json(response)["error"]
+
+
+def test_missing_keyword_is_400(conn):
+    conn.request("GET", "/search?q=%20")
+    response = conn.getresponse()
+    assert response.status == 400
+    assert "q" in _json(response)["error"]
+
+
+def test_unknown_site_is_404(conn):
+    conn.request("GET", "/sites/unknown?q=x")
+    response = conn.getresponse()
+    assert response.status == 404
+
+
+@pytest.mark.parametrize("body", [
+    b"not json",
+    b'{"keywords": "a"}',
+    b'{"keywords": ["a"], "sites": 5}',
+    b'{"keywords": ["a"], "sites": {"gifu": true}}',
+    b'{"keywords": ["a"], "sites": ["nowhere"]}',
+])
+def test_invalid_batch_body_is_400(conn, body):
+    conn.request("POST", "/batch", body=body, headers={"Content-Type": "application/json"})
+    response = conn.getresponse()
+    assert response.status == 400
+    assert "error" in _json(response)
+
+
+def test_too_many_keywords_is_413(conn):
+    body = json.dumps({"keywords": [f"k{i}" for i in range(api.API_BATCH_MAX_KEYWORDS + 1)]})
+    conn.request("POST", "/batch", body=body)
+    response = conn.getresponse()
+    assert response.status == 413
+
+
+@pytest.mark.parametrize("length, status", [
+    ("abc", 400),
+    ("-1", 400),
+    (str(api.API_MAX_BODY_BYTES + 1), 413),
+])
+def test_bad_content_length_is_rejected_and_closes(server, length, status):
+    raw = _post_raw(server, f"POST /batch HTTP/1.1\r\nHost: x\r\nContent-Length: {length}\r\n\r\n".encode())
+    head = raw.split(b"\r\n\r\n", 1)[0].decode()
+    assert head.startswith(f"HTTP/1.1 {status} ")
+    assert "Connection: close" in head
+
+
+def test_unexpected_error_is_json_500(conn, monkeypatch, capsys):
+    def broken():
+        raise RuntimeError("壊れた")
+
+    monkeypatch.setattr(api, "circuit_breaker_stats", broken)
+    conn.request("GET", "/health")
+    response = conn.getresponse()
+    assert response.status == 500
+    assert response.getheader("Connection") == "close"
+    assert "error" in _json(response)
+    assert "RuntimeError" in capsys.readouterr().err
+
+
+# ============================================================================
+# keep-alive
+# ============================================================================
+
+def test_connection_is_reused_across_requests(conn):
+    for path in ("/sites", "/nope", "/sites"):
+        conn.request("GET", path)
+        response = conn.getresponse()
+        response.read()
+        assert not response.will_close
+    conn.request("POST", "/batch", body=b'{"keywords": []}')
+    response = conn.getresponse()
+    assert response.status == 200
+    assert _json(response)["results"] == []
+    conn.request("GET", "/sites")
+    assert conn.getresponse().status == 200
+
+
+def test_unread_body_does_not_leak_into_next_request(server):
+    body = b'{"keywords": ["a"]}'
+    raw = _post_raw(
+        server,
+        b"POST /nope HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n" % len(body),
+        body + b"GET /sites HTTP/1.1\r\nHost: x\r\n\r\n",
+    )
+    assert raw.startswith(b"HTTP/1.1 404 ")
+    assert b"Connection: close" in raw
+    # 残ったボディが次のリクエストとして解釈されない（501などが続かない）
+    assert raw.count(b"HTTP/1.1 ") == 1
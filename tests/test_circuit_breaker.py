@@ -0,0 +1,123 @@
+"""サイトごとのサーキットブレーカー（CircuitBreaker）と、草叢BOOKSの通信エラーの扱いのテスト"""
+
+import pytest
+import requests
+
+from book_search_app import core
+from book_search_app.core import CircuitBreaker
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker(failure_threshold=3, reset_timeout=30)
+
+
+def _open(breaker):
+    for _ in range(breaker.failure_threshold):
+        assert breaker.allow()
+        breaker.record_failure()
+
+
+# ============================================================================
+# 状態遷移
+# ============================================================================
+
+def test_stays_closed_below_threshold(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_success_resets_consecutive_failures(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    assert breaker.failures == 1
+
+
+def test_opens_after_threshold_and_short_circuits(breaker):
+    _open(breaker)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert not breaker.allow()
+    assert breaker.stats() == {"state": "open", "failures": 3, "short_circuited": 2}
+
+
+def test_half_open_after_reset_timeout_allows_one_probe(breaker, clock):
+    _open(breaker)
+    clock.advance(29.9)
+    assert not breaker.allow()
+    clock.advance(0.1)
+    assert breaker.allow()
+    assert breaker.state == "half-open"
+    # 試しの1件が終わるまで他は通さない
+    assert not breaker.allow()
+
+
+def test_successful_probe_closes(breaker, clock):
+    _open(breaker)
+    clock.advance(30)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_for_another_timeout(breaker, clock):
+    _open(breaker)
+    clock.advance(30)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.advance(29)
+    assert not breaker.allow()
+    clock.advance(1)
+    assert breaker.allow()
+
+
+def test_cancelled_probe_frees_the_slot(breaker, clock):
+    _open(breaker)
+    clock.advance(30)
+    assert breaker.allow()
+    breaker.record_cancelled()
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+
+
+# ============================================================================
+# 草叢BOOKSの通信エラー
+# ============================================================================
+
+@pytest.fixture
+def unreachable_tsutaya(monkeypatch):
+    """草叢BOOKSへのリクエストを全て接続エラーにする（キャッシュ・ブレーカーは作り直す）"""
+    def fail(*args, **kwargs):
+        raise requests.exceptions.ConnectionError("connection refused")
+
+    monkeypatch.setattr(core, "site_get", fail)
+    core.get_circuit_breaker.clear()
+    core.get_result_cache.clear()
+    yield
+    core.get_circuit_breaker.clear()
+    core.get_result_cache.clear()
+
+
+def test_tsutaya_transport_failure_is_an_uncacheable_error(unreachable_tsutaya):
+    status, _ = core.check_tsutaya("サーキットブレーカーのテスト")
+    assert status["text"] == "エラー"
+    assert status.get("cacheable") is False
+
+
+def test_tsutaya_breaker_opens_on_transport_failures(unreachable_tsutaya):
+    for i in range(core.CIRCUIT_FAILURE_THRESHOLD):
+        status, _ = core.run_site_check("tsutaya", f"接続エラー{i}")
+        assert status["text"] == "エラー"
+    assert core.get_circuit_breaker("tsutaya").state == "open"
+    result = core.run_site_check("tsutaya", "接続エラー（停止中）")
+    status = result[0] if isinstance(result, tuple) else result
+    assert status["text"] == "一時停止中"
+    assert core.get_result_cache().stats()["entries"] == 0
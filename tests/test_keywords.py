@@ -0,0 +1,76 @@
+"""キーワード正規化（canonicalize_keyword / _normalize_isbn）のテスト"""
+
+import pytest
+
+from book_search_app.core import _normalize_isbn, canonicalize_keyword
+
+
+# ============================================================================
+# ISBN
+# ============================================================================
+
+@pytest.mark.parametrize("text, expected", [
+    ("4062748681", "9784062748681"),
+    ("4-06-274868-1", "9784062748681"),
+    ("080442957X", "9780804429573"),
+    ("0-8044-2957-x", "9780804429573"),
+])
+def test_isbn10_is_converted_to_isbn13(text, expected):
+    assert _normalize_isbn(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "9784062748681",
+    "978-4-06-274868-1",
+    "978 4 06 274868 1",
+    "ISBN978-4-06-274868-1",
+    "ISBN: 978-4-06-274868-1",
+    "isbn-13 9784062748681",
+])
+def test_isbn13_variants_lose_hyphens_and_prefix(text):
+    assert _normalize_isbn(text) == "9784062748681"
+
+
+@pytest.mark.parametrize("text", [
+    "4062748682",      # ISBN-10のチェックディジット違い
+    "9784062748680",   # ISBN-13のチェックディジット違い
+    "406274868X",
+    "97840627486",     # 桁数不足
+    "978406274868X",   # ISBN-13にXは使えない
+])
+def test_invalid_check_digits_are_not_isbn(text):
+    assert _normalize_isbn(text) is None
+
+
+def test_invalid_isbn_is_kept_as_plain_keyword():
+    assert canonicalize_keyword("978-4-06-274868-0") == "978-4-06-274868-0"
+
+
+def test_fullwidth_isbn_is_normalized():
+    assert canonicalize_keyword("ＩＳＢＮ９７８－４－０６－２７４８６８－１") == "9784062748681"
+
+
+# ============================================================================
+# NFKC・空白・記号
+# ============================================================================
+
+@pytest.mark.parametrize("text, expected", [
+    ("ﾉﾙｳｪｲの森", "ノルウェイの森"),
+    ("ＡＢＣ　１２３", "ABC 123"),
+    ("  ノルウェイ　の \t 森\n", "ノルウェイ の 森"),
+    ("1Q84 ― BOOK1", "1Q84 - BOOK1"),
+    ("Ｃ＋＋入門 〜基礎編〜", "C++入門 ~基礎編~"),
+    ("“Hello” ‘World’", "\"Hello\" 'World'"),
+])
+def test_nfkc_and_folding(text, expected):
+    assert canonicalize_keyword(text) == expected
+
+
+def test_canonical_form_is_stable():
+    once = canonicalize_keyword("　ﾉﾙｳｪｲの森　上 ")
+    assert canonicalize_keyword(once) == once
+
+
+@pytest.mark.parametrize("text", ["", "   ", "　", None])
+def test_empty_input_becomes_empty_string(text):
+    assert canonicalize_keyword(text) == ""
@@ -0,0 +1,87 @@
+"""ホストごとの送信レート制限（TokenBucket / BOOK_SEARCH_RATE_LIMITS）のテスト"""
+
+import pytest
+
+from book_search_app.core import TokenBucket, _parse_rate_limits
+
+
+# ============================================================================
+# TokenBucket
+# ============================================================================
+
+def test_burst_is_sent_without_waiting(clock):
+    bucket = TokenBucket(rate=1.0, burst=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+
+
+def test_requests_beyond_burst_are_spaced_by_rate(clock):
+    bucket = TokenBucket(rate=2.0, burst=2)
+    waits = [bucket.reserve() for _ in range(5)]
+    assert waits == pytest.approx([0.0, 0.0, 0.5, 1.0, 1.5])
+
+
+def test_tokens_refill_over_time(clock):
+    bucket = TokenBucket(rate=2.0, burst=2)
+    bucket.reserve()
+    bucket.reserve()
+    clock.advance(0.5)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.5)
+
+
+def test_idle_time_does_not_accumulate_beyond_burst(clock):
+    bucket = TokenBucket(rate=2.0, burst=2)
+    bucket.reserve()
+    clock.advance(60)
+    waits = [bucket.reserve() for _ in range(3)]
+    assert waits == pytest.approx([0.0, 0.0, 0.5])
+
+
+def test_reserve_over_max_wait_does_not_consume(clock):
+    bucket = TokenBucket(rate=1.0, burst=1)
+    bucket.reserve()
+    assert bucket.reserve(max_wait=0.5) is None
+    # 予約しなかったので、次の呼び出しは1つ目のすぐ後の枠に入る
+    assert bucket.reserve() == pytest.approx(1.0)
+    assert bucket.stats()["acquired"] == 2
+
+
+def test_acquire_sleeps_for_the_reserved_wait(clock):
+    bucket = TokenBucket(rate=4.0, burst=1)
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == pytest.approx(0.25)
+    assert clock.sleeps == [pytest.approx(0.25)]
+    stats = bucket.stats()
+    assert stats["waited"] == 1
+    assert stats["waiting"] == 0
+    assert stats["max_wait_ms"] == 250.0
+
+
+def test_burst_below_one_is_raised_to_one(clock):
+    bucket = TokenBucket(rate=1.0, burst=0)
+    assert bucket.burst == 1
+    assert [bucket.reserve(), bucket.reserve()] == pytest.approx([0.0, 1.0])
+
+
+# ============================================================================
+# BOOK_SEARCH_RATE_LIMITS
+# ============================================================================
+
+def test_parse_rate_limits():
+    limits = _parse_rate_limits("a.example=1.5:3, b.example=0.5,c.example=2.2")
+    assert limits == {"a.example": (1.5, 3), "b.example": (0.5, 1), "c.example": (2.2, 3)}
+
+
+@pytest.mark.parametrize("item", [
+    "a.example=0",
+    "a.example=-1:2",
+    "a.example=inf",
+    "a.example=nan",
+    "a.example=1:0",
+    "a.example=1:-3",
+    "a.example=fast",
+    "a.example=1:many",
+])
+def test_invalid_rate_limits_are_ignored_with_warning(item, capsys):
+    assert _parse_rate_limits(f"{item},b.example=1:1") == {"b.example": (1.0, 1)}
+    assert f"⚠️ BOOK_SEARCH_RATE_LIMITSの指定を無視しました: {item}" in capsys.readouterr().out
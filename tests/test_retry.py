@@ -0,0 +1,157 @@
+"""再試行ポリシー（RetryPolicy）のテスト"""
+
+import io
+
+import pytest
+import requests
+
+from book_search_app import core
+from book_search_app.core import DeadlineExceeded, RetryPolicy
+
+
+def _response(status: int, retry_after: str = "") -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response.raw = io.BytesIO(b"")
+    if retry_after:
+        response.headers["Retry-After"] = retry_after
+    return response
+
+
+class Attempts:
+    """呼ばれるたびに用意した結果を順に返す（例外なら送出する）1回分の試行"""
+
+    def __init__(self, *outcomes, clock=None, duration=0.0):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.clock = clock
+        self.duration = duration
+
+    def __call__(self):
+        self.calls += 1
+        if self.clock is not None:
+            self.clock.advance(self.duration)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def max_jitter(monkeypatch):
+    """ジッターを常に上限にする"""
+    monkeypatch.setattr(core.random, "uniform", lambda low, high: high)
+
+
+# ============================================================================
+# 再試行する失敗・しない失敗
+# ============================================================================
+
+def test_retries_connection_errors_until_success(clock, max_jitter):
+    ok = _response(200)
+    attempts = Attempts(requests.exceptions.ConnectionError(), requests.exceptions.ReadTimeout(), ok)
+    retried = []
+    policy = RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=4.0, total_timeout=15.0)
+    assert policy.call(attempts, on_retry=lambda n, outcome, wait: retried.append((n, wait))) is ok
+    assert attempts.calls == 3
+    assert retried == [(1, 0.5), (2, 1.0)]
+    assert clock.sleeps == [0.5, 1.0]
+
+
+def test_raises_last_error_after_max_attempts(clock, max_jitter):
+    attempts = Attempts(*[requests.exceptions.ConnectionError(f"#{i}") for i in range(3)])
+    with pytest.raises(requests.exceptions.ConnectionError, match="#2"):
+        RetryPolicy(max_attempts=3).call(attempts)
+    assert attempts.calls == 3
+
+
+def test_returns_last_retryable_response_after_max_attempts(clock, max_jitter):
+    last = _response(503)
+    attempts = Attempts(_response(502), last)
+    assert RetryPolicy(max_attempts=2).call(attempts) is last
+
+
+@pytest.mark.parametrize("outcome", [
+    _response(404),
+    _response(200),
+    ValueError("JSONではない"),
+    DeadlineExceeded("制限時間切れ"),
+])
+def test_does_not_retry_permanent_outcomes(clock, outcome):
+    attempts = Attempts(outcome, _response(200))
+    if isinstance(outcome, Exception):
+        with pytest.raises(type(outcome)):
+            RetryPolicy().call(attempts)
+    else:
+        assert RetryPolicy().call(attempts) is outcome
+    assert attempts.calls == 1
+    assert clock.sleeps == []
+
+
+# ============================================================================
+# バックオフ
+# ============================================================================
+
+def test_backoff_doubles_up_to_max_delay(max_jitter):
+    policy = RetryPolicy(base_delay=0.5, max_delay=3.0)
+    error = requests.exceptions.ConnectionError()
+    assert [policy.delay(n, error) for n in range(1, 6)] == [0.5, 1.0, 2.0, 3.0, 3.0]
+
+
+def test_backoff_is_full_jitter():
+    policy = RetryPolicy(base_delay=1.0, max_delay=8.0)
+    error = requests.exceptions.ConnectionError()
+    delays = [policy.delay(3, error) for _ in range(200)]
+    assert all(0.0 <= d <= 4.0 for d in delays)
+    assert len(set(delays)) > 1
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_retry_after_is_honoured(status):
+    assert RetryPolicy(max_delay=1.0).delay(1, _response(status, retry_after="7")) == 7.0
+
+
+def test_retry_after_is_ignored_for_other_statuses(max_jitter):
+    assert RetryPolicy(base_delay=0.5).delay(1, _response(502, retry_after="7")) == 0.5
+
+
+# ============================================================================
+# 制限時間
+# ============================================================================
+
+def test_gives_up_instead_of_waiting_past_total_timeout(clock):
+    last = _response(503, retry_after="10")
+    attempts = Attempts(last, _response(200))
+    assert RetryPolicy(max_attempts=3, total_timeout=5.0).call(attempts) is last
+    assert attempts.calls == 1
+    assert clock.sleeps == []
+
+
+def test_backoff_is_capped_by_outer_search_deadline(clock, max_jitter):
+    error = requests.exceptions.ConnectionError("最後のエラー")
+    attempts = Attempts(requests.exceptions.ConnectionError(), error, clock=clock, duration=0.4)
+    token = core._search_deadline.set(clock.now + 1.0)
+    try:
+        with pytest.raises(requests.exceptions.ConnectionError, match="最後のエラー"):
+            RetryPolicy(max_attempts=5, base_delay=0.5, total_timeout=15.0).call(attempts)
+    finally:
+        core._search_deadline.reset(token)
+    # 1回目の後は0.5秒待てるが、2回目の後の1.0秒は残り（0.2秒）を超えるので待たずに諦める
+    assert clock.sleeps == [0.5]
+    assert attempts.calls == 2
+
+
+def test_timeout_after_deadline_becomes_deadline_exceeded(clock):
+    attempts = Attempts(requests.exceptions.ReadTimeout(), clock=clock, duration=6.0)
+    with pytest.raises(DeadlineExceeded):
+        RetryPolicy(max_attempts=3, total_timeout=5.0).call(attempts)
+    assert attempts.calls == 1
+
+
+def test_call_restores_search_deadline(clock):
+    token = core._search_deadline.set(clock.now + 100)
+    try:
+        RetryPolicy(total_timeout=5.0).call(Attempts(_response(200)))
+        assert core.deadline_remaining() == pytest.approx(100)
+    finally:
+        core._search_deadline.reset(token)